@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+#---------------------------------------------------------------------------------
+#
+# Benchmark the GDL state machines (the interpreting
+# ggputils.reasoner.StateMachine, the compiled
+# ggputils.compiler.CompiledStateMachine and, if NumPy is installed,
+# ggputils.propnet.PropNetStateMachine) by running
+# random rollouts from the initial state of some standard games and
+# reporting the number of rollouts (and state updates) per second. The
+# propnet is also run in batches of --batch simultaneous rollouts.
+#
+# Usage: PYTHONPATH=../src python bench-reasoner.py [--seconds N] [game ...]
+#
+# The games are read from the test/games directory.
+#
+#---------------------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import time
+from ggputils.gdl import KnowledgeBase
+from ggputils.reasoner import StateMachine
+from ggputils.compiler import CompiledStateMachine
+
+try:
+    import numpy as np
+    from ggputils.propnet import PropNetStateMachine
+except ImportError:
+    np = None
+
+GAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test", "games")
+
+#---------------------------------------------------------------------------------
+# Engines to benchmark: name => function that takes a knowledge base and
+# returns a state machine.
+#---------------------------------------------------------------------------------
+ENGINES = [("reasoner", StateMachine), ("compiled", CompiledStateMachine)]
+if np is not None: ENGINES.append(("propnet", PropNetStateMachine))
+
+#---------------------------------------------------------------------------------
+# Run random rollouts for the given time. Returns (rollouts/s, steps/s).
+#---------------------------------------------------------------------------------
+def run_rollouts(sm, seconds, seed=0):
+    rng = random.Random(seed)
+    initial = sm.initial_state()
+    rollouts = 0
+    steps = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        state = initial
+        while not sm.is_terminal(state):
+            joint = [rng.choice(sm.legal_moves(state, r)) for r in sm.roles]
+            state = sm.next_state(state, joint)
+            steps += 1
+        rollouts += 1
+    elapsed = time.time() - start
+    return (rollouts / elapsed, steps / elapsed)
+
+#---------------------------------------------------------------------------------
+# Run batches of simultaneous propnet rollouts. Returns rollouts/s.
+#---------------------------------------------------------------------------------
+def run_batched_rollouts(sm, seconds, batch, seed=0):
+    rng = np.random.RandomState(seed)
+    initial = sm.initial_state()
+    rollouts = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        sm.random_rollouts(initial, batch, rng)
+        rollouts += batch
+    return rollouts / (time.time() - start)
+
+#-----------------------------
+# main
+#-----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="GDL reasoner rollout benchmark")
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="time to run each benchmark")
+    parser.add_argument("--batch", type=int, default=1000,
+                        help="number of simultaneous propnet rollouts")
+    parser.add_argument("games", nargs="*", default=["tictactoe", "connectfour"],
+                        help="games (in test/games) to benchmark")
+    args = parser.parse_args()
+
+    print("{0:<14} {1:<12} {2:>10} {3:>12} {4:>10}".format("game", "engine", "build",
+                                                        "rollouts/s", "steps/s"))
+    for game in args.games:
+        with open(os.path.join(GAMES_DIR, game + ".kif")) as f:
+            kb = KnowledgeBase.from_gdl(f.read())
+        for (name, factory) in ENGINES:
+            start = time.time()
+            sm = factory(kb)
+            build = time.time() - start
+            (rollouts, steps) = run_rollouts(sm, args.seconds)
+            print("{0:<14} {1:<12} {2:>9.3f}s {3:>12.1f} {4:>10.1f}".format(
+                game, name, build, rollouts, steps))
+            if name == "propnet":
+                rollouts = run_batched_rollouts(sm, args.seconds, args.batch)
+                print("{0:<14} {1:<12} {2:>10} {3:>12.1f} {4:>10}".format(
+                    game, "propnet-x{0}".format(args.batch), "", rollouts, "-"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+#---------------------------------------------------------------------------------
+#
+# Benchmark the s-expression serialiser (ggputils.utils.exp_to_sexp)
+# against the original recursive implementation. The terms are shaped
+# like the states and move lists that are serialised every turn, plus a
+# deeply nested term that the recursive version cannot handle at all.
+#
+# Also compares parsing a move list by parse/re-serialise against the
+# span based extraction (parse_actions_sexp(sexp, spans=True)).
+#
+# Usage: PYTHONPATH=../src python bench-sexp.py [--repeat N]
+#
+#---------------------------------------------------------------------------------
+
+import argparse
+import re
+import timeit
+from ggputils.utils import exp_to_sexp, parse_actions_sexp
+
+#---------------------------------------------------------------------------------
+# The original recursive implementation that is used as the baseline.
+#---------------------------------------------------------------------------------
+def exp_to_sexp_recursive(exp):
+    out = ''
+    if type(exp) == type([]):
+        out += '(' + ' '.join(exp_to_sexp_recursive(x) for x in exp) + ')'
+    elif type(exp) == type('') and re.search(r'[\s()]', exp):
+        raise ValueError(("Cannot be converted to an s-expression as a "
+                          "text element contains spaces or '(' or ')'"))
+    else:
+        out += '{0}'.format(exp)
+    return out
+
+#---------------------------------------------------------------------------------
+# Some test terms
+#---------------------------------------------------------------------------------
+def make_state(size):
+    marks = ['x', 'o', 'b']
+    return [['true', ['cell', str(i), str(j), marks[(i+j) % 3]]]
+            for i in range(size) for j in range(size)]
+
+def make_moves(num):
+    return [['mark', str(i % 8), str(i // 8)] for i in range(num)]
+
+def make_deep(depth):
+    exp = 'leaf'
+    for i in range(depth): exp = ['f', exp]
+    return exp
+
+#-----------------------------
+# main
+#-----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="exp_to_sexp benchmark")
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="number of serialisations per test")
+    args = parser.parse_args()
+
+    tests = [("state 8x8", make_state(8)),
+             ("state 32x32", make_state(32)),
+             ("moves 64", make_moves(64))]
+
+    print("{0:<14} {1:>12} {2:>12} {3:>8}".format("term", "recursive",
+                                                 "iterative", "speedup"))
+    for (name, exp) in tests:
+        assert exp_to_sexp(exp) == exp_to_sexp_recursive(exp)
+        old = timeit.timeit(lambda: exp_to_sexp_recursive(exp), number=args.repeat)
+        new = timeit.timeit(lambda: exp_to_sexp(exp), number=args.repeat)
+        print("{0:<14} {1:>11.4f}s {2:>11.4f}s {3:>7.2f}x".format(name, old, new, old/new))
+
+    deep = make_deep(100000)
+    new = timeit.timeit(lambda: exp_to_sexp(deep), number=1)
+    try:
+        exp_to_sexp_recursive(deep)
+        old = "ok"
+    except RuntimeError:
+        old = "recursion limit"
+    print("{0:<14} {1:>12} {2:>11.4f}s".format("deep 100000", old, new))
+
+    print("")
+    print("{0:<14} {1:>12} {2:>12} {3:>8}".format("actions", "parse", "spans", "speedup"))
+    for num in [2, 16, 256]:
+        sexp = exp_to_sexp(make_moves(num))
+        assert parse_actions_sexp(sexp) == parse_actions_sexp(sexp, True)
+        old = timeit.timeit(lambda: parse_actions_sexp(sexp), number=args.repeat)
+        new = timeit.timeit(lambda: parse_actions_sexp(sexp, True), number=args.repeat)
+        print("{0:<14} {1:>11.4f}s {2:>11.4f}s {3:>7.2f}x".format("moves {0}".format(num),
+                                                                 old, new, old/new))
+
+if __name__ == '__main__':
+    main()
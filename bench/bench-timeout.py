@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+#---------------------------------------------------------------------------------
+#
+# Benchmark the deadline checks of ggputils.utils.Timeout that search loops
+# poll: the cancelled flag, has_expired() and remaining(), against reading
+# the clocks directly. has_expired() and remaining() should cost about as
+# much as a time.time() call and not as much as a monotonic() call.
+#
+# Usage: PYTHONPATH=../src python bench-timeout.py [--repeat N]
+#
+#---------------------------------------------------------------------------------
+
+import argparse
+import time
+import timeit
+from ggputils.utils import Timeout, monotonic
+
+#-----------------------------
+# main
+#-----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Timeout check benchmark")
+    parser.add_argument("--repeat", type=int, default=1000000,
+                        help="number of calls per test")
+    args = parser.parse_args()
+
+    timeout = Timeout(time.time(), 3600.0)
+    tests = [("time.time()", time.time),
+             ("monotonic()", monotonic),
+             ("cancelled", lambda: timeout.cancelled),
+             ("has_expired()", timeout.has_expired),
+             ("remaining()", timeout.remaining)]
+
+    print("{0:<14} {1:>12}".format("check", "per call"))
+    for (name, check) in tests:
+        total = timeit.timeit(check, number=args.repeat)
+        print("{0:<14} {1:>10.3f}us".format(name, total * 1e6 / args.repeat))
+
+if __name__ == '__main__':
+    main()
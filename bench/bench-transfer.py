@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+#---------------------------------------------------------------------------------
+#
+# Benchmark receiving a large START message: the (simulated) transfer time
+# over a link of a given bandwidth plus the time to read, decompress and
+# parse the message, with and without gzip compression of the request body.
+# The game description is a real game padded with many extra facts, since
+# large GDL is typically large because of long lists of similar facts.
+#
+# Usage: PYTHONPATH=../src python bench-transfer.py [--facts N] [--mbits M]
+#
+#---------------------------------------------------------------------------------
+
+import argparse
+import os
+import StringIO
+import time
+import zlib
+from ggputils.gdl import GDL, strip_comments
+from ggputils.player.ggp_http_handler import _get_http_post
+
+#---------------------------------------------------------------------------------
+# The START message
+#---------------------------------------------------------------------------------
+def make_message(facts):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test",
+                        "games", "connectfour.kif")
+    with open(path) as f: gdl = strip_comments(f.read())
+    extra = " ".join("(adjacent (cell {0} {1}) (cell {2} {3}))".format(
+        i % 97, i // 97, (i + 1) % 97, i // 97) for i in range(facts))
+    return "(START match robot ({0} {1}) 60 15)".format(gdl, extra)
+
+def encode(message, encoding):
+    if encoding == "identity": return message
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return encoder.compress(message) + encoder.flush()
+
+# Read (and decompress) the body like the Handler and parse the GDL
+def receive(body, encoding):
+    environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body)),
+               'HTTP_CONTENT_ENCODING': encoding, 'wsgi.input': StringIO.StringIO(body)}
+    start = time.time()
+    message = _get_http_post(environ)
+    read = time.time() - start
+    gdl = GDL(message[message.index("(", 1) + 1:message.rindex(")", 0, -7)])
+    gdl.exp
+    return (read, time.time() - start - read)
+
+#-----------------------------
+# main
+#-----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="START message transfer benchmark")
+    parser.add_argument("--facts", type=int, default=100000,
+                        help="number of extra facts in the GDL")
+    parser.add_argument("--mbits", type=float, default=10.0,
+                        help="link bandwidth in Mbit/s")
+    args = parser.parse_args()
+
+    message = make_message(args.facts)
+    print("START message: {0:.1f} MB, link: {1} Mbit/s".format(len(message) / 1e6, args.mbits))
+    print("{0:<10} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+        "encoding", "size", "encode", "transfer", "read", "parse", "total"))
+    for encoding in ["identity", "gzip"]:
+        start = time.time()
+        body = encode(message, encoding)
+        encode_time = time.time() - start
+        transfer = len(body) * 8 / (args.mbits * 1e6)
+        (read, parse) = receive(body, encoding)
+        print("{0:<10} {1:>9.2f}M {2:>9.3f}s {3:>9.3f}s {4:>9.3f}s {5:>9.3f}s {6:>9.3f}s".format(
+            encoding, len(body) / 1e6, encode_time, transfer, read, parse,
+            transfer + read + parse))
+
+if __name__ == '__main__':
+    main()
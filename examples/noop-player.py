@@ -16,6 +16,7 @@ import logging
 import re
 import time
 from ggputils.utils import _fmt
+from ggputils.asynclog import AsyncLogHandler, MatchFileHandler
 from ggputils.player import SimplePlayer
 
 #---------------------------------------------------------------------------------
@@ -85,13 +86,18 @@ def main():
     parser.add_argument("--log-level", default="debug",
                         choices=['critical','error','warning','info','debug'],
                         help="logging level")
+    parser.add_argument("--log-dir", default=None,
+                        help="also log each match to its own file in this directory")
     parser.add_argument("--gdl-version", type=int, default=1,
                         help="The GDL version (1 or 2)")
     args = parser.parse_args()
 
-    # Some some logging
+    # Some some logging. The log records are written by a background thread
+    # so that a slow terminal or disk doesn't hold up the player.
     g_logger.setLevel(log_level(args.log_level))
-    g_logger.addHandler(logging.StreamHandler())
+    handlers = [logging.StreamHandler()]
+    if args.log_dir: handlers.append(MatchFileHandler(args.log_dir))
+    g_logger.addHandler(AsyncLogHandler(*handlers))
 
     if args.gdl_version == 1:
         SimplePlayer((args.host, args.port),
@@ -0,0 +1,245 @@
+#---------------------------------------------------------------------------------
+#
+# A persistent, on-disk store of per-game artifacts (compiled networks,
+# opening statistics, learned weights, ...). Artifacts are keyed by the game
+# hash (see ggputils.gdl.game_hash(); the Handler passes it to on_start with
+# game_hash=True) and a name, so an expensive analysis done the first time a
+# game is played can be reloaded almost instantly when it recurs:
+#
+#    store = ArtifactStore("~/.ggp-artifacts", version=3, max_bytes=1 << 30)
+#    def on_start(timeout, matchid, role, gdl, playclock, game_hash):
+#        weights = store.load_array(game_hash, "weights")
+#        if weights is None:
+#            weights = train(gdl)
+#            store.save_array(game_hash, "weights", weights)
+#
+# Storage formats:
+#
+# - arrays: NumPy .npy files, loaded with mmap (read-only, zero copy).
+# - bytes: raw files, loaded as a read-only mmap.mmap object (zero copy).
+# - objects: pickle files (for small artifacts).
+#
+# Each artifact has a JSON metadata file recording its format, size and the
+# version of the store that saved it. Artifacts saved by a different version
+# (eg. by an older compiler) are treated as missing and removed. Files are
+# written to a temporary file and renamed, so a crash never leaves a
+# partially written artifact.
+#
+# The total size of the store is capped at max_bytes. When it is exceeded the
+# least recently used artifacts (by the modification time of the metadata,
+# which is touched on each load) are evicted.
+#
+# NumPy is only required for the array artifacts.
+#
+#---------------------------------------------------------------------------------
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+from ggputils.utils import _fmt
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger(__name__)
+
+ARRAY = "array"
+BYTES = "bytes"
+OBJECT = "object"
+
+_EXTENSIONS = {ARRAY: ".npy", BYTES: ".bin", OBJECT: ".pkl"}
+_re_name = re.compile(r'^[\w.-]+$')
+
+#---------------------------------------------------------------------------------
+# ArtifactStore
+#---------------------------------------------------------------------------------
+
+class ArtifactStore(object):
+    def __init__(self, directory, version=0, max_bytes=1 << 30):
+        self._directory = os.path.abspath(os.path.expanduser(directory))
+        self._version = version
+        self._max_bytes = max_bytes
+        if not os.path.isdir(self._directory): os.makedirs(self._directory)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def version(self):
+        return self._version
+
+    #-----------------------------------------------------------------------------
+    # Save and load artifacts. The load functions return None if the
+    # artifact is missing (or is from a different version).
+    #-----------------------------------------------------------------------------
+    def save_array(self, game_hash, name, array):
+        if np is None: raise ImportError("NumPy is required for array artifacts")
+        self._save(game_hash, name, ARRAY, lambda f: np.save(f, np.ascontiguousarray(array)))
+
+    def load_array(self, game_hash, name, mmap_mode="r"):
+        path = self._lookup(game_hash, name, ARRAY)
+        if path is None: return None
+        if np is None: raise ImportError("NumPy is required for array artifacts")
+        return np.load(path, mmap_mode=mmap_mode)
+
+    def save_bytes(self, game_hash, name, data):
+        self._save(game_hash, name, BYTES, lambda f: f.write(data))
+
+    def load_bytes(self, game_hash, name):
+        path = self._lookup(game_hash, name, BYTES)
+        if path is None: return None
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size: return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def save_object(self, game_hash, name, obj):
+        self._save(game_hash, name, OBJECT,
+                   lambda f: pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL))
+
+    def load_object(self, game_hash, name):
+        path = self._lookup(game_hash, name, OBJECT)
+        if path is None: return None
+        with open(path, "rb") as f: return pickle.load(f)
+
+    #-----------------------------------------------------------------------------
+    # Queries and removal
+    #-----------------------------------------------------------------------------
+    def contains(self, game_hash, name):
+        return self._metadata(game_hash, name) is not None
+
+    def games(self):
+        return sorted(d for d in os.listdir(self._directory)
+                      if os.path.isdir(os.path.join(self._directory, d)))
+
+    def artifacts(self, game_hash):
+        directory = self._game_dir(game_hash)
+        if not os.path.isdir(directory): return []
+        return sorted(f[:-5] for f in os.listdir(directory) if f.endswith(".json"))
+
+    def total_size(self):
+        return sum(size for (atime, size, game, name) in self._entries())
+
+    def remove(self, game_hash, name):
+        self._check(game_hash, name)
+        meta_path = self._meta_path(game_hash, name)
+        for kind in _EXTENSIONS:
+            _unlink(self._data_path(game_hash, name, kind))
+        _unlink(meta_path)
+        directory = self._game_dir(game_hash)
+        if os.path.isdir(directory) and not os.listdir(directory): os.rmdir(directory)
+
+    def clear(self):
+        for game in self.games(): shutil.rmtree(os.path.join(self._directory, game))
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    def _game_dir(self, game_hash):
+        return os.path.join(self._directory, game_hash)
+
+    def _meta_path(self, game_hash, name):
+        return os.path.join(self._game_dir(game_hash), name + ".json")
+
+    def _data_path(self, game_hash, name, kind):
+        return os.path.join(self._game_dir(game_hash), name + _EXTENSIONS[kind])
+
+    def _check(self, game_hash, name):
+        if not _re_name.match(game_hash) or not _re_name.match(name) or \
+           game_hash.startswith(".") or name.startswith("."):
+            raise ValueError("Invalid artifact key: {0}/{1}".format(game_hash, name))
+
+    def _metadata(self, game_hash, name):
+        self._check(game_hash, name)
+        try:
+            with open(self._meta_path(game_hash, name)) as f: meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get("version") != self._version:
+            g_logger.info(_fmt("Removing artifact {0}/{1} from version {2}",
+                               game_hash, name, meta.get("version")))
+            self.remove(game_hash, name)
+            return None
+        return meta
+
+    def _lookup(self, game_hash, name, kind):
+        meta = self._metadata(game_hash, name)
+        if meta is None or meta.get("kind") != kind: return None
+        path = self._data_path(game_hash, name, kind)
+        if not os.path.exists(path): return None
+        try:
+            os.utime(self._meta_path(game_hash, name), None)
+        except OSError:
+            pass
+        return path
+
+    def _save(self, game_hash, name, kind, write):
+        self._check(game_hash, name)
+        if self.contains(game_hash, name): self.remove(game_hash, name)
+        directory = self._game_dir(game_hash)
+        if not os.path.isdir(directory): os.makedirs(directory)
+        path = self._data_path(game_hash, name, kind)
+        _atomic_write(directory, path, write)
+        meta = {"version": self._version, "kind": kind, "size": os.path.getsize(path),
+                "created": time.time()}
+        _atomic_write(directory, self._meta_path(game_hash, name),
+                      lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        self._evict()
+
+    # (access time, size, game, name) of each artifact
+    def _entries(self):
+        entries = []
+        for game in self.games():
+            for name in self.artifacts(game):
+                meta_path = self._meta_path(game, name)
+                try:
+                    with open(meta_path) as f: meta = json.load(f)
+                    entries.append((os.path.getmtime(meta_path), meta.get("size", 0),
+                                    game, name))
+                except (IOError, OSError, ValueError):
+                    continue
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        if total <= self._max_bytes: return
+        for (atime, size, game, name) in sorted(entries):
+            if total <= self._max_bytes: break
+            g_logger.info(_fmt("Evicting artifact {0}/{1} ({2} bytes)", game, name, size))
+            self.remove(game, name)
+            total -= size
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+def _atomic_write(directory, path, write):
+    (fd, tmp) = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f: write(f)
+        os.rename(tmp, path)
+    except:
+        _unlink(tmp)
+        raise
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
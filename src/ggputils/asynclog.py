@@ -0,0 +1,217 @@
+#---------------------------------------------------------------------------------
+#
+# Non-blocking logging for players. Writing log records to a terminal, a pipe
+# or a slow disk from the gevent event loop eats into the play clock, so
+# AsyncLogHandler only appends each record to a queue and a background thread
+# passes them on to the real handlers. The records are not formatted when they
+# are logged, so with messages built with ggputils.utils._fmt (BraceMessage)
+# even the string formatting happens in the background thread. Note: this
+# means that the arguments of a message are formatted later, so they should
+# not be modified after they are logged.
+#
+# MatchFileHandler writes the records of each match to its own rotating log
+# file, <directory>/<matchid>.log. The Handler sets the current match at
+# START (see set_current_match()) and each record is tagged with it when it is
+# logged. Records logged outside a match go to <directory>/<default>.log.
+#
+# For example:
+#
+#    handler = AsyncLogHandler(MatchFileHandler("logs"), logging.StreamHandler())
+#    logging.getLogger().addHandler(handler)
+#    ...
+#    handler.close()     # flushes the queue
+#
+# The queue is bounded (maxsize records). When it is full records are dropped
+# rather than blocking the caller and are counted in the handler's dropped
+# attribute.
+#
+# The background writer is a real OS thread even when gevent has monkey
+# patched the standard library, since otherwise it would just be another
+# greenlet writing from the event loop. It blocks until records are queued
+# (on a real lock that emit() releases) rather than polling; a Python 2
+# Queue.get() with a timeout polls internally and under monkey patching
+# would block on a gevent lock.
+#
+# flush() waits until the records queued before it was called have been
+# written. In a greenlet it polls with gevent.sleep() (every interval / 10
+# seconds) so that the other greenlets keep running, otherwise it blocks on
+# a real lock that the writer releases each time the queue is empty.
+#
+# The Handler clears the current match at STOP and ABORT, so records logged
+# between matches go to the default file.
+#
+#---------------------------------------------------------------------------------
+
+import collections
+import logging
+import logging.handlers
+import os
+import re
+import sys
+from ggputils.utils import _original, _THREAD
+
+#---------------------------------------------------------------------------------
+# The current match
+#---------------------------------------------------------------------------------
+_current_match = None
+
+def set_current_match(matchid):
+    global _current_match
+    _current_match = matchid
+
+def current_match():
+    return _current_match
+
+#---------------------------------------------------------------------------------
+# AsyncLogHandler passes records to other handlers in a background thread.
+#---------------------------------------------------------------------------------
+
+class AsyncLogHandler(logging.Handler):
+    def __init__(self, *handlers, **kwargs):
+        logging.Handler.__init__(self, kwargs.get("level", logging.NOTSET))
+        self._handlers = list(handlers)
+        self._maxsize = kwargs.get("maxsize", 10000)
+        self._interval = kwargs.get("interval", 0.05)
+        self._queue = collections.deque()
+        self._running = True
+        self.dropped = 0
+        self._queued = 0
+        self._written = 0
+        allocate_lock = _original(_THREAD, "allocate_lock")
+        self._done = allocate_lock()
+        self._done.acquire()
+        self._wakeup = allocate_lock()
+        self._wakeup.acquire()
+        self._drained = allocate_lock()
+        self._drained.acquire()
+        _original(_THREAD, "start_new_thread")(self._run, ())
+
+    @property
+    def handlers(self):
+        return self._handlers
+
+    def __len__(self):
+        return len(self._queue)
+
+    #-----------------------------------------------------------------------------
+    # Called by the logging module: tag the record with the current match and
+    # queue it. Nothing is formatted here.
+    #-----------------------------------------------------------------------------
+    def emit(self, record):
+        if len(self._queue) >= self._maxsize or not self._running:
+            self.dropped += 1
+            return
+        if not hasattr(record, "matchid"): record.matchid = _current_match
+        self._queued += 1
+        self._queue.append(record)
+        self._wake()
+
+    #-----------------------------------------------------------------------------
+    # Wait for the queued records to be written and stop the background thread.
+    #-----------------------------------------------------------------------------
+    def close(self):
+        if self._running:
+            self._running = False
+            self._wake()
+            self._done.acquire()
+            self._done.release()
+            for handler in self._handlers: handler.close()
+        logging.Handler.close(self)
+
+    def flush(self):
+        target = self._queued
+        sleep = _greenlet_sleep()
+        while self._written < target and self._running:
+            if sleep is not None: sleep(self._interval / 10.0)
+            else: self._drained.acquire()
+        _release(self._drained)    # Pass the wakeup on to any other flush()
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    def _wake(self):
+        _release(self._wakeup)
+
+    def _run(self):
+        queue = self._queue
+        try:
+            while True:
+                self._wakeup.acquire()
+                while queue:
+                    record = queue.popleft()
+                    for handler in self._handlers:
+                        if record.levelno < handler.level: continue
+                        try:
+                            handler.handle(record)
+                        except Exception:
+                            handler.handleError(record)
+                    self._written += 1
+                _release(self._drained)
+                if not self._running and not queue: break
+        finally:
+            _release(self._drained)
+            self._done.release()
+
+# Release a lock that may already be released
+def _release(lock):
+    try:
+        lock.release()
+    except Exception:
+        pass
+
+# gevent.sleep() when called from a greenlet (other than the hub), so that
+# waiting does not block the event loop, otherwise None.
+def _greenlet_sleep():
+    hub = sys.modules.get("gevent.hub")
+    if hub is None: return None
+    current = hub.getcurrent()
+    if current.parent is None or current is hub.get_hub(): return None
+    return hub.sleep
+
+#---------------------------------------------------------------------------------
+# MatchFileHandler writes the records of each match to its own rotating file.
+# Only the files of the max_open most recent matches are kept open.
+#---------------------------------------------------------------------------------
+_re_unsafe = re.compile(r'[^\w.-]')
+
+class MatchFileHandler(logging.Handler):
+    def __init__(self, directory, max_bytes=1 << 20, backup_count=3, default="ggp",
+                 max_open=2, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self._directory = os.path.abspath(os.path.expanduser(directory))
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._default = default
+        self._max_open = max(max_open, 1)
+        self._files = collections.OrderedDict()
+        if not os.path.isdir(self._directory): os.makedirs(self._directory)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    # The log file of a match (or of the records outside a match for None)
+    def filename(self, matchid):
+        name = _re_unsafe.sub("_", matchid) if matchid else self._default
+        return os.path.join(self._directory, name + ".log")
+
+    def emit(self, record):
+        handler = self._handler(getattr(record, "matchid", None))
+        if self.formatter: handler.setFormatter(self.formatter)
+        handler.emit(record)
+
+    def close(self):
+        for handler in self._files.values(): handler.close()
+        self._files.clear()
+        logging.Handler.close(self)
+
+    def _handler(self, matchid):
+        path = self.filename(matchid)
+        handler = self._files.pop(path, None)
+        if handler is None:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=self._max_bytes, backupCount=self._backup_count)
+            while len(self._files) >= self._max_open:
+                self._files.popitem(last=False)[1].close()
+        self._files[path] = handler
+        return handler
@@ -0,0 +1,217 @@
+#---------------------------------------------------------------------------------
+#
+# A GDL rule compiler. Each rule of a knowledge base is translated into a
+# Python function that joins its body with nested loops, in the join order
+# fixed by ggputils.reasoner.PreparedRule, with the rule variables held in
+# local variables and the unification against each candidate fact unrolled
+# into straight-line comparisons. For example:
+#
+#    (<= (legal ?r (mark ?x ?y)) (true (control ?r)) (true (cell ?x ?y b)))
+#
+# becomes (roughly):
+#
+#    def rule_12(store, add, delta_pos, delta):
+#        r0 = delta if delta_pos == 0 else store.get(('true', 1), _EMPTY)
+#        for a0 in r0.tuples:
+#            t0 = a0[0]
+#            if type(t0) is not tuple or len(t0) != 2: continue
+#            if t0[0] != 'control': continue
+#            v0 = t0[1]
+#            ...
+#                add((v0, ('mark', v1, v2)))
+#
+# The generated source of a game can be inspected with
+# compile_rules(kb).source. The compiled rules are cached by the game hash
+# (ggputils.gdl.KnowledgeBase.hash) so a game that is played repeatedly is
+# only compiled once.
+#
+# CompiledReasoner is a drop-in replacement for the interpreting Reasoner and
+# CompiledStateMachine a StateMachine that uses it. Rules that can't be
+# compiled (eg. that are too deeply nested for Python) fall back to the
+# interpreter.
+#
+#---------------------------------------------------------------------------------
+
+import logging
+from ggputils.utils import exp_to_sexp, _fmt
+from ggputils.gdl import KnowledgeBase
+from ggputils.reasoner import Reasoner, StateMachine, PreparedRule, \
+    _REL, _NOT, _DISTINCT, _EMPTY, _slots
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger(__name__)
+
+# The compiled rules of the most recently used games
+_CACHE_SIZE = 16
+_cache = {}
+
+#---------------------------------------------------------------------------------
+# CompiledRules holds the generated source and functions for the rules of a
+# knowledge base.
+#---------------------------------------------------------------------------------
+
+class CompiledRules(object):
+    def __init__(self, kb):
+        self._hash = kb.hash
+        self._names = {}
+        chunks = []
+        failed = []
+        for key in sorted(kb.relations()):
+            for rule in kb.rules(key):
+                text = _rule_text(rule)
+                if text in self._names or text in failed: continue
+                name = "rule_{0}".format(len(self._names) + len(failed))
+                try:
+                    chunk = _generate(PreparedRule(rule), name)
+                    compile(chunk, "<gdl>", "exec")
+                except (ValueError, SyntaxError) as e:
+                    g_logger.debug(_fmt("Interpreting rule {0}: {1}", text, e))
+                    failed.append(text)
+                    continue
+                self._names[text] = name
+                chunks.append(chunk)
+        self._source = "\n".join(chunks)
+        self._namespace = {"_EMPTY": _EMPTY}
+        code = compile(self._source, "<gdl-rules {0}>".format(self._hash), "exec")
+        exec(code, self._namespace)
+
+    @property
+    def hash(self):
+        return self._hash
+
+    @property
+    def source(self):
+        return self._source
+
+    # The compiled function of a rule or None if the rule wasn't compiled
+    def function(self, rule):
+        name = self._names.get(_rule_text(rule))
+        if name is None: return None
+        return self._namespace[name]
+
+    def __len__(self):
+        return len(self._names)
+
+#---------------------------------------------------------------------------------
+# Return the (cached) compiled rules of a knowledge base.
+#---------------------------------------------------------------------------------
+
+def compile_rules(kb):
+    compiled = _cache.get(kb.hash)
+    if compiled is None:
+        compiled = CompiledRules(kb)
+        if len(_cache) >= _CACHE_SIZE: _cache.clear()
+        _cache[kb.hash] = compiled
+    return compiled
+
+def clear_cache():
+    _cache.clear()
+
+#---------------------------------------------------------------------------------
+# CompiledReasoner evaluates the rules with their compiled functions.
+#---------------------------------------------------------------------------------
+
+class CompiledReasoner(Reasoner):
+    def __init__(self, kb):
+        self._compiled = compile_rules(kb)
+        Reasoner.__init__(self, kb)
+
+    @property
+    def compiled(self):
+        return self._compiled
+
+    def _prepare(self, rule):
+        prepared = PreparedRule(rule)
+        prepared.function = self._compiled.function(rule)
+        return prepared
+
+    def _fire(self, rule, store, add, delta_pos=-1, delta=None):
+        function = getattr(rule, "function", None)
+        if function is None:
+            return Reasoner._fire(self, rule, store, add, delta_pos, delta)
+        function(store, add, delta_pos, delta)
+
+class CompiledStateMachine(StateMachine):
+    def __init__(self, kb, cache_size=1024):
+        if not isinstance(kb, KnowledgeBase): kb = KnowledgeBase.from_gdl(kb)
+        StateMachine.__init__(self, kb, cache_size, CompiledReasoner(kb))
+
+#---------------------------------------------------------------------------------
+# Code generation
+#---------------------------------------------------------------------------------
+
+def _rule_text(rule):
+    return exp_to_sexp(["<=", rule.head] + rule.body)
+
+class _Writer(object):
+    def __init__(self):
+        self.lines = []
+        self.indent = 1
+        self.temps = 0
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def temp(self):
+        name = "t{0}".format(self.temps)
+        self.temps += 1
+        return name
+
+def _generate(prepared, name):
+    out = _Writer()
+    out.lines.append("# {0}".format(_rule_text(prepared.rule).replace("\n", " ")))
+    out.lines.append("def {0}(store, add, delta_pos, delta):".format(name))
+    out.emit("get = store.get")
+    bound = set()
+    for (i, op) in enumerate(prepared.body):
+        if op[0] == _REL:
+            (_, key, pats, positions, steps, new_slots) = op
+            out.emit("r{0} = delta if delta_pos == {0} else get({1!r}, _EMPTY)".format(i, key))
+            if positions:
+                lookup = "r{0}.lookup({1!r}, {2})".format(
+                    i, positions, _tuple_expr([pats[p] for p in positions]))
+            else:
+                lookup = "r{0}.tuples".format(i)
+            out.emit("for a{0} in {1}:".format(i, lookup))
+            out.indent += 1
+            for (pos, pat, direct) in steps:
+                _match(out, pat, "a{0}[{1}]".format(i, pos), bound)
+        elif op[0] == _NOT:
+            (_, key, pats) = op
+            out.emit("if {0} not in get({1!r}, _EMPTY):".format(_tuple_expr(pats), key))
+            out.indent += 1
+        else:
+            (_, _, (p1, p2)) = op
+            out.emit("if {0} != {1}:".format(_expr(p1), _expr(p2)))
+            out.indent += 1
+    out.emit("add({0})".format(_tuple_expr(prepared.head)))
+    return "\n".join(out.lines) + "\n"
+
+# Generate the code to match a pattern against the value of an expression
+# (within the loop over the candidate facts).
+def _match(out, pattern, expr, bound):
+    if type(pattern) == int and pattern not in bound:
+        out.emit("v{0} = {1}".format(pattern, expr))
+        bound.add(pattern)
+    elif _slots([pattern]) <= bound:
+        out.emit("if {0} != {1}: continue".format(expr, _expr(pattern)))
+    else:
+        temp = out.temp()
+        out.emit("{0} = {1}".format(temp, expr))
+        out.emit("if type({0}) is not tuple or len({0}) != {1}: continue".format(
+            temp, len(pattern)))
+        for (i, p) in enumerate(pattern):
+            _match(out, p, "{0}[{1}]".format(temp, i), bound)
+
+# The expression for a pattern with its variables substituted
+def _expr(pattern):
+    if type(pattern) == int: return "v{0}".format(pattern)
+    if type(pattern) == str: return repr(pattern)
+    return _tuple_expr(pattern)
+
+def _tuple_expr(patterns):
+    items = [_expr(p) for p in patterns]
+    if len(items) == 1: return "({0},)".format(items[0])
+    return "({0})".format(", ".join(items))
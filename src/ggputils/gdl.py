@@ -0,0 +1,505 @@
+#---------------------------------------------------------------------------------
+#
+# An indexed GDL knowledge base. It is built once from a (parsed) game
+# description and holds:
+#
+# - the roles in the order they appear in the GDL,
+# - the facts and rules indexed by the name and arity of their head, so
+#   that, for example, kb.rules("legal", 2) or kb.facts("init", 1) are
+#   simple dictionary lookups,
+# - the relation dependency graph and its stratification.
+#
+# The GDL class wraps the game description text with lazily computed views
+# (roles, tokens, parse, predicate index, knowledge base and hash).
+#
+# Sentences are kept as parsed expressions (see ggputils.utils.parse_simple_sexp)
+# except that the GDL keywords (role, true, does, distinct, not, or, <=, ...)
+# are converted to lower case. Other symbols are left unchanged. Disjunctions
+# in rule bodies are expanded into multiple rules, so a rule body is a list of
+# literals each of which is either an atom, (not <literal>), (distinct x y),
+# or a relation (true/does included).
+#
+# Relations are identified by a (name, arity) pair; eg. ("legal", 2) and
+# ("terminal", 0). The KnowledgeBase queries take a name and an arity, a
+# (name, arity) pair, or a bare name for the relations of every arity with
+# that name (so kb.rules("legal") is the same as kb.rules("legal", 2) in a
+# game that only has a legal/2 relation).
+#
+#---------------------------------------------------------------------------------
+
+import re
+import hashlib
+from ggputils.utils import parse_simple_sexp, exp_to_sexp, split_sexp_sequence
+
+#---------------------------------------------------------------------------------
+# GDL keywords and relations
+#---------------------------------------------------------------------------------
+
+ROLE = ("role", 1)
+INIT = ("init", 1)
+TRUE = ("true", 1)
+NEXT = ("next", 1)
+LEGAL = ("legal", 2)
+DOES = ("does", 2)
+GOAL = ("goal", 2)
+TERMINAL = ("terminal", 0)
+BASE = ("base", 1)
+INPUT = ("input", 2)
+SEES = ("sees", 2)
+
+KEYWORDS = frozenset(["role", "init", "true", "next", "legal", "does", "goal",
+                      "terminal", "base", "input", "sees", "distinct", "not",
+                      "or", "<=", "random"])
+
+#---------------------------------------------------------------------------------
+# Helper functions for GDL expressions.
+#---------------------------------------------------------------------------------
+
+def is_variable(term):
+    return type(term) == str and term.startswith("?")
+
+def relation(literal):
+    if type(literal) == list: return (literal[0], len(literal) - 1)
+    return (literal, 0)
+
+def is_ground(term):
+    if type(term) != list: return not is_variable(term)
+    stack = [term]
+    while stack:
+        for x in stack.pop():
+            if type(x) == list: stack.append(x)
+            elif is_variable(x): return False
+    return True
+
+def variables(term, out=None):
+    if out is None: out = []
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if type(t) == list: stack.extend(reversed(t))
+        elif is_variable(t) and t not in out: out.append(t)
+    return out
+
+#---------------------------------------------------------------------------------
+# A rule (or a fact when the body is empty).
+#---------------------------------------------------------------------------------
+
+class Rule(object):
+    __slots__ = ("head", "body")
+
+    def __init__(self, head, body=()):
+        self.head = head
+        self.body = list(body)
+
+    @property
+    def relation(self):
+        return relation(self.head)
+
+    def is_fact(self):
+        return not self.body
+
+    def __eq__(self, other):
+        return isinstance(other, Rule) and \
+            self.head == other.head and self.body == other.body
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Rule({0!r}, {1!r})".format(self.head, self.body)
+
+#---------------------------------------------------------------------------------
+# KnowledgeBase
+#---------------------------------------------------------------------------------
+
+class KnowledgeBase(object):
+    def __init__(self, gdl_exp):
+        self._roles = []
+        self._facts = {}
+        self._rules = {}
+        self._sentences = []
+        self._hash = None
+        for sentence in gdl_exp:
+            sentence = _normalise(sentence)
+            self._sentences.append(sentence)
+            if type(sentence) == list and sentence and sentence[0] == "<=":
+                if len(sentence) < 2:
+                    raise ValueError("Invalid GDL rule: {0}".format(sentence))
+                for body in _expand_or(sentence[2:]):
+                    rule = Rule(sentence[1], body)
+                    if rule.body: self._rules.setdefault(rule.relation, []).append(rule)
+                    else: self._add_fact(rule.head)
+            else:
+                self._add_fact(sentence)
+        if not self._roles: raise ValueError("Invalid GDL has no roles")
+        self._build_dependency_graph()
+        self._stratify()
+
+    #-----------------------------------------------------------------------------
+    # Build from the GDL text (without the enclosing brackets).
+    #-----------------------------------------------------------------------------
+    @classmethod
+    def from_gdl(cls, gdl):
+        return cls(parse_simple_sexp("({0})".format(strip_comments(gdl))))
+
+    #-----------------------------------------------------------------------------
+    # Access to the roles, facts and rules
+    #-----------------------------------------------------------------------------
+    @property
+    def roles(self):
+        return self._roles
+
+    @property
+    def sentences(self):
+        return self._sentences
+
+    # A hash of the game (see game_hash())
+    @property
+    def hash(self):
+        if self._hash is None: self._hash = game_hash(self._sentences)
+        return self._hash
+
+    def facts(self, name, arity=None):
+        return self._lookup(self._facts, name, arity)
+
+    def rules(self, name, arity=None):
+        return self._lookup(self._rules, name, arity)
+
+    def relations(self):
+        return set(self._facts) | set(self._rules)
+
+    def is_defined(self, name, arity=None):
+        return any(key in self._facts or key in self._rules
+                   for key in self._keys(name, arity))
+
+    #-----------------------------------------------------------------------------
+    # The dependency graph. dependencies(relation) returns the set of
+    # (relation, negative) pairs for the relations that appear in the bodies
+    # of its rules. distinct is not included.
+    #-----------------------------------------------------------------------------
+    def dependencies(self, name, arity=None):
+        keys = self._keys(name, arity)
+        if len(keys) == 1: return self._dependencies.get(keys[0], frozenset())
+        return frozenset().union(*[self._dependencies.get(key, ()) for key in keys])
+
+    #-----------------------------------------------------------------------------
+    # The stratification. The components are the strongly connected
+    # components of the dependency graph in evaluation order (each only depends
+    # on itself and earlier components). The strata group relations so that a
+    # relation only depends negatively on relations in lower strata. The
+    # stratum of a bare name is the highest of its arities.
+    #-----------------------------------------------------------------------------
+    @property
+    def components(self):
+        return self._components
+
+    @property
+    def strata(self):
+        return self._strata
+
+    def stratum(self, name, arity=None):
+        keys = self._keys(name, arity)
+        if not keys: raise KeyError(name)
+        return max(self._stratum[key] for key in keys)
+
+    def is_recursive(self, name, arity=None):
+        return any(key in self._recursive for key in self._keys(name, arity))
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    # The (name, arity) keys of a query (see the header comment)
+    def _keys(self, name, arity):
+        if arity is not None: return [(name, arity)]
+        if type(name) == tuple: return [name]
+        return self._names.get(name, [])
+
+    def _lookup(self, index, name, arity):
+        keys = self._keys(name, arity)
+        if len(keys) == 1: return index.get(keys[0], [])
+        return [x for key in keys for x in index.get(key, ())]
+
+    def _add_fact(self, fact):
+        key = relation(fact)
+        if key == ROLE: self._roles.append(fact[1])
+        self._facts.setdefault(key, []).append(fact)
+
+    def _build_dependency_graph(self):
+        self._dependencies = {}
+        for (key, rules) in self._rules.items():
+            deps = set()
+            for rule in rules:
+                for literal in rule.body:
+                    negative = False
+                    if type(literal) == list and literal[0] == "not":
+                        negative = True
+                        literal = literal[1]
+                    dep = relation(literal)
+                    if dep[0] == "distinct": continue
+                    deps.add((dep, negative))
+            self._dependencies[key] = frozenset(deps)
+
+    def _stratify(self):
+        nodes = self.relations()
+        for deps in self._dependencies.values():
+            nodes.update(dep for (dep, negative) in deps)
+        graph = dict((n, [d for (d, neg) in self._dependencies.get(n, ())]) for n in nodes)
+        self._names = {}
+        for key in sorted(nodes): self._names.setdefault(key[0], []).append(key)
+        self._components = _tarjan(graph)
+
+        self._stratum = {}
+        self._recursive = set()
+        for component in self._components:
+            members = set(component)
+            level = 0
+            for key in component:
+                for (dep, negative) in self._dependencies.get(key, ()):
+                    if dep in members:
+                        if negative:
+                            raise ValueError(("GDL is not stratified: {0}/{1} depends "
+                                              "negatively on itself").format(*key))
+                        self._recursive.add(key)
+                    else:
+                        level = max(level, self._stratum[dep] + (1 if negative else 0))
+            for key in component: self._stratum[key] = level
+
+        self._strata = []
+        for component in self._components:
+            level = self._stratum[component[0]]
+            while len(self._strata) <= level: self._strata.append([])
+            self._strata[level].extend(component)
+
+#---------------------------------------------------------------------------------
+# A content hash of a game: the hex SHA-1 digest of its (parsed) sentences in
+# canonical form, so it doesn't depend on whitespace or the case of the GDL
+# keywords. Games are keyed by this hash in per-game caches.
+#---------------------------------------------------------------------------------
+
+def game_hash(gdl_exp):
+    digest = hashlib.sha1()
+    for sentence in gdl_exp:
+        text = exp_to_sexp(_normalise(sentence))
+        if not isinstance(text, bytes): text = text.encode("utf-8")
+        digest.update(text + b"\n")
+    return digest.hexdigest()
+
+#---------------------------------------------------------------------------------
+# GDL is the game description text (without the enclosing brackets) with
+# lazily computed views. It is a str, so it can be used anywhere the raw text
+# is expected, but each view is only computed the first time it is accessed
+# and is then remembered, so it is shared by everyone holding the object (the
+# Handler passes it to on_start):
+#
+# - stripped: the text with ";" comments removed (see strip_comments()).
+#   All the other views are built from it, so they agree with
+#   KnowledgeBase.from_gdl() for commented GDL.
+# - roles: the roles in the order they appear in the GDL. Only needs a
+#   bracket-depth scan of the top-level sentences, not a full parse.
+# - tokens: the list of tokens ("(", ")" and atoms).
+# - exp: the parsed sentences (see ggputils.utils.parse_simple_sexp()).
+# - predicates: the parsed sentences indexed by the (name, arity) of the
+#   sentence or, for rules, of the rule head. GDL keywords in the index keys
+#   are lower case.
+# - kb: the indexed knowledge base (see KnowledgeBase).
+# - hash: the game hash (see game_hash()).
+#---------------------------------------------------------------------------------
+_re_token = re.compile(r'\(|\)|[^\s()]+')
+_re_separator = re.compile(r'[\s()]')
+_TOKENIZE_CHUNK = 1 << 16
+_re_role = re.compile(r'^\(\s*role\s+([^\s()]+)\s*\)$', re.IGNORECASE)
+
+class GDL(str):
+    def __init__(self, text=""):
+        super(GDL, self).__init__()
+        self._stripped = None
+        self._roles = None
+        self._tokens = None
+        self._exp = None
+        self._predicates = None
+        self._kb = None
+        self._hash = None
+
+    @property
+    def text(self):
+        return str(self)
+
+    @property
+    def stripped(self):
+        if self._stripped is None: self._stripped = strip_comments(self)
+        return self._stripped
+
+    @property
+    def roles(self):
+        if self._roles is None:
+            if self._exp is not None:
+                roles = [s[1] for s in self._exp if type(s) == list and len(s) == 2
+                         and type(s[0]) == str and s[0].lower() == "role"]
+            else:
+                roles = []
+                for span in split_sexp_sequence(self.stripped):
+                    match = _re_role.match(span)
+                    if match: roles.append(match.group(1))
+            self._roles = roles
+        return self._roles
+
+    @property
+    def tokens(self):
+        if self._tokens is None: self._tokens = _tokenize(self.stripped)
+        return self._tokens
+
+    @property
+    def exp(self):
+        if self._exp is None: self._exp = _parse_tokens(self.tokens)
+        return self._exp
+
+    @property
+    def predicates(self):
+        if self._predicates is None:
+            index = {}
+            for sentence in self.exp:
+                head = sentence
+                if type(sentence) == list and sentence and sentence[0] == "<=" and \
+                   len(sentence) > 1:
+                    head = sentence[1]
+                (name, arity) = relation(head)
+                if type(name) == str and name.lower() in KEYWORDS: name = name.lower()
+                index.setdefault((name, arity), []).append(sentence)
+            self._predicates = index
+        return self._predicates
+
+    @property
+    def kb(self):
+        if self._kb is None: self._kb = KnowledgeBase(self.exp)
+        return self._kb
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = self._kb.hash if self._kb is not None else game_hash(self.exp)
+        return self._hash
+
+#---------------------------------------------------------------------------------
+# Remove ";" comments from GDL text
+#---------------------------------------------------------------------------------
+_re_comment = re.compile(r';[^\n]*')
+
+def strip_comments(gdl):
+    if ';' not in gdl: return gdl
+    return _re_comment.sub('', gdl)
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+def _normalise(exp):
+    if type(exp) != list:
+        lexp = exp.lower()
+        return lexp if lexp in KEYWORDS else exp
+    out = []
+    stack = [(exp, out)]
+    while stack:
+        (src, dst) = stack.pop()
+        for x in src:
+            if type(x) == list:
+                sub = []
+                dst.append(sub)
+                stack.append((x, sub))
+            else:
+                lx = x.lower()
+                dst.append(lx if lx in KEYWORDS else x)
+    return out
+
+# Tokenize in chunks (split at a separator) rather than with a single
+# findall() over the whole text, so that a thread tokenizing a very large GDL
+# doesn't hold the GIL for the whole time.
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    end = len(text)
+    while pos < end:
+        stop = pos + _TOKENIZE_CHUNK
+        if stop < end:
+            match = _re_separator.search(text, stop)
+            stop = match.start() + 1 if match else end
+        else:
+            stop = end
+        tokens.extend(_re_token.findall(text, pos, stop))
+        pos = stop
+    return tokens
+
+# Build the parsed sentences from a token list (see GDL.tokens)
+def _parse_tokens(tokens):
+    stack = []
+    out = []
+    for token in tokens:
+        if token == '(':
+            stack.append(out)
+            out = []
+        elif token == ')':
+            if not stack: raise ValueError("Bad bracket nesting in GDL")
+            (tmp, out) = (out, stack.pop())
+            out.append(tmp)
+        else:
+            out.append(token)
+    if stack: raise ValueError("Bad bracket nesting in GDL")
+    return out
+
+# Expand the (or ...) literals in a rule body into a list of bodies.
+def _expand_or(body):
+    bodies = [[]]
+    for literal in body:
+        if type(literal) == list and literal and literal[0] == "or":
+            alternatives = []
+            for disjunct in literal[1:]:
+                alternatives.extend(_expand_or([disjunct]))
+            bodies = [b + alt for b in bodies for alt in alternatives]
+        else:
+            for b in bodies: b.append(literal)
+    return bodies
+
+# Iterative Tarjan's algorithm. Returns the strongly connected components
+# in reverse topological order of the edges, so that each component only
+# depends on earlier ones.
+def _tarjan(graph):
+    index = {}
+    lowlink = {}
+    onstack = set()
+    stack = []
+    components = []
+    counter = 0
+    for root in sorted(graph):
+        if root in index: continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack.add(root)
+        while work:
+            (node, children) = work[-1]
+            pushed = False
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    onstack.add(child)
+                    work.append((child, iter(graph[child])))
+                    pushed = True
+                    break
+                elif child in onstack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if pushed: continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    onstack.discard(member)
+                    component.append(member)
+                    if member == node: break
+                components.append(component)
+    return components
@@ -0,0 +1,253 @@
+#---------------------------------------------------------------------------------
+#
+# A compact, array backed search tree for MCTS players. Instead of a Python
+# object per node the tree is a set of NumPy arrays indexed by node number:
+#
+# - visits: the number of visits of each node.
+# - values: the sum of the values backed up through each node. A node can hold
+#   several values (num_values), eg. one per role for simultaneous move games.
+# - parent: the parent of each node (-1 for the root).
+# - move: the move id (an integer chosen by the caller; eg. from a
+#   ggputils.symbols.SymbolTable) that leads from the parent to the node.
+# - first_child, num_children: the children of a node are allocated as a
+#   contiguous block of nodes, so the children of node n are the nodes
+#   first_child[n] ... first_child[n] + num_children[n] - 1.
+#
+# Because the children of a node are contiguous the UCT selection is a few
+# vectorised operations over slices of the arrays. The arrays are allocated
+# with spare capacity and grow (doubling) as nodes are added.
+#
+# The tree is re-rooted when the game advances. advance() moves the root to
+# the node reached by a sequence of moves and compacts the tree, copying that
+# subtree to the front of new arrays and dropping the rest. This fits the
+# SimplePlayer split between on_update() (advance the tree) and on_select()
+# (search from the root). For example:
+#
+#    tree = SearchTree(num_values=len(roles))
+#    def on_update(actions):
+#        tree.advance([joint_move_id(actions)])
+#    def on_select(timeout):
+#        while not timeout.has_expired():
+#            node = tree.root
+#            while tree.is_expanded(node) and tree.num_children[node]:
+#                node = tree.select_child(node, value_index=role_index)
+#            ...expand, simulate and tree.backpropagate(node, goals)...
+#        return tree.move[tree.best_child(tree.root)]
+#
+#---------------------------------------------------------------------------------
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import math
+
+#---------------------------------------------------------------------------------
+# SearchTree
+#---------------------------------------------------------------------------------
+
+NO_NODE = -1
+
+class SearchTree(object):
+    def __init__(self, capacity=1024, num_values=1):
+        if np is None:
+            raise ImportError("NumPy is required for the search tree")
+        self._initial_capacity = max(capacity, 1)
+        self._num_values = num_values
+        self._allocate(self._initial_capacity)
+        self.clear()
+
+    #-----------------------------------------------------------------------------
+    # Remove all nodes except a new (unexpanded) root.
+    #-----------------------------------------------------------------------------
+    def clear(self):
+        if self.capacity > 2 * self._initial_capacity: self._allocate(self._initial_capacity)
+        self._size = 1
+        self._reset(0, 1)
+        self.parent[0] = NO_NODE
+        self.move[0] = NO_NODE
+
+    @property
+    def root(self):
+        return 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self.visits)
+
+    @property
+    def num_values(self):
+        return self._num_values
+
+    def __len__(self):
+        return self._size
+
+    #-----------------------------------------------------------------------------
+    # Node queries
+    #-----------------------------------------------------------------------------
+    def is_expanded(self, node):
+        return self.first_child[node] != NO_NODE
+
+    def children(self, node):
+        first = self.first_child[node]
+        if first == NO_NODE: return range(0)
+        return range(first, first + self.num_children[node])
+
+    def child(self, node, move):
+        first = self.first_child[node]
+        if first == NO_NODE: return NO_NODE
+        matches = np.flatnonzero(self.move[first:first + self.num_children[node]] == move)
+        if not len(matches): return NO_NODE
+        return first + int(matches[0])
+
+    def mean(self, node, value_index=0):
+        if not self.visits[node]: return None
+        return float(self.values[node, value_index]) / self.visits[node]
+
+    #-----------------------------------------------------------------------------
+    # Expand a node by adding a child for each move id. Returns the first
+    # child. A node can only be expanded once.
+    #-----------------------------------------------------------------------------
+    def expand(self, node, moves):
+        if self.first_child[node] != NO_NODE:
+            raise ValueError("Node {0} is already expanded".format(node))
+        count = len(moves)
+        if self._size + count > self.capacity: self._grow(self._size + count)
+        first = self._size
+        end = first + count
+        self._reset(first, end)
+        self.parent[first:end] = node
+        self.move[first:end] = moves
+        # A node without moves (eg. terminal) is marked as expanded with the
+        # root as a (dummy) first child.
+        self.first_child[node] = first if count else self.root
+        self.num_children[node] = count
+        self._size = end
+        return first
+
+    #-----------------------------------------------------------------------------
+    # UCT selection: the child maximising mean + c * sqrt(ln(N) / n), where
+    # the mean is for the given value. Unvisited children are selected first
+    # (the first unvisited child).
+    #-----------------------------------------------------------------------------
+    def select_child(self, node, c=math.sqrt(2.0), value_index=0):
+        first = self.first_child[node]
+        count = self.num_children[node]
+        if first == NO_NODE or not count:
+            raise ValueError("Node {0} has no children".format(node))
+        end = first + count
+        visits = self.visits[first:end]
+        unvisited = np.flatnonzero(visits == 0)
+        if len(unvisited): return first + int(unvisited[0])
+        scores = self.values[first:end, value_index] / visits
+        scores += c * np.sqrt(math.log(self.visits[node]) / visits)
+        return first + int(scores.argmax())
+
+    # The most visited child
+    def best_child(self, node):
+        first = self.first_child[node]
+        if first == NO_NODE or not self.num_children[node]: return NO_NODE
+        return first + int(self.visits[first:first + self.num_children[node]].argmax())
+
+    #-----------------------------------------------------------------------------
+    # Add a visit and a value (a number or a sequence of num_values numbers)
+    # to a node and all its ancestors.
+    #-----------------------------------------------------------------------------
+    def backpropagate(self, node, value):
+        path = self.path(node)
+        self.visits[path] += 1
+        self.values[path] += value
+
+    # The nodes from a node up to the root
+    def path(self, node):
+        path = []
+        while node != NO_NODE:
+            path.append(node)
+            node = self.parent[node]
+        return path
+
+    #-----------------------------------------------------------------------------
+    # Move the root down the tree following a sequence of move ids and drop
+    # the rest of the tree. If a move is not in the tree the tree is cleared.
+    # Returns True if the subtree was reused.
+    #-----------------------------------------------------------------------------
+    def advance(self, moves):
+        node = self.root
+        for move in moves:
+            node = self.child(node, move)
+            if node == NO_NODE:
+                self.clear()
+                return False
+        if node != self.root: self._compact(node)
+        return True
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    def _allocate(self, capacity):
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, self._num_values), dtype=np.float64)
+        self.parent = np.full(capacity, NO_NODE, dtype=np.int32)
+        self.move = np.full(capacity, NO_NODE, dtype=np.int32)
+        self.first_child = np.full(capacity, NO_NODE, dtype=np.int32)
+        self.num_children = np.zeros(capacity, dtype=np.int32)
+
+    def _reset(self, start, end):
+        self.visits[start:end] = 0
+        self.values[start:end] = 0.0
+        self.first_child[start:end] = NO_NODE
+        self.num_children[start:end] = 0
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed: capacity *= 2
+        old = (self.visits, self.values, self.parent, self.move,
+               self.first_child, self.num_children)
+        self._allocate(capacity)
+        size = self._size
+        for (new, prev) in zip((self.visits, self.values, self.parent, self.move,
+                                self.first_child, self.num_children), old):
+            new[:size] = prev[:size]
+
+    # Copy the subtree of a node (breadth first, so the children of each node
+    # stay contiguous) to new arrays with the node as the root.
+    def _compact(self, node):
+        order = [np.array([node], dtype=np.int64)]
+        frontier = order[0]
+        while len(frontier):
+            counts = self.num_children[frontier].astype(np.int64)
+            frontier = frontier[counts > 0]
+            counts = counts[counts > 0]
+            if not len(frontier): break
+            starts = self.first_child[frontier].astype(np.int64)
+            offsets = np.cumsum(counts) - counts
+            frontier = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+            order.append(frontier)
+        order = np.concatenate(order)
+
+        size = len(order)
+        remap = np.full(self._size, NO_NODE, dtype=np.int64)
+        remap[order] = np.arange(size)
+        old = (self.visits, self.values, self.parent, self.move,
+               self.first_child, self.num_children)
+        capacity = self._initial_capacity
+        while capacity < 2 * size: capacity *= 2
+        self._allocate(capacity)
+        self.visits[:size] = old[0][order]
+        self.values[:size] = old[1][order]
+        self.move[:size] = old[3][order]
+        self.num_children[:size] = old[5][order]
+        parents = old[2][order]
+        parents[0] = NO_NODE
+        self.parent[:size] = np.where(parents >= 0, remap[np.maximum(parents, 0)], NO_NODE)
+        firsts = old[4][order]
+        firsts = np.where(self.num_children[:size] > 0, remap[np.maximum(firsts, 0)],
+                          np.where(firsts >= 0, self.root, NO_NODE))
+        self.first_child[:size] = firsts
+        self.move[0] = NO_NODE
+        self._size = size
@@ -0,0 +1,168 @@
+#---------------------------------------------------------------------------------
+#
+# NumPy encoding of GDL-II observation sets. Each turn's observations are
+# encoded over a per-match observation vocabulary (a SymbolTable, normally
+# ggputils.symbols.MatchSymbols.observations) either as:
+#
+# - a sorted, duplicate free, int32 array of observation ids, or
+# - a boolean bit vector indexed by observation id.
+#
+# Belief-state trackers can then stack the observations predicted for each
+# candidate state into a matrix (one row per state) and filter the whole
+# belief set in one vectorised operation. For example:
+#
+#    encoder = ObservationEncoder(symbols.observations)
+#    predicted = encoder.stack_bits([predict(s) for s in candidates])
+#    actual = encoder.to_bits(observations, predicted.shape[1])
+#    candidates = [s for (s, ok) in zip(candidates, consistent_rows(predicted, actual)) if ok]
+#
+# Because the vocabulary can grow during a match, bit vectors of different
+# lengths are padded with False before they are combined.
+#
+# The module imports without NumPy, so the Handler can import it only for
+# the observation_arrays option, but ObservationEncoder raises ImportError
+# and the id and bit functions cannot be used.
+#
+#---------------------------------------------------------------------------------
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ggputils.symbols import SymbolTable
+
+#---------------------------------------------------------------------------------
+# ObservationEncoder converts observations (strings or parsed expressions)
+# to id arrays and bit vectors over the vocabulary, and back again.
+#---------------------------------------------------------------------------------
+
+class ObservationEncoder(object):
+    def __init__(self, vocabulary=None):
+        if np is None:
+            raise ImportError("NumPy is required for the observation encoding")
+        self._vocabulary = vocabulary if vocabulary is not None else SymbolTable()
+
+    @property
+    def vocabulary(self):
+        return self._vocabulary
+
+    def __len__(self):
+        return len(self._vocabulary)
+
+    #-----------------------------------------------------------------------------
+    # Observations to a sorted int32 array of ids. New observations are added
+    # to the vocabulary.
+    #-----------------------------------------------------------------------------
+    def to_ids(self, observations):
+        return to_id_array([self._vocabulary.intern(o) for o in observations])
+
+    #-----------------------------------------------------------------------------
+    # Observations to a bit vector. The size defaults to the size of the
+    # vocabulary (after any new observations have been added).
+    #-----------------------------------------------------------------------------
+    def to_bits(self, observations, size=None):
+        return self.ids_to_bits(self.to_ids(observations), size)
+
+    def ids_to_bits(self, ids, size=None):
+        if size is None: size = len(self._vocabulary)
+        bits = np.zeros(max(size, len(self._vocabulary)), dtype=np.bool_)
+        bits[ids] = True
+        return bits
+
+    #-----------------------------------------------------------------------------
+    # Stack the bit vectors of a sequence of observation sets into a
+    # boolean matrix with one row for each set.
+    #-----------------------------------------------------------------------------
+    def stack_bits(self, observation_sets):
+        idsets = [self.to_ids(obs) for obs in observation_sets]
+        matrix = np.zeros((len(idsets), len(self._vocabulary)), dtype=np.bool_)
+        for (row, ids) in enumerate(idsets): matrix[row, ids] = True
+        return matrix
+
+    #-----------------------------------------------------------------------------
+    # Decode id arrays and bit vectors back to observation strings
+    #-----------------------------------------------------------------------------
+    def decode_ids(self, ids):
+        return self._vocabulary.decode(int(i) for i in ids)
+
+    def decode_bits(self, bits):
+        return self.decode_ids(bits_to_ids(bits))
+
+#---------------------------------------------------------------------------------
+# Conversion and set operations on sorted int32 id arrays.
+#---------------------------------------------------------------------------------
+
+def to_id_array(ids):
+    return np.unique(np.asarray(ids, dtype=np.int32))
+
+def bits_to_ids(bits):
+    return np.flatnonzero(bits).astype(np.int32)
+
+def ids_union(a, b):
+    return np.union1d(a, b).astype(np.int32)
+
+def ids_intersection(a, b):
+    return np.intersect1d(a, b, assume_unique=True).astype(np.int32)
+
+def ids_difference(a, b):
+    return np.setdiff1d(a, b, assume_unique=True).astype(np.int32)
+
+def ids_issubset(a, b):
+    return bool(np.in1d(a, b, assume_unique=True).all())
+
+#---------------------------------------------------------------------------------
+# Set operations on bit vectors (or matrices of bit vectors). Operands of
+# different lengths are padded with False to the longest.
+#---------------------------------------------------------------------------------
+
+def bits_union(a, b):
+    (a, b) = _pad(a, b)
+    return np.logical_or(a, b)
+
+def bits_intersection(a, b):
+    (a, b) = _pad(a, b)
+    return np.logical_and(a, b)
+
+def bits_difference(a, b):
+    (a, b) = _pad(a, b)
+    return np.logical_and(a, np.logical_not(b))
+
+def bits_issubset(a, b):
+    (a, b) = _pad(a, b)
+    return bool(not np.logical_and(a, np.logical_not(b)).any())
+
+#---------------------------------------------------------------------------------
+# Belief filtering over a matrix with one row of predicted observations per
+# candidate state. Each returns a boolean mask with one entry per row:
+#
+# - consistent_rows: the row is exactly the observed set.
+# - superset_rows: the row contains all the observed set.
+# - subset_rows: the row only contains observations in the observed set.
+#---------------------------------------------------------------------------------
+
+def consistent_rows(matrix, bits):
+    (matrix, bits) = _pad(matrix, bits)
+    return (matrix == bits).all(axis=1)
+
+def superset_rows(matrix, bits):
+    (matrix, bits) = _pad(matrix, bits)
+    return np.logical_or(matrix, np.logical_not(bits)).all(axis=1)
+
+def subset_rows(matrix, bits):
+    (matrix, bits) = _pad(matrix, bits)
+    return np.logical_or(np.logical_not(matrix), bits).all(axis=1)
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+def _pad(a, b):
+    size = max(a.shape[-1], b.shape[-1])
+    return (_pad_to(a, size), _pad_to(b, size))
+
+def _pad_to(bits, size):
+    missing = size - bits.shape[-1]
+    if missing == 0: return bits
+    padding = [(0, 0)] * (bits.ndim - 1) + [(0, missing)]
+    return np.pad(bits, padding, mode="constant", constant_values=False)
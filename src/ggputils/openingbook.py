@@ -0,0 +1,152 @@
+#---------------------------------------------------------------------------------
+#
+# An opening book for replaying known games. Positions are identified by the
+# game hash (see ggputils.gdl.game_hash()), our role and the history of moves
+# so far, as accumulated from the PLAY messages:
+#
+# - GDL-I: a tuple of joint moves, each a tuple of action strings ordered like
+#   the roles in the GDL.
+# - GDL-II: a tuple of (our last action, sorted tuple of observations) pairs.
+#
+# All action and observation strings are in canonical form (see
+# ggputils.utils.exp_to_sexp()).
+#
+# The book holds statistics (count and total value) for each move tried in a
+# position and suggests the move with the best mean value once it has been
+# played at least min_count times. It can be filled by hand (add()), learned
+# from our own matches (learn()) or loaded from a file (load()).
+#
+# Passing a book to the Handler (or SimplePlayer) with opening_book=book
+# makes it track the history of each match and look up every PLAY message in
+# the book. For a SimplePlayer a hit is returned immediately without calling
+# on_select(). A RawPlayer is instead passed the suggested move (or None) to
+# on_play/on_play2 as the keyword argument "book_move". At STOP the moves we
+# played are available as book.last_match, so on_stop can learn from them:
+#
+#    book = OpeningBook.load("book.json") if os.path.exists("book.json") else OpeningBook()
+#    def on_clear():
+#        book.learn(book.last_match, our_goal_value)
+#        book.save("book.json")
+#
+#---------------------------------------------------------------------------------
+
+import json
+
+#---------------------------------------------------------------------------------
+# The record of the moves we made in a match: a list of (history, move) pairs.
+#---------------------------------------------------------------------------------
+
+class MatchRecord(object):
+    def __init__(self, game_hash, role, moves=None):
+        self.game_hash = game_hash
+        self.role = role
+        self.moves = moves if moves is not None else []
+
+    def __len__(self):
+        return len(self.moves)
+
+#---------------------------------------------------------------------------------
+# OpeningBook
+#---------------------------------------------------------------------------------
+
+class OpeningBook(object):
+    def __init__(self, min_count=1, max_depth=None):
+        self._entries = {}
+        self._min_count = min_count
+        self._max_depth = max_depth
+        self.last_match = None
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    #-----------------------------------------------------------------------------
+    # Return the book move for a position or None.
+    #-----------------------------------------------------------------------------
+    def lookup(self, game_hash, role, history):
+        if self._max_depth is not None and len(history) > self._max_depth:
+            return None
+        moves = self._entries.get((game_hash, role, _freeze(history)))
+        best = None
+        if moves:
+            bestscore = None
+            for (move, (count, total)) in moves.items():
+                if count < self._min_count: continue
+                score = (float(total) / count, count, move)
+                if bestscore is None or score > bestscore: (best, bestscore) = (move, score)
+        if best is None: self.misses += 1
+        else: self.hits += 1
+        return best
+
+    #-----------------------------------------------------------------------------
+    # Add the result of playing a move in a position.
+    #-----------------------------------------------------------------------------
+    def add(self, game_hash, role, history, move, value=0.0, count=1):
+        key = (game_hash, role, _freeze(history))
+        stats = self._entries.setdefault(key, {}).setdefault(move, [0, 0.0])
+        stats[0] += count
+        stats[1] += value * count
+
+    # Learn from the record of a match with the final value (eg. our goal)
+    def learn(self, record, value=0.0):
+        if record is None: return
+        for (history, move) in record.moves:
+            if self._max_depth is not None and len(history) > self._max_depth: break
+            self.add(record.game_hash, record.role, history, move, value)
+
+    #-----------------------------------------------------------------------------
+    # Statistics
+    #-----------------------------------------------------------------------------
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups: return 0.0
+        return float(self.hits) / lookups
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"positions": len(self._entries), "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate}
+
+    #-----------------------------------------------------------------------------
+    # Save to and load from a JSON file
+    #-----------------------------------------------------------------------------
+    def save(self, path):
+        entries = [[game_hash, role, _thaw(history), move, count, total]
+                   for ((game_hash, role, history), moves) in self._entries.items()
+                   for (move, (count, total)) in moves.items()]
+        with open(path, "w") as f:
+            json.dump({"version": 1, "entries": entries}, f)
+
+    @classmethod
+    def load(cls, path, min_count=1, max_depth=None):
+        with open(path) as f: data = json.load(f)
+        if data.get("version") != 1:
+            raise ValueError("Unsupported opening book version: {0}".format(data.get("version")))
+        book = cls(min_count, max_depth)
+        for (game_hash, role, history, move, count, total) in data["entries"]:
+            stats = book._entries.setdefault((_str(game_hash), _str(role), _freeze(history)), {})
+            stats[_str(move)] = [count, total]
+        return book
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+# Convert a history (of nested lists/tuples of strings) to nested tuples
+def _freeze(history):
+    if type(history) == tuple or type(history) == list:
+        return tuple(_freeze(h) for h in history)
+    return _str(history)
+
+def _thaw(history):
+    if type(history) == tuple: return [_thaw(h) for h in history]
+    return history
+
+# JSON loads strings as unicode in Python 2
+def _str(s):
+    if s is None or type(s) == str: return s
+    return str(s)
@@ -1 +1,32 @@
-from .basic_players import RawPlayer, SimplePlayer
+# --------------------------------------------------------------------
+#
+# The GGP players. The players (and with them gevent) are only
+# imported when they are first used, so importing a module that does
+# not need the server (eg. in a worker process) stays fast and does not
+# import gevent.
+#
+# --------------------------------------------------------------------
+
+import importlib
+import sys
+import types
+
+_LAZY = {"RawPlayer": "basic_players", "SimplePlayer": "basic_players",
+         "Handler": "ggp_http_handler"}
+
+__all__ = sorted(_LAZY)
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name not in _LAZY:
+            raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
+        value = getattr(importlib.import_module("." + _LAZY[name], __name__), name)
+        setattr(self, name, value)
+        return value
+
+# Replace this module with a lazy one. The original is kept referenced
+# since Python 2 clears the globals of a module when it is deleted.
+_module = _LazyModule(__name__)
+_module.__dict__.update(globals())
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -10,7 +10,7 @@ import logging
 import operator
 from .ggp_http_handler import Handler
 from ggputils.utils import *
-from gevent.wsgi import *
+from gevent.pywsgi import WSGIServer
 
 g_logger = logging.getLogger(__name__)
 
@@ -32,13 +32,18 @@ g_logger = logging.getLogger(__name__)
 # - on_info() - optional
 # - on_preview(timeout, gdl) -optional
 #
+# The gdl is a ggputils.gdl.GDL object: the GDL text with lazily computed
+# views (roles, tokens, parse, predicate index, knowledge base and hash).
+#
 # Note: The timeout is a ggputils.util.Timeout object. It is
 # calculated from a timestamp taken when the GGP message has been
 # received with the addition of the start/play/preview clock.  This
 # timeout should be reduced (using the reduce() call) to allow for
 # some buffer in responding to the game master. Unfortunately, we
 # can't do better than this without some modifications to the GGP
-# protocol itself.
+# protocol itself. The timeout's cancelled flag is set at the deadline
+# and when the match is stopped or aborted, so a search loop can poll
+# "while not timeout.cancelled" (after a reduce()).
 #
 # Example usage:
 #
@@ -52,13 +57,30 @@ class RawPlayer(WSGIServer):
                  on_play=None, on_stop=None,
                  on_play2=None, on_stop2=None,
                  on_abort=None, on_info=None, on_preview=None,
-                 protocol_version=None):
+                 protocol_version=None, action_spans=False,
+                 structured_actions=False, integer_actions=False,
+                 observation_arrays=False, knowledge_base=False,
+                 game_hash=False, opening_book=None, offload_threshold=1 << 16,
+                 catch_up=False, preempt=False, fast_lane=True,
+                 compress_responses=None, max_message_size=1 << 28):
         self._handler = Handler(on_start=on_start,
                                 on_play=on_play, on_stop=on_stop,
                                 on_play2=on_play2, on_stop2=on_stop2,
                                 on_abort=on_abort, on_info=on_info,
                                 on_preview=on_preview,
-                                protocol_version=protocol_version)
+                                protocol_version=protocol_version,
+                                action_spans=action_spans,
+                                structured_actions=structured_actions,
+                                integer_actions=integer_actions,
+                                observation_arrays=observation_arrays,
+                                knowledge_base=knowledge_base,
+                                game_hash=game_hash,
+                                opening_book=opening_book,
+                                offload_threshold=offload_threshold,
+                                catch_up=catch_up, preempt=preempt,
+                                fast_lane=fast_lane,
+                                compress_responses=compress_responses,
+                                max_message_size=max_message_size)
         super(RawPlayer, self).__init__(address,self._handler)
         self.serve_forever()
 
@@ -78,6 +100,62 @@ class RawPlayer(WSGIServer):
 # - on_clear()
 # - on_info() - optional
 # - on_preview(timeout, gdl) - optional
+# - on_fallback(timeout) - optional
+#
+# With structured_actions=True the actions and observations passed to
+# on_update/on_update2 are parsed expressions (nested lists of strings)
+# rather than strings. In either case on_select can return a string or
+# a parsed expression.
+#
+# With integer_actions=True on_start is also passed the per-match symbol
+# table as the keyword argument "symbols", on_update receives a tuple of
+# action ids ordered like the roles in the GDL, on_update2 an action id and
+# a tuple of observation ids, and on_select can return an action id.
+# Adding observation_arrays=True passes the observations to on_update2 as
+# a sorted NumPy int32 array of ids instead (see ggputils.observations).
+#
+# With knowledge_base=True on_start is also passed an indexed GDL knowledge
+# base (see ggputils.gdl.KnowledgeBase) as the keyword argument "kb".
+#
+# With game_hash=True on_start is also passed the content hash of the GDL
+# as the keyword argument "game_hash".
+#
+# With opening_book set (see ggputils.openingbook.OpeningBook) each PLAY is
+# first looked up in the book and, on a hit, the book move is returned
+# without calling on_select (on_update is still called).
+#
+# START messages of at least offload_threshold bytes are preprocessed in a
+# thread so that a large GDL doesn't block the event loop (see Handler).
+#
+# With catch_up=True, when we have fallen behind and a later PLAY (or
+# STOP) is already waiting, the stale PLAY is only used to update the
+# state (on_update/on_update2) and is answered with a fast fallback move
+# instead of calling on_select. The fallback move is returned by the
+# optional on_fallback(timeout) callback, or is "NOOP" (the game master
+# will have already timed out on a stale message).
+#
+# With preempt=True an ABORT for the current match kills a running
+# on_start/on_select (see the Handler), so it is handled without waiting
+# for the search to finish. Otherwise a search should stop when its
+# timeout is cancelled. Either way the ABORT is only read when the search
+# yields to gevent, so a CPU bound search is never preempted, and killing
+# it can leave the player's state half updated. A search should poll
+# timeout.cancelled and call gevent.sleep(0) now and then; that is the
+# supported way to stop early.
+#
+# INFO and PREVIEW messages are answered immediately, without waiting
+# for a running on_start/on_select, unless fast_lane=False. So on_info
+# and on_preview can run while on_start/on_select is suspended at a gevent
+# yield and must be safe to do so.
+#
+# Compressed (gzip or deflate) requests are always accepted. Responses of
+# at least compress_responses bytes are gzip compressed if the game master
+# accepts it. Requests can also use chunked transfer-encoding and are
+# limited to max_message_size bytes.
+#
+# auto_clear is a list of objects (eg. ggputils.transposition.TranspositionTable)
+# whose clear() method is called, before on_clear, when a match ends or is
+# aborted.
 #
 # Note the timeout
 # --------------------------------------------------------------------
@@ -87,12 +165,20 @@ class SimplePlayer(object):
     def __init__(self, address, on_start=None,
                  on_update=None, on_update2=None,
                  on_select=None, on_clear=None,
-                 on_info=None, on_preview=None):
+                 on_info=None, on_preview=None, on_fallback=None,
+                 action_spans=False, structured_actions=False,
+                 integer_actions=False, observation_arrays=False,
+                 knowledge_base=False, game_hash=False, opening_book=None,
+                 offload_threshold=1 << 16, catch_up=False, preempt=False,
+                 fast_lane=True, compress_responses=None, max_message_size=1 << 28,
+                 auto_clear=()):
         self._on_update=on_update
         self._on_update2=on_update2
         self._on_select=on_select
         self._on_clear=on_clear
         self._on_preview=on_preview
+        self._on_fallback=on_fallback
+        self._auto_clear=list(auto_clear)
 
         assert self._on_select, "No on_select handler defined"
         assert self._on_update or self._on_update2, \
@@ -108,28 +194,52 @@ class SimplePlayer(object):
                                  on_stop=self._on_ggp_stop,
                                  on_play2=self._on_ggp_play2,
                                  on_stop2=self._on_ggp_stop2,
-                                 on_abort=on_clear,
+                                 on_abort=self._on_ggp_abort,
                                  on_info=on_info,
                                  on_preview=on_preview,
-                                 protocol_version=protocol_version)
+                                 protocol_version=protocol_version,
+                                 action_spans=action_spans,
+                                 structured_actions=structured_actions,
+                                 integer_actions=integer_actions,
+                                 observation_arrays=observation_arrays,
+                                 knowledge_base=knowledge_base,
+                                 game_hash=game_hash,
+                                 opening_book=opening_book,
+                                 offload_threshold=offload_threshold,
+                                 catch_up=catch_up, preempt=preempt,
+                                 fast_lane=fast_lane,
+                                 compress_responses=compress_responses,
+                                 max_message_size=max_message_size)
 
     #-----------------------------------------------------------------
     # The callbacks for the GGP comms
     #-----------------------------------------------------------------
-    def _on_ggp_play(self, timeout, actions):
+    def _on_ggp_play(self, timeout, actions, book_move=None, stale=False):
         # The Handler should guarantee that the match ids match.
-        if actions != {}: self._on_update(actions)
+        if actions: self._on_update(actions)
+        if book_move is not None: return book_move
+        if stale: return self._fallback(timeout)
         return self._on_select(timeout)
 
     def _on_ggp_stop(self, timeout, actions):
-        if actions != {}: self._on_update(actions)
-        self._on_clear()
+        if actions: self._on_update(actions)
+        self._on_ggp_abort()
 
-    def _on_ggp_play2(self, timeout, action, observations):
+    def _on_ggp_play2(self, timeout, action, observations, book_move=None, stale=False):
         # The Handler should guarantee that the match ids match.
         self._on_update2(action, observations)
+        if book_move is not None: return book_move
+        if stale: return self._fallback(timeout)
         return self._on_select(timeout)
 
     def _on_ggp_stop2(self, timeout, action, observations):
         self._on_update2(action, observations)
-        self._on_clear()
+        self._on_ggp_abort()
+
+    def _on_ggp_abort(self):
+        for obj in self._auto_clear: obj.clear()
+        if self._on_clear: self._on_clear()
+
+    def _fallback(self, timeout):
+        if self._on_fallback: return self._on_fallback(timeout)
+        return "NOOP"
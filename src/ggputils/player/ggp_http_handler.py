@@ -38,7 +38,9 @@
 #   messages.
 #
 # - All callbacks have a timeout object (see
-#   ggputils.util.Timeout). This timeout object is based on a
+#   ggputils.util.Timeout). Its cancelled flag is set at the deadline
+#   and when the match is stopped or aborted, so search loops can just
+#   poll the flag. This timeout object is based on a
 #   timestamp taken as soon as the message arrives. Note: I don't know
 #   enough about HTTP to be sure but from what I can tell the two GGP
 #   game masters (Stanford/Tiltyard and Dresden) do not provide any
@@ -50,11 +52,22 @@
 #   timeout should be reduced by a healthy margin to make sure that
 #   the player responds in time.
 #
+# - The gdl passed to on_start and on_preview is a ggputils.gdl.GDL
+#   object. It is a string of the GDL text but also has lazily computed
+#   (and shared) views: roles, tokens, exp (the parsed sentences),
+#   predicates, kb and hash. So players don't need to re-parse the GDL.
+#
 # - The actions in the on_play and on_stop callbacks are a python
 #   dictionary of roles to actions. It can be empty, corresponding to
 #   the "NIL" actions string that happens with the first PLAY message
 #   of a game.
 #
+# - Logging is done with lazily formatted messages (see
+#   ggputils.utils._fmt) and the current match is set at START and
+#   cleared at STOP/ABORT (see ggputils.asynclog), so with an
+#   AsyncLogHandler the formatting and writing of log records is done in
+#   a background thread and each match can be logged to its own file.
+#
 # The handler tries to be robust in how it handles requests. It adapts
 # to the variations between the Stanford game server and the Dresden
 # game controller. It also tries to respond appropriately to out of
@@ -71,12 +84,20 @@
 import time
 import re
 import logging
+import numbers
+import zlib
 from ggputils.utils import *
 from ggputils.utils import _fmt
+from ggputils.symbols import MatchSymbols
+from ggputils.gdl import GDL
+from ggputils.openingbook import MatchRecord
+from ggputils.asynclog import set_current_match
 from cgi import escape
 from gevent.lock import *
 from gevent.queue import *
 from gevent.event import *
+from gevent.hub import get_hub
+from gevent import spawn, GreenletExit
 
 g_logger = logging.getLogger(__name__)
 
@@ -122,24 +143,127 @@ class Handler(object):
     re_m_PREVIEW = re.compile(MATCH_PREVIEW, re.IGNORECASE | re.DOTALL)
     re_m_SPS_MATCHID = re.compile(MATCH_SPS_MATCHID, re.IGNORECASE | re.DOTALL)
 
-    re_m_GDL_ROLE = re.compile("role", re.IGNORECASE)
-
     #---------------------------------------------------------------------------------
     # Constructor takes callbacks for the different GGP message types.
     # INFO and PREVIEW callbacks are optional with the following default behaviours:
     # - PREVIEW: does nothing except responds with "DONE"
     # - INFO: if not in a game then responds with "AVAILABLE", or "BUSY" otherwise.
+    #
+    # If action_spans is True then the actions and observations passed to the
+    # callbacks are slices of the message text, extracted with a single
+    # bracket-depth scan, rather than being parsed and re-serialised. This is
+    # faster but the whitespace within each action is not normalised.
+    #
+    # If structured_actions is True then the actions and observations are
+    # passed as parsed expressions (see ggputils.utils.parse_simple_sexp())
+    # instead of strings, so players don't have to re-parse them. Independent
+    # of this option, on_play/on_play2 can return either a string or a
+    # parsed expression.
+    #
+    # If integer_actions is True then a per-match symbol table (see
+    # ggputils.symbols.MatchSymbols) is seeded from the GDL at START and is
+    # passed to on_start as the keyword argument "symbols". The GDL-I actions
+    # are then passed to on_play/on_stop as a tuple of action ids ordered like
+    # the roles in the GDL (empty for the first PLAY), and the GDL-II last
+    # move and observations as an action id (or None) and a tuple of
+    # observation ids. An integer returned from on_play/on_play2 is decoded
+    # back to its action string.
+    #
+    # If observation_arrays is True (requires integer_actions and NumPy) then
+    # the GDL-II observations are instead passed as a sorted int32 NumPy array
+    # of observation ids (see ggputils.observations). NumPy is only imported
+    # when this option is used.
+    #
+    # If knowledge_base is True then an indexed GDL knowledge base (see
+    # ggputils.gdl.KnowledgeBase) is built from the GDL at START and passed to
+    # on_start as the keyword argument "kb".
+    #
+    # If game_hash is True then the content hash of the GDL (see
+    # ggputils.gdl.game_hash()) is passed to on_start as the keyword argument
+    # "game_hash". It can be used to key per-game caches (eg.
+    # ggputils.artifacts.ArtifactStore).
+    #
+    # If opening_book is set (see ggputils.openingbook.OpeningBook) then the
+    # history of moves is tracked and each PLAY is looked up in the book,
+    # keyed by the game hash, role and history. The book move (or None) is
+    # passed to on_play/on_play2 as the keyword argument "book_move". The
+    # moves we play are recorded and at STOP saved as the book's last_match
+    # (before on_stop is called).
+    #
+    # START messages of at least offload_threshold bytes are preprocessed
+    # (framing, role extraction, parsing and populating the GDL views needed by
+    # the other options) in the gevent thread pool so that the event loop is
+    # not blocked by a large GDL. This is done as soon as the message arrives
+    # and before it joins the queue of messages, so other messages (eg. INFO)
+    # are not held up and are still timestamped on arrival. Set it to None to
+    # always preprocess in the event loop.
+    #
+    # If catch_up is True then a PLAY message is marked as stale when a later
+    # PLAY or STOP message for the same match is already waiting in the queue
+    # (we have fallen behind and the game master has moved on). on_play/on_play2
+    # are passed the keyword argument "stale", so a stale message can be used
+    # to update the game state and answered with a fast fallback move instead
+    # of searching. The number of messages waiting behind the current one is
+    # the backlog property.
+    #
+    # When an ABORT or STOP for the current match arrives while a callback is
+    # still running, the callback's timeout is cancelled (see
+    # ggputils.utils.Timeout.cancelled) so that a search can return early. If
+    # preempt is True then on_start/on_play/on_play2 also run in their own
+    # greenlet, which is killed when an ABORT arrives, and any PLAY messages
+    # still queued before the ABORT are answered without calling on_play. A
+    # preempted PLAY is answered with NOOP (the match is over anyway) and the
+    # ABORT is then handled as normal.
+    #
+    # Note: an ABORT or STOP can only be read (and the timeout cancelled or
+    # the greenlet killed) when the running callback yields to the gevent
+    # hub. A CPU bound search that never yields is not preempted; it is only
+    # stopped at its deadline (the timeout's timer is a real thread). Killing
+    # a greenlet can also leave the player's state half updated. So the
+    # supported way for a search to stop early is to poll timeout.cancelled
+    # and to call gevent.sleep(0) now and then so that messages are read.
+    #
+    # If fast_lane is True (the default) then INFO and PREVIEW messages, which
+    # don't change the match state, bypass the message queues and are answered
+    # immediately, even while a START/PLAY/STOP callback is running. So
+    # on_info and on_preview can run concurrently with the other callbacks
+    # (whenever those yield to the gevent hub) and must not change state that
+    # they rely on. INFO and PREVIEW are answered in the case of their own
+    # message and never change the case of the other responses.
+    #
+    # Request bodies compressed with gzip or deflate (the Content-Encoding
+    # header) are always accepted. If compress_responses is set to a number of
+    # bytes then responses at least that long are gzip compressed for clients
+    # that accept it (the Accept-Encoding header). GGP responses are normally
+    # tiny, so this only matters for unusually large responses.
+    #
+    # Request bodies can also be sent with chunked transfer-encoding. Messages
+    # (after decompression) larger than max_message_size bytes are rejected.
     #---------------------------------------------------------------------------------
     def __init__(self, on_start=None,
                  on_play=None, on_stop=None,
                  on_play2=None, on_stop2=None,
                  on_abort=None,
                  on_info=None, on_preview=None,
-                 protocol_version=None, test_mode=False):
+                 protocol_version=None, action_spans=False,
+                 structured_actions=False, integer_actions=False,
+                 observation_arrays=False, knowledge_base=False,
+                 game_hash=False, opening_book=None, offload_threshold=1 << 16,
+                 catch_up=False, preempt=False, fast_lane=True,
+                 compress_responses=None, max_message_size=1 << 28, test_mode=False):
 
         if not protocol_version: protocol_version=Handler.GGP1
         assert protocol_version in [Handler.GGP1, Handler.GGP2],\
             "Unrecognised GDL protocol version {0}".format(protocol_version)
+        assert not (structured_actions and integer_actions),\
+            "Cannot use both structured_actions and integer_actions"
+        assert not (action_spans and structured_actions),\
+            "Cannot use both action_spans and structured_actions"
+        assert integer_actions or not observation_arrays,\
+            "observation_arrays requires integer_actions"
+        if observation_arrays:
+            from ggputils.observations import np
+            if np is None: raise ImportError("NumPy is required for observation_arrays")
 
         # Test mode is useful for unit testing individual callback functions
         if not test_mode:
@@ -152,9 +276,22 @@ class Handler(object):
                 raise ValueError(("Must have valid callbacks for: on_start, "
                                   "on_play2, on_stop2, on_abort"))
 
-        g_logger.info("Running player for GDL version: {0}".format(protocol_version))
+        g_logger.info(_fmt("Running player for GDL version: {0}", protocol_version))
 
         self._protocol_version = protocol_version
+        self._action_spans = action_spans
+        self._structured_actions = structured_actions
+        self._integer_actions = integer_actions
+        self._observation_arrays = observation_arrays
+        self._knowledge_base = knowledge_base
+        self._game_hash = game_hash
+        self._opening_book = opening_book
+        self._offload_threshold = offload_threshold
+        self._catch_up = catch_up
+        self._preempt = preempt
+        self._fast_lane = fast_lane
+        self._compress_responses = compress_responses
+        self._max_message_size = max_message_size
         self._on_START = on_start
         self._on_PLAY = on_play
         self._on_STOP = on_stop
@@ -175,6 +312,12 @@ class Handler(object):
         self._playclock = None
         self._startclock = None
         self._roles = []
+        self._symbols = None
+        self._book_record = None
+        self._book_history = []
+        self._active_timeout = None
+        self._active_callback = None
+        self._aborting = None
 
     #----------------------------------------------------------------------------
     # Call that adheres to the WSGI application specification. Handles
@@ -194,20 +337,30 @@ class Handler(object):
     # expect the good queue to only ever contain the current message
     # being handled, but it does mean that even if the player gets
     # behind, the messages will be processed in an orderly way and
-    # there is the possibility of catching up.
+    # there is the possibility of catching up (see the catch_up option).
+    #
+    # INFO and PREVIEW messages don't need to be ordered so they take a
+    # fast lane around the queues (see the fast_lane option).
     # ----------------------------------------------------------------------------
     def __call__(self, environ, start_response):
 
         # Timestamp  as early as possible
-        timestamp = time.time()
+        timestamp = monotonic()
 
         # NOTE: _get_http_post(environ) can only be called once.
         try:
 #            post_message = escape(_get_http_post(environ))
-            post_message = _get_http_post(environ)
+            post_message = _get_http_post(environ, self._max_message_size)
+        except HTTPErrorResponse as er:
+            return self._app_error(environ, start_response, er)
         except:
             return self._app_bad(environ, start_response)
 
+        # INFO and PREVIEW messages can skip the queues
+        if self._fast_lane and (Handler.re_s_INFO.match(post_message) or
+                                Handler.re_s_PREVIEW.match(post_message)):
+            return self._app_normal(environ, start_response, timestamp, post_message)
+
         # Handle one connection at a time in order by creating an event
         # adding it to the queue and then waiting for that event to be called.
         myevent = AsyncResult()
@@ -215,12 +368,19 @@ class Handler(object):
 
         # If I'm not the head of the all queue then wait till I'm called
         if self._all_conn_queue.peek() != myevent: myevent.wait()
+
+        # The heavy lifting for a START message is done while it holds the
+        # head of the all queue, so later messages cannot overtake it, but
+        # before it waits for the good queue (where a callback may be running).
+        start = None
+        if Handler.re_s_START.match(post_message): start = self._prepare_START(post_message)
         mygood = self._is_good_connection(environ, timestamp, post_message)
 
         # If I'm not bad then add myself to the good connection queue
         if mygood:
-            myevent = AsyncResult()
+            myevent = _QueuedMessage(post_message)
             self._good_conn_queue.put(myevent)
+            self._check_preempt(post_message)
 
         # remove myself from the all queue and call up the next one
         self._all_conn_queue.get()
@@ -232,7 +392,7 @@ class Handler(object):
         # If I'm not the head of the good queue then wait till I'm called
         if self._good_conn_queue.peek() != myevent: myevent.wait()
 
-        result = self._app_normal(environ, start_response, timestamp, post_message)
+        result = self._app_normal(environ, start_response, timestamp, post_message, start)
 
         # remove myself from the good queue and call up the next one
         self._good_conn_queue.get()
@@ -245,21 +405,23 @@ class Handler(object):
     # Internal functions to handle messages
     # _app_normal is for normal operation.
     # _app_bad is called when the handle is for bad a connection.
+    # _app_error replies with the status of an HTTPErrorResponse.
     #---------------------------------------------------------------------------------
-    def _app_normal(self, environ, start_response, timestamp, post_message):
+    def _app_normal(self, environ, start_response, timestamp, post_message, start=None):
         try:
-            response_body = self._handle_POST(timestamp, post_message)
+            response_body = self._handle_POST(timestamp, post_message, start)
+            encoding = None
+            if self._compress_responses is not None:
+                (response_body, encoding) = _encode_response(environ, response_body,
+                                                             self._compress_responses)
 
-            response_headers = _get_response_headers(environ, response_body)
+            response_headers = _get_response_headers(environ, response_body, encoding)
 
             start_response('200 OK', response_headers)
             return response_body
 
         except HTTPErrorResponse as er:
-            g_logger.info(_fmt("HTTPErrorResponse: {0}", er))
-            response_headers = _get_response_headers(environ, "")
-            start_response(str(er), response_headers)
-            return ""
+            return self._app_error(environ, start_response, er)
         except Exception as e:
             g_logger.error(_fmt("Unknown Exception: {0}", e))
             response_headers = _get_response_headers(environ, "")
@@ -267,6 +429,12 @@ class Handler(object):
             raise
             return ""
 
+    def _app_error(self, environ, start_response, er):
+        g_logger.info(_fmt("HTTPErrorResponse: {0}", er))
+        response_headers = _get_response_headers(environ, "")
+        start_response(str(er), response_headers)
+        return ""
+
     def _app_bad(self, environ, start_response):
         try:
             # Return an error
@@ -306,8 +474,8 @@ class Handler(object):
         # message through.
         if Handler.re_s_START.match(message):
             if self._matchid is not None:
-                g_logger.error(("A new START message has been received before the"
-                                "match {0} has ended.").format(self._matchid))
+                g_logger.error(_fmt(("A new START message has been received before the"
+                                     "match {0} has ended."), self._matchid))
             return True
 
         # Non-START game messages (those with matchids) are ok only if
@@ -332,19 +500,21 @@ class Handler(object):
     # game master using upper or lower case. Don't think it matters
     # for the Dresden game master but does for Stanford.
     # ---------------------------------------------------------------------------------
-    def _response(self, response):
-        if self._uppercase: return response.upper()
+    def _response(self, response, uppercase=None):
+        if uppercase is None: uppercase = self._uppercase
+        if uppercase: return response.upper()
         return response.lower()
 
     #---------------------------------------------------------------------------------
     # Internal functions - handle the different types of GGP messages
     #---------------------------------------------------------------------------------
-    def _handle_POST(self, timestamp, message):
-        logstr = message
-        if len(logstr) > 40: logstr = logstr[:50] + "..."
-        g_logger.info("Game Master message: {0}".format(logstr))
+    def _handle_POST(self, timestamp, message, start=None):
+        # Only a short prefix of the message is kept and formatting is lazy
+        if g_logger.isEnabledFor(logging.INFO):
+            g_logger.info(_fmt("Game Master message: {0}{1}", message[:50],
+                               "..." if len(message) > 50 else ""))
         if Handler.re_s_START.match(message):
-            return self.handle_START(timestamp, message)
+            return self.handle_START(timestamp, message, start)
         elif Handler.re_s_PLAY.match(message):
             return self.handle_PLAY(timestamp, message)
         elif Handler.re_s_STOP.match(message):
@@ -361,32 +531,43 @@ class Handler(object):
     #----------------------------------------------------------------------
     # handle GGP START message
     #----------------------------------------------------------------------
-    def handle_START(self, timestamp, message):
+    def handle_START(self, timestamp, message, start=None):
         self._set_case(message, "START")
-        match = Handler.re_m_START.match(message)
-        if not match:
-            raise HTTPErrorResponse(400, "Malformed START message {0}".format(message))
-        self._matchid = match.group(1)
-        role = match.group(2)
-        gdl = match.group(3)
-        self._startclock = int(match.group(4))
-        self._playclock = int(match.group(5))
+        if start is None: start = self._prepare_START(message)
+        if isinstance(start.error, HTTPErrorResponse): raise start.error
+        self._matchid = start.matchid
+        self._aborting = None
+        set_current_match(self._matchid)
+        role = start.role
+        gdl = start.gdl
+        self._startclock = start.startclock
+        self._playclock = start.playclock
 
         if self._protocol_version == Handler.GGP2: self._gdl2_turn = 0
 
-        # Hack: need to process the GDL to extract the order of roles as they appear
-        # in the GDL file so that we can get around the brokeness of the PLAY/STOP
-        # messages, which require a player to know the order of roles to match
-        # to the correct actions.
-        try:
-            self._roles_in_correct_order(gdl)
-        except Exception as e:
-            g_logger.error(_fmt("GDL error. Will ignore this game: {0}", e))
+        if start.error:
+            g_logger.error(_fmt("GDL error. Will ignore this game: {0}", start.error))
             self._matchid = None
+            set_current_match(None)
             return
 
-        timeout = Timeout(timestamp, self._startclock)
-        self._on_START(timeout.clone(), self._matchid, role, gdl, self._playclock)
+        # Hack: need the order of roles as they appear in the GDL file so that we
+        # can get around the brokeness of the PLAY/STOP messages, which require a
+        # player to know the order of roles to match to the correct actions.
+        self._roles = list(gdl.roles)
+        kwargs = {}
+        if self._integer_actions:
+            self._symbols = start.symbols
+            kwargs["symbols"] = self._symbols
+        if self._knowledge_base: kwargs["kb"] = gdl.kb
+        if self._game_hash: kwargs["game_hash"] = gdl.hash
+        if self._opening_book is not None:
+            self._book_record = MatchRecord(gdl.hash, role)
+            self._book_history = []
+
+        timeout = Timeout.from_monotonic(timestamp, self._startclock)
+        self._invoke(self._on_START, self._callback_timeout(timeout), self._matchid, role,
+                     gdl, self._playclock, **kwargs)
         remaining = timeout.remaining()
         if  remaining <= 0:
             g_logger.error(_fmt("START messsage handler late response by {0}s", remaining))
@@ -405,8 +586,10 @@ class Handler(object):
             raise HTTPErrorResponse(400, "Malformed PLAY message {0}".format(message))
         matchid = match.group(1)
         if self._matchid != matchid:
+            self._cancel_callback_timeout()
             self._on_ABORT()
             self._matchid = None
+            set_current_match(None)
             raise HTTPErrorResponse(400, ("PLAY message has wrong matchid: "
                                           "{0} {1}").format(matchid, self._matchid))
 
@@ -420,33 +603,58 @@ class Handler(object):
             if not re.match(r'^\s*\(.*\)\s*$', tmpstr) and \
                not re.match(r'^\s*NIL\s*$', tmpstr, re.I):
                 raise HTTPErrorResponse(400, "Malformed PLAY message {0}".format(message))
-            actions = parse_actions_sexp(tmpstr)
+            actions = self._parse_actions(tmpstr)
             if len(actions) != 0 and len(actions) != len(self._roles):
                 raise HTTPErrorResponse(400, "Malformed PLAY message {0}".format(message))
 
-            timeout = Timeout(timestamp, self._playclock)
-            action = self._on_PLAY(timeout.clone(), dict(zip(self._roles, actions)))
+            timeout = Timeout.from_monotonic(timestamp, self._playclock)
+            joint = self._joint_actions(actions)
+            kwargs = self._book_lookup(joint if self._integer_actions else actions)
+            self._add_stale(kwargs, matchid)
+            action = self._invoke(self._on_PLAY, self._callback_timeout(timeout),
+                                  joint, **kwargs)
         else:
             # GDL-II: a list of observations
-            (turn, action, observations) = _parse_gdl2_playstop_component("PLAY", message, tmpstr)
-            timeout = Timeout(timestamp, self._playclock)
-            action = self._on_PLAY2(timeout.clone(), action, observations)
+            (turn, action, observations) = self._parse_gdl2_playstop("PLAY", message, tmpstr)
+            timeout = Timeout.from_monotonic(timestamp, self._playclock)
+            kwargs = self._book_lookup((action,), turn, observations)
+            self._add_stale(kwargs, matchid)
+            action = self._invoke(self._on_PLAY2, self._callback_timeout(timeout), action,
+                                  observations, **kwargs)
 
             if turn != self._gdl2_turn:
                 raise HTTPErrorResponse(400, ("PLAY message has wrong turn number: "
                                           "{0} {1}").format(turn, self._gdl2_turn))
             self._gdl2_turn += 1
 
-        # Handle the return action
-        actionstr = "{0}".format(action)
-
-        # Make sure the action is a valid s-expression
-        try:
-            exp = parse_simple_sexp(actionstr.strip())
-        except:
-            actionstr = "({0})".format(actionstr)
-            g_logger.critical(_fmt(("Invalid action '{0}'. Will try to recover to "
-                                    "and send {1}"), action, actionstr))
+        if action is _PREEMPTED:
+            g_logger.info("PLAY preempted by an ABORT message")
+            return self._response("NOOP")
+
+        # Handle the return action. An action id is decoded and a parsed
+        # expression can be serialised directly, otherwise make sure the
+        # action is a valid s-expression
+        if self._integer_actions and isinstance(action, numbers.Integral):
+            try:
+                action = self._symbols.actions.symbol(action)
+            except IndexError:
+                g_logger.critical(_fmt("Invalid action id {0}. Will send NOOP", action))
+                action = "NOOP"
+        exp = None
+        if type(action) == type([]):
+            exp = action
+            actionstr = exp_to_sexp(action)
+        else:
+            actionstr = "{0}".format(action)
+            try:
+                exp = parse_simple_sexp(actionstr.strip())
+            except:
+                actionstr = "({0})".format(actionstr)
+                g_logger.critical(_fmt(("Invalid action '{0}'. Will try to recover to "
+                                        "and send {1}"), action, actionstr))
+        if self._book_record is not None:
+            move = exp_to_sexp(exp) if exp is not None else actionstr
+            self._book_record.moves.append((tuple(self._book_history), move))
 
         remaining = timeout.remaining()
         if remaining <= 0:
@@ -468,8 +676,10 @@ class Handler(object):
         # Make sure the matchid is correct
         matchid = match.group(1)
         if self._matchid != matchid:
+            self._cancel_callback_timeout()
             self._on_ABORT()
             self._matchid = None
+            set_current_match(None)
             raise HTTPErrorResponse(400, ("PLAY message has wrong matchid: "
                                           "{0} {1}").format(matchid, self._matchid))
 
@@ -479,27 +689,30 @@ class Handler(object):
         # GGP 1 and GGP 2 are handled differently
         if self._protocol_version == Handler.GGP1:
             # GDL-I: a list of actions
-            actions = parse_actions_sexp(tmpstr)
+            actions = self._parse_actions(tmpstr)
             if len(actions) != len(self._roles):
                 raise HTTPErrorResponse(400, "Malformed STOP message {0}".format(message))
-            timeout = Timeout(timestamp, self._playclock)
-            self._on_STOP(timeout.clone(), dict(zip(self._roles, actions)))
+            timeout = Timeout.from_monotonic(timestamp, self._playclock)
+            self._book_finish()
+            self._on_STOP(self._callback_timeout(timeout), self._joint_actions(actions))
         else:
             # GDL-II: a list of observations
-            (turn, action, observations) = _parse_gdl2_playstop_component("STOP", message, tmpstr)
+            (turn, action, observations) = self._parse_gdl2_playstop("STOP", message, tmpstr)
             if turn != self._gdl2_turn:
                 raise HTTPErrorResponse(400, ("STOP message has wrong turn number: "
                                           "{0} {1}").format(turn, self._gdl2_turn))
             self._gdl2_turn += 1
 
-            timeout = Timeout(timestamp, self._playclock)
-            self._on_STOP2(timeout.clone(), action, observations)
+            timeout = Timeout.from_monotonic(timestamp, self._playclock)
+            self._book_finish()
+            self._on_STOP2(self._callback_timeout(timeout), action, observations)
 
         remaining = timeout.remaining()
         if remaining <= 0:
             g_logger.error(_fmt("STOP messsage handler late response by {0}s", remaining))
         else:
             g_logger.debug(_fmt("STOP response with {0}s remaining", remaining))
+        set_current_match(None)
 
         # Now return the DONE response
         return self._response("DONE")
@@ -508,21 +721,21 @@ class Handler(object):
     # handle GGP INFO message
     #----------------------------------------------------------------------
     def handle_INFO(self, timestamp, message):
-        self._set_case(message, "INFO")
+        uppercase = self._message_case(message, "INFO")
         match = Handler.re_m_INFO.match(message)
         if not match:
             raise HTTPErrorResponse(400, "Malformed INFO message {0}".format(message))
 
         # If no INFO callback provide a sensible default
         if not self._on_INFO:
-            if self._matchid: return self._response("BUSY")
-            return self._response("AVAILABLE")
+            if self._matchid: return self._response("BUSY", uppercase)
+            return self._response("AVAILABLE", uppercase)
 
         # Use the user-provided callback
         response = self._on_INFO()
         if not response:
             raise ValueError("on_info() callback returned an empty value")
-        return self._response(self._on_INFO())
+        return self._response(response, uppercase)
 
     #----------------------------------------------------------------------
     # handle GGP ABORT message
@@ -534,13 +747,18 @@ class Handler(object):
             raise HTTPErrorResponse(400, "Malformed ABORT message {0}".format(message))
         matchid = match.group(1)
         if self._matchid != matchid:
+            self._cancel_callback_timeout()
             self._on_ABORT()
             self._matchid = None
+            set_current_match(None)
             raise HTTPErrorResponse(400, ("ABORT message has wrong matchid: "
                                           "{0} {1}").format(matchid, self._matchid))
 
         self._matchid = None
+        self._aborting = None
+        self._cancel_callback_timeout()
         self._on_ABORT()
+        set_current_match(None)
 
         # Stanford test website doesn't match the protocol description at:
         # http://games.stanford.edu/index.php/communication-protocol
@@ -551,44 +769,197 @@ class Handler(object):
     # handle GGP PREVIEW message
     #----------------------------------------------------------------------
     def handle_PREVIEW(self, timestamp, message):
-        self._set_case(message, "PREVIEW")
+        uppercase = self._message_case(message, "PREVIEW")
         match = Handler.re_m_PREVIEW.match(message)
         if not match:
             raise HTTPErrorResponse(400, "Malformed PREVIEW message {0}".format(message))
-        gdl = match.group(1)
+        gdl = GDL(match.group(1))
         previewclock = int(match.group(2))
-        timeout = Timeout(timestamp, previewclock)
+        timeout = Timeout.from_monotonic(timestamp, previewclock)
         if self._on_PREVIEW: self._on_PREVIEW(timeout, gdl)
-        return self._response("DONE")
+        return self._response("DONE", uppercase)
+
+
+    #---------------------------------------------------------------------------------
+    # Internal functions - preempting the running callback. _check_preempt() is
+    # called for each good message as it is queued; _invoke() runs a callback
+    # (in its own greenlet if preempt is set) and returns _PREEMPTED if it was
+    # killed or skipped.
+    #---------------------------------------------------------------------------------
+    def _check_preempt(self, message):
+        if self._good_conn_queue.qsize() < 2 or self._matchid is None: return
+        match = Handler.re_m_ABORT.match(message)
+        abort = match is not None
+        if not abort: match = Handler.re_m_STOP.match(message)
+        if not match or match.group(1) != self._matchid: return
+        g_logger.info(_fmt("Cancelling the running callback for {0}",
+                           "ABORT" if abort else "STOP"))
+        if self._active_timeout is not None: self._active_timeout.cancel()
+        if abort and self._preempt:
+            self._aborting = self._matchid
+            if self._active_callback is not None: self._active_callback.kill(block=False)
+
+    def _invoke(self, callback, *args, **kwargs):
+        if not self._preempt: return callback(*args, **kwargs)
+        if self._aborting is not None and self._aborting == self._matchid: return _PREEMPTED
+        self._active_callback = spawn(callback, *args, **kwargs)
+        try:
+            result = self._active_callback.get()
+        finally:
+            self._active_callback = None
+        if isinstance(result, GreenletExit): return _PREEMPTED
+        return result
 
+    #---------------------------------------------------------------------------------
+    # The number of good messages waiting behind the one being handled.
+    #---------------------------------------------------------------------------------
+    @property
+    def backlog(self):
+        return max(0, self._good_conn_queue.qsize() - 1)
+
+    #---------------------------------------------------------------------------------
+    # Internal functions - catching up. A PLAY is stale if a later PLAY or STOP
+    # for the same match is waiting in the good connection queue.
+    #---------------------------------------------------------------------------------
+    def _add_stale(self, kwargs, matchid):
+        if not self._catch_up: return
+        stale = False
+        for queued in list(self._good_conn_queue.queue)[1:]:
+            match = Handler.re_m_SPS_MATCHID.match(queued.message)
+            if match and match.group(2) == matchid and match.group(1).upper() != "START":
+                stale = True
+                break
+        if stale:
+            g_logger.warning(_fmt("Catching up: PLAY is stale with a backlog of {0}",
+                                  self.backlog))
+        kwargs["stale"] = stale
 
     #---------------------------------------------------------------------------------
     # Internal functions - work out the case for talking to the game server
     #---------------------------------------------------------------------------------
     def _set_case(self, message, command="START"):
+        self._uppercase = self._message_case(message, command)
+
+    # The case of a message (True for uppercase)
+    def _message_case(self, message, command):
         uc = r'^\s*\(\s*{0}'.format(command.upper())
         lc = r'^\s*\(\s*{0}'.format(command.lower())
 
-        if re.match(uc, message): self._uppercase = True
-        elif re.match(lc, message): self._uppercase = False
-        else:
-            g_logger.warning(("Cannot determine case used by game server, "
-                              "so defaulting to uppercase responses"))
-            self._uppercase = True
+        if re.match(uc, message): return True
+        elif re.match(lc, message): return False
+        g_logger.warning(("Cannot determine case used by game server, "
+                          "so defaulting to uppercase responses"))
+        return True
 
 
     #---------------------------------------------------------------------------------
-    # Maintain a list of roles in the same order as it appears in the GDL.
-    # _roles_in_correct_order(self, gdl)
+    # Internal functions - extract the actions/observations from PLAY/STOP messages
+    # in the format selected by the action_spans/structured_actions options.
     #---------------------------------------------------------------------------------
-    def _roles_in_correct_order(self, gdl):
-        self._roles = []
-        exp = parse_simple_sexp("({0})".format(gdl))
-        for pexp in exp:
-            if type(pexp) == type([]) and len(pexp) == 2:
-                if self.re_m_GDL_ROLE.match(pexp[0]):
-                    self._roles.append(pexp[1])
-        if not self._roles: raise ValueError("Invalid GDL has no roles")
+    def _parse_actions(self, actionstr):
+        if self._structured_actions: return parse_actions_exp(actionstr)
+        return parse_actions_sexp(actionstr, self._action_spans or self._integer_actions)
+
+    def _parse_gdl2_playstop(self, mtype, message, component):
+        (turn, action, observations) = \
+            _parse_gdl2_playstop_component(mtype, message, component,
+                                           self._action_spans or self._integer_actions,
+                                           self._structured_actions)
+        if self._integer_actions:
+            if action is not None: action = self._symbols.actions.intern(action)
+            observations = self._symbols.observations.encode(observations)
+            if self._observation_arrays:
+                from ggputils.observations import to_id_array
+                observations = to_id_array(observations)
+        return (turn, action, observations)
+
+    def _joint_actions(self, actions):
+        if self._integer_actions: return self._symbols.actions.encode(actions)
+        return dict(zip(self._roles, actions))
+
+    #---------------------------------------------------------------------------------
+    # Internal functions - the timeouts passed to the callbacks. Each is a clone
+    # with its timer started, so its cancelled flag is set at the deadline. The
+    # timeout of the previous message is cancelled when the next one (or an
+    # ABORT) is handled.
+    #---------------------------------------------------------------------------------
+    def _callback_timeout(self, timeout):
+        self._cancel_callback_timeout()
+        self._active_timeout = timeout.clone().start_timer()
+        return self._active_timeout
+
+    def _cancel_callback_timeout(self):
+        if self._active_timeout is not None: self._active_timeout.cancel()
+        self._active_timeout = None
+
+    #---------------------------------------------------------------------------------
+    # Internal functions - the opening book. The history is kept in canonical
+    # form, independent of the format of the actions passed to the callbacks.
+    # It is built from the actions (and for GDL-II the turn and observations)
+    # that handle_PLAY has already parsed. Returns the keyword arguments for
+    # the on_play/on_play2 callbacks.
+    #---------------------------------------------------------------------------------
+    def _book_lookup(self, actions, turn=None, observations=()):
+        if self._opening_book is None: return {}
+        if self._book_record is None: return {"book_move": None}
+        if turn is None:
+            if len(actions): self._book_history.append(self._book_terms(actions, "actions"))
+        elif turn > 0:
+            (action,) = self._book_terms(actions, "actions")
+            observations = tuple(sorted(set(self._book_terms(observations, "observations"))))
+            self._book_history.append((action, observations))
+        record = self._book_record
+        move = self._opening_book.lookup(record.game_hash, record.role,
+                                         tuple(self._book_history))
+        if move is not None: g_logger.info(_fmt("Opening book move: {0}", move))
+        return {"book_move": move}
+
+    # Only the spans (which keep the whitespace of the message) need to be
+    # re-parsed, the other formats are canonical or can be serialised directly
+    def _book_terms(self, terms, table):
+        if self._integer_actions:
+            table = getattr(self._symbols, table)
+            return tuple(None if t is None else table.symbol(t) for t in terms)
+        if self._structured_actions:
+            return tuple(None if t is None else exp_to_sexp(t) for t in terms)
+        if self._action_spans:
+            return tuple(None if t is None else exp_to_sexp(parse_simple_sexp(t))
+                         for t in terms)
+        return tuple(terms)
+
+    def _book_finish(self):
+        if self._book_record is None: return
+        self._opening_book.last_match = self._book_record
+        self._book_record = None
+
+    #---------------------------------------------------------------------------------
+    # Internal functions - preprocess a START message: match the message,
+    # extract the roles (in the order they appear in the GDL) and compute the
+    # GDL views that are needed by the options. Large messages are handed to
+    # the gevent thread pool and waited for cooperatively (see offload_threshold).
+    # Returns a _StartMessage, with any error stored rather than raised.
+    #---------------------------------------------------------------------------------
+    def _prepare_START(self, message):
+        if self._offload_threshold is None or len(message) < self._offload_threshold:
+            return self._preprocess_START(message)
+        return get_hub().threadpool.apply(self._preprocess_START, (message,))
+
+    def _preprocess_START(self, message):
+        match = Handler.re_m_START.match(message)
+        if not match:
+            return _StartMessage(error=HTTPErrorResponse(
+                400, "Malformed START message {0}".format(message)))
+        start = _StartMessage(match.group(1), match.group(2), GDL(match.group(3)),
+                              int(match.group(4)), int(match.group(5)))
+        try:
+            if not start.gdl.roles: raise ValueError("Invalid GDL has no roles")
+            if self._integer_actions:
+                start.symbols = MatchSymbols.from_gdl_exp(start.gdl.exp)
+            if self._knowledge_base: start.gdl.kb
+            if self._game_hash or self._opening_book is not None: start.gdl.hash
+        except Exception as e:
+            start.error = e
+        return start
 
 
 #---------------------------------------------------------------------------------
@@ -599,6 +970,26 @@ class Handler(object):
 # Internal support functions and classes
 #---------------------------------------------------------------------------------
 
+# Returned by Handler._invoke() for a preempted callback
+_PREEMPTED = object()
+
+# A good connection waiting in the queue
+class _QueuedMessage(AsyncResult):
+    def __init__(self, message):
+        AsyncResult.__init__(self)
+        self.message = message
+
+class _StartMessage(object):
+    def __init__(self, matchid=None, role=None, gdl=None, startclock=None,
+                 playclock=None, error=None):
+        self.matchid = matchid
+        self.role = role
+        self.gdl = gdl
+        self.startclock = startclock
+        self.playclock = playclock
+        self.symbols = None
+        self.error = error
+
 class HTTPErrorResponse(Exception):
     def __init__(self, status, message):
         Exception.__init__(self, message)
@@ -608,12 +999,13 @@ class HTTPErrorResponse(Exception):
         return "{0} {1}".format(self.status, self.message)
 
 #---------------------------------------------------------------------------------
-# _get_response_headers(environ_dict, response_body)
+# _get_response_headers(environ_dict, response_body, encoding=None)
 # Returns a sensible reponse header. Input is the original evironment
-# dictionary and the response_body (used for calculating the context-length).
+# dictionary and the response_body (used for calculating the context-length)
+# and the content encoding of the body (if it is compressed).
 # Output a list of tuples of (variable, value) pairs.
 #---------------------------------------------------------------------------------
-def _get_response_headers(environ, response_body):
+def _get_response_headers(environ, response_body, encoding=None):
     newenv = []
     try:
         # Adjust the content type header to match the game controller
@@ -624,6 +1016,9 @@ def _get_response_headers(environ, response_body):
 
         # Now the other headers
         newenv.append(('Content-Length', str(len(response_body))))
+        if encoding:
+            newenv.append(('Content-Encoding', encoding))
+            newenv.append(('Vary', 'Accept-Encoding'))
         newenv.append(('Access-Control-Allow-Origin', '*'))
 #        newenv.append(('Access-Control-Allow-Method', 'POST, GET, OPTIONS'))
         newenv.append(('Access-Control-Allow-Method', 'POST'))
@@ -635,52 +1030,173 @@ def _get_response_headers(environ, response_body):
 
 
 #---------------------------------------------------------------------------------
-# _get_http_post(environ)
+# _get_http_post(environ, max_size)
 # Checks that it is a valid http post message and returns the content of the message.
+# The body can have a Content-Length or be sent with chunked transfer-encoding
+# (the WSGI server removes the chunk framing; the body is read until the end
+# of the input). A body compressed with gzip or deflate (the Content-Encoding
+# header) is decompressed as it is read, a block at a time. The size of the
+# (decompressed) message is limited to max_size bytes.
 # NOTE: should be call only once because the 'wsgi.input' object is a stream object
 #       so will be empty once it has been read.
 #---------------------------------------------------------------------------------
-def _get_http_post(environ):
+_MAX_MESSAGE_SIZE = 1 << 28
+_READ_BLOCK_SIZE = 1 << 16
+
+def _get_http_post(environ, max_size=_MAX_MESSAGE_SIZE):
     try:
         if environ.get('REQUEST_METHOD') != "POST":
             raise HTTPErrorResponse(405, 'Non-POST method not supported')
-        request_body_size = int(environ.get('CONTENT_LENGTH'))
-        if request_body_size <= 5:
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding == 'identity': encoding = ''
+        if encoding and encoding not in _DECODERS:
+            raise HTTPErrorResponse(415, 'Unsupported content encoding')
+        if environ.get('CONTENT_LENGTH'):
+            request_body_size = int(environ.get('CONTENT_LENGTH'))
+            if request_body_size <= 5:
+                raise HTTPErrorResponse(400, 'Message content too short to be meaningful')
+            if not encoding:
+                if request_body_size > max_size:
+                    raise HTTPErrorResponse(413, 'Message content too large')
+                return environ['wsgi.input'].read(request_body_size)
+        elif 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            request_body_size = None
+        else:
+            raise HTTPErrorResponse(411, 'Content length required')
+        message = _read_body(environ['wsgi.input'], request_body_size, encoding, max_size)
+        if len(message) <= 5:
             raise HTTPErrorResponse(400, 'Message content too short to be meaningful')
-        return environ['wsgi.input'].read(request_body_size)
+        return message
     except HTTPErrorResponse:
         raise
     except Exception as e:
         g_logger.warning(_fmt("HTTP POST exception: {0}", e))
         raise HTTPErrorResponse(400, 'Invalid content')
 
+# zlib window bits for each encoding. "deflate" should be zlib wrapped but
+# some clients send raw deflate data, so that is tried if the header is bad.
+_DECODERS = {'gzip': 16 + zlib.MAX_WBITS, 'x-gzip': 16 + zlib.MAX_WBITS,
+             'deflate': zlib.MAX_WBITS}
+
+# Read a body of the given size (or to the end of the input if size is None)
+# a block at a time, decompressing each block as it arrives.
+def _read_body(stream, size, encoding, max_size):
+    decoder = zlib.decompressobj(_DECODERS[encoding]) if encoding else None
+    chunks = []
+    total = 0
+    first = True
+    while size is None or size > 0:
+        data = stream.read(_READ_BLOCK_SIZE if size is None else min(size, _READ_BLOCK_SIZE))
+        if not data:
+            if size is None: break
+            raise HTTPErrorResponse(400, 'Truncated message content')
+        if size is not None: size -= len(data)
+        if decoder is None:
+            chunk = data
+        else:
+            try:
+                chunk = decoder.decompress(data, max_size + 1 - total)
+            except zlib.error:
+                if not (first and encoding == 'deflate'): raise
+                decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                chunk = decoder.decompress(data, max_size + 1 - total)
+            if decoder.unconsumed_tail:
+                raise HTTPErrorResponse(413, 'Message content too large')
+        first = False
+        total += len(chunk)
+        if total > max_size: raise HTTPErrorResponse(413, 'Message content too large')
+        chunks.append(chunk)
+    if decoder is not None:
+        if decoder.unused_data or not _decoder_finished(decoder):
+            raise HTTPErrorResponse(400, 'Truncated or invalid compressed content')
+        chunks.append(decoder.flush())
+    return b''.join(chunks)
+
+# Whether a decompressor has reached the end of the compressed stream. Python 2
+# has no eof attribute, but data after the end of the stream is left unused.
+def _decoder_finished(decoder):
+    if hasattr(decoder, "eof"): return decoder.eof
+    probe = decoder.copy()
+    try:
+        probe.decompress(b"\0")
+    except zlib.error:
+        return False
+    return probe.unused_data == b"\0"
+
+#---------------------------------------------------------------------------------
+# _encode_response(environ, response_body, minimum)
+# Compress a response body with gzip if the client accepts it and the body is
+# at least minimum bytes long. Returns the (possibly compressed) body and its
+# content encoding (or None).
+#---------------------------------------------------------------------------------
+def _encode_response(environ, response_body, minimum):
+    if not response_body or len(response_body) < minimum: return (response_body, None)
+    if not _accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')):
+        return (response_body, None)
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (encoder.compress(response_body) + encoder.flush(), 'gzip')
+
+def _accepts_gzip(accept_encoding):
+    for item in accept_encoding.split(','):
+        params = item.split(';')
+        if params[0].strip().lower() not in ('gzip', 'x-gzip'): continue
+        for param in params[1:]:
+            (name, _, value) = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    if float(value) <= 0.0: return False
+                except ValueError:
+                    return False
+        return True
+    return False
+
 
 #---------------------------------------------------------------------------------
 # parse part of a GDL-II play/stop message consisting of:
 #    "<turn> <lastmove> <observations>"
-# Returns a triple of these elements.
+# Returns a triple of these elements. If spans is True then the last move
+# and the observations are slices of the original message text (see
+# ggputils.utils.split_sexp()) rather than being parsed and re-serialised.
+# If structured is True then they are returned as parsed expressions.
 # ---------------------------------------------------------------------------------
 
-def _parse_gdl2_playstop_component(mtype, message, component):
+def _parse_gdl2_playstop_component(mtype, message, component, spans=False,
+                                   structured=False):
     error="Malformed GDL-II {0} message {1}".format(mtype, message)
 
     # Handle the turn part first
     match = re.match(r'^\s*(\d+)\s+(.*)\s*$', component)
     if not match: raise HTTPErrorResponse(400, error)
     turn=int(match.group(1))
+
+    if spans:
+        try:
+            exp = split_sexp_sequence(match.group(2))
+        except ValueError:
+            raise HTTPErrorResponse(400, error)
+        if len(exp) != 2: raise HTTPErrorResponse(400, error)
+        lastaction = exp[0]
+        if lastaction == "NIL": lastaction=None
+        if turn == 0 and lastaction: raise HTTPErrorResponse(400, error)
+        if exp[1][0] != '(':
+            if exp[1] != "NIL": raise HTTPErrorResponse(400, error)
+            return (turn, lastaction, [])
+        return (turn, lastaction, split_sexp(exp[1]))
+
     tmpstr=match.group(2)
 
     # Parse the remaining <lastmove> <observations> as an sexpression
     exp=parse_simple_sexp("({0})".format(tmpstr))
     if type(exp) == type(''): raise HTTPErrorResponse(400, error)
     if len(exp) != 2: raise HTTPErrorResponse(400, error)
-    lastaction = exp_to_sexp(exp[0])
+    lastaction = exp[0] if structured else exp_to_sexp(exp[0])
     if lastaction == "NIL": lastaction=None
     if turn == 0 and lastaction: raise HTTPErrorResponse(400, error)
     if type(exp[1]) == type(''):
         if exp[1] != "NIL": raise HTTPErrorResponse(400, error)
         return (turn, lastaction, [])
 
+    if structured: return (turn, lastaction, exp[1])
     observations = []
     for oexp in exp[1]:
         observations.append(exp_to_sexp(oexp))
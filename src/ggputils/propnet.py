@@ -0,0 +1,500 @@
+#---------------------------------------------------------------------------------
+#
+# A propositional network (propnet) compiler for GDL games that are small
+# enough to ground, with NumPy based evaluation.
+#
+# Compilation:
+#
+# - A relaxed version of the game (negations dropped, "true" fed by "init"
+#   and "next", "does" fed by "legal") is evaluated to find every fluent,
+#   move and view that could ever be true. These bound the grounding.
+#
+# - Each rule for a state dependent relation is grounded against the relaxed
+#   model (static relations are evaluated exactly, once, by the reasoner and
+#   then disappear from the network). A ground rule is a conjunction of
+#   (possibly negated) propositions and a view proposition is the
+#   disjunction of its ground rules.
+#
+# - Every proposition has a row in a value matrix. The rows are: the False
+#   and True constants, the base propositions (true ...), the input
+#   propositions (does ...) and then the views. The views are split into
+#   layers, where a layer only depends on earlier layers (recursive views
+#   share a layer that is iterated to a fixpoint). The layers that don't
+#   depend on the inputs are evaluated first (legal, goal, terminal), then
+#   the ones that do (next, sees).
+#
+# Evaluation:
+#
+# The value matrix has one column per state, so a batch of states is
+# evaluated at once. A layer is evaluated with a few NumPy operations:
+# gather the inputs of all its conjunctions, reduce with all() (and any()
+# for the negated inputs), then reduce the conjunctions of each view with
+# logical_or.reduceat().
+#
+# PropNetStateMachine provides the same interface as the reasoner's
+# StateMachine (with frozenset states) plus batched operations on state
+# matrices, including vectorised random rollouts, which is where most of
+# the speed-up comes from.
+#
+# Building a PropNet without NumPy raises ImportError. The reasoner in
+# ggputils.reasoner is pure Python and can be used instead.
+#
+#---------------------------------------------------------------------------------
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import random
+from ggputils.gdl import KnowledgeBase, Rule, relation, _tarjan, \
+    INIT, TRUE, NEXT, LEGAL, DOES, GOAL, TERMINAL, SEES
+from ggputils.reasoner import Reasoner, PreparedRule, Relation, to_term, _exp_to_term
+
+#---------------------------------------------------------------------------------
+# Constant proposition rows
+#---------------------------------------------------------------------------------
+FALSE_ID = 0
+TRUE_ID = 1
+
+#---------------------------------------------------------------------------------
+# PropNet: the compiled network. The interesting attributes are:
+#
+# - base: the fluent terms of the base propositions (the rows of a state).
+# - inputs: the (role, move) terms of the input propositions.
+# - init: the initial state as a boolean vector over the base propositions.
+# - next_ids: the row of the (next f) proposition of each base proposition.
+# - terminal_id: the row of the terminal proposition.
+# - legal_ids, legal_inputs: per role, the rows of the legal propositions and
+#   the index of the matching input proposition.
+# - goal_ids, goal_values: per role, the rows of the goal propositions and
+#   their values.
+# - sees: per role, the observation terms and the rows of their propositions.
+#
+# A ValueError is raised if grounding the game produces more than
+# max_conjunctions ground rules.
+#---------------------------------------------------------------------------------
+
+class PropNet(object):
+    def __init__(self, kb, max_conjunctions=1000000):
+        if np is None:
+            raise ImportError("NumPy is required for the propositional network")
+        if not isinstance(kb, KnowledgeBase): kb = KnowledgeBase.from_gdl(kb)
+        self._kb = kb
+        self._max_conjunctions = max_conjunctions
+        self.roles = [to_term(r) for r in kb.roles]
+
+        reasoner = Reasoner(kb)
+        self._reasoner = reasoner
+        relaxed = _relaxed_model(kb)
+        self._ground(kb, reasoner, relaxed)
+        self._build_layers()
+        self._build_outputs(reasoner)
+
+    @property
+    def kb(self):
+        return self._kb
+
+    @property
+    def num_propositions(self):
+        return len(self._props)
+
+    @property
+    def num_conjunctions(self):
+        return sum(len(c) for c in self._conjunctions.values())
+
+    #-----------------------------------------------------------------------------
+    # Evaluate the state dependent propositions for a batch of states (a
+    # boolean matrix with one row per base proposition and one column per
+    # state). Returns the value matrix.
+    #-----------------------------------------------------------------------------
+    def evaluate_state(self, states):
+        values = np.zeros((len(self._props), states.shape[1]), dtype=np.bool_)
+        values[TRUE_ID] = True
+        values[self._base_start:self._base_start + len(self.base)] = states
+        for layer in self._state_layers: _evaluate_layer(values, layer)
+        return values
+
+    #-----------------------------------------------------------------------------
+    # Given the value matrix of a batch of states and the inputs (a boolean
+    # matrix with one row per input proposition) return the next states.
+    #-----------------------------------------------------------------------------
+    def evaluate_next(self, values, inputs):
+        values[self._input_start:self._input_start + len(self.inputs)] = inputs
+        for layer in self._move_layers: _evaluate_layer(values, layer)
+        return values[self.next_ids]
+
+    #-----------------------------------------------------------------------------
+    # Internal functions: grounding
+    #-----------------------------------------------------------------------------
+    def _ground(self, kb, reasoner, relaxed):
+        dynamic = set()
+        for component in reasoner.state_components + reasoner.move_components:
+            dynamic.update(component)
+        self._dynamic = dynamic
+
+        # Propositions: constants, base, inputs and then views (added on demand)
+        self._props = [("false", ()), ("true", ())]
+        self._prop_ids = {}
+        self._views_start = None
+        self._base_start = len(self._props)
+        self.base = sorted(args[0] for args in relaxed[TRUE])
+        for f in self.base: self._add_prop(TRUE, (f,))
+        self._input_start = len(self._props)
+        self.inputs = sorted(relaxed[DOES].tuples)
+        for args in self.inputs: self._add_prop(DOES, args)
+        self._views_start = len(self._props)
+
+        store = dict(reasoner.static_store)
+        for key in dynamic | set([TRUE, DOES]):
+            if key in relaxed: store[key] = relaxed[key]
+        self._conjunctions = {}
+        count = 0
+        for key in sorted(dynamic):
+            for fact in kb.facts(key):
+                pid = self._add_prop(key, tuple(_exp_to_term(a) for a in _args(fact)))
+                self._conjunctions.setdefault(pid, []).append(((), ()))
+            for rule in kb.rules(key):
+                count += self._ground_rule(rule, store)
+                if count > self._max_conjunctions:
+                    raise ValueError(("Game is too large to ground (more than {0} "
+                                      "conjunctions)").format(self._max_conjunctions))
+
+    def _ground_rule(self, rule, store):
+        # Join everything except the negated state dependent literals, which
+        # become negated inputs of the conjunction.
+        body = [l for l in rule.body if not (_is_negative(l) and
+                                             relation(l[1]) in self._dynamic)]
+        prepared = PreparedRule(Rule(rule.head, body))
+        prepared.head = tuple(range(len(prepared.variables)))
+        names = prepared.variables
+        envs = []
+        self._reasoner._fire(prepared, store, envs.append)
+
+        count = 0
+        for env in envs:
+            binding = dict(zip(names, env))
+            pos = []
+            neg = []
+            for lit in rule.body:
+                negative = _is_negative(lit)
+                atom = lit[1] if negative else lit
+                key = relation(atom)
+                if key not in self._dynamic and key not in (TRUE, DOES): continue
+                pid = self._add_prop(key, _ground_args(atom, binding))
+                if negative: neg.append(pid)
+                else: pos.append(pid)
+            head = self._add_prop(rule.relation, _ground_args(rule.head, binding))
+            self._conjunctions.setdefault(head, []).append((tuple(pos), tuple(neg)))
+            count += 1
+        return count
+
+    def _add_prop(self, key, args):
+        pid = self._prop_ids.get((key, args))
+        if pid is None:
+            # A fluent or move that is not in the relaxed model is never true
+            if self._views_start is not None and key in (TRUE, DOES): return FALSE_ID
+            pid = len(self._props)
+            self._props.append((key, args))
+            self._prop_ids[(key, args)] = pid
+        return pid
+
+    #-----------------------------------------------------------------------------
+    # Internal functions: layering
+    #-----------------------------------------------------------------------------
+    def _build_layers(self):
+        nprops = len(self._props)
+        graph = {}
+        for pid in range(self._views_start, nprops):
+            deps = set()
+            for (pos, neg) in self._conjunctions.get(pid, ()):
+                deps.update(p for p in pos if p >= self._views_start)
+                deps.update(p for p in neg if p >= self._views_start)
+            graph[pid] = sorted(deps)
+
+        # Which views depend on the inputs
+        on_input = set()
+        input_ids = set(range(self._input_start, self._views_start))
+        level = {}
+        cyclic = set()
+        for component in _tarjan(graph):
+            members = set(component)
+            lvl = 1
+            moves = False
+            for pid in component:
+                for (pos, neg) in self._conjunctions.get(pid, ()):
+                    for p in pos + neg:
+                        if p in input_ids or p in on_input: moves = True
+                        if p in level and p not in members: lvl = max(lvl, level[p] + 1)
+                        if p in members and (len(component) > 1 or p == pid):
+                            cyclic.add(pid)
+            for pid in component:
+                level[pid] = lvl
+                if moves: on_input.add(pid)
+
+        self._state_layers = self._make_layers([p for p in level if p not in on_input],
+                                               level, cyclic)
+        self._move_layers = self._make_layers([p for p in level if p in on_input],
+                                              level, cyclic)
+
+    def _make_layers(self, pids, level, cyclic):
+        bylevel = {}
+        for pid in pids:
+            if self._conjunctions.get(pid): bylevel.setdefault(level[pid], []).append(pid)
+        layers = []
+        for lvl in sorted(bylevel):
+            targets = sorted(bylevel[lvl])
+            conjs = []
+            starts = []
+            for pid in targets:
+                starts.append(len(conjs))
+                conjs.extend(self._conjunctions[pid])
+            maxpos = max(len(pos) for (pos, neg) in conjs)
+            maxneg = max(len(neg) for (pos, neg) in conjs)
+            pos = np.full((len(conjs), maxpos), TRUE_ID, dtype=np.intp)
+            neg = np.full((len(conjs), maxneg), FALSE_ID, dtype=np.intp)
+            for (i, (p, n)) in enumerate(conjs):
+                pos[i, :len(p)] = p
+                neg[i, :len(n)] = n
+            iterate = any(pid in cyclic for pid in targets)
+            layers.append((np.array(targets, dtype=np.intp), pos, neg,
+                           np.array(starts, dtype=np.intp), iterate))
+        return layers
+
+    #-----------------------------------------------------------------------------
+    # Internal functions: the output propositions
+    #-----------------------------------------------------------------------------
+    def _build_outputs(self, reasoner):
+        ids = self._prop_ids
+        init = reasoner.static_store.get(INIT)
+        init = set(args[0] for args in init) if init else set()
+        self.init = np.array([f in init for f in self.base], dtype=np.bool_)
+        self.next_ids = np.array([ids.get((NEXT, (f,)), FALSE_ID) for f in self.base],
+                                 dtype=np.intp)
+        self.terminal_id = ids.get((TERMINAL, ()), FALSE_ID)
+
+        # Per role: the legal moves (as indexes into the inputs), and goals
+        input_index = dict((args, i) for (i, args) in enumerate(self.inputs))
+        self.legal_ids = []
+        self.legal_inputs = []
+        self.goal_ids = []
+        self.goal_values = []
+        self.sees = []
+        for role in self.roles:
+            legal = [(args, pid) for ((key, args), pid) in ids.items()
+                     if key == LEGAL and args[0] == role and args in input_index]
+            legal.sort()
+            self.legal_ids.append(np.array([pid for (a, pid) in legal], dtype=np.intp))
+            self.legal_inputs.append(np.array([input_index[a] for (a, pid) in legal],
+                                              dtype=np.intp))
+            goals = [(int(args[1]), pid) for ((key, args), pid) in ids.items()
+                     if key == GOAL and args[0] == role]
+            goals.sort()
+            self.goal_ids.append(np.array([pid for (v, pid) in goals], dtype=np.intp))
+            self.goal_values.append(np.array([v for (v, pid) in goals], dtype=np.int64))
+            sees = [(args[1], pid) for ((key, args), pid) in ids.items()
+                    if key == SEES and args[0] == role]
+            sees.sort()
+            self.sees.append(([o for (o, pid) in sees],
+                              np.array([pid for (o, pid) in sees], dtype=np.intp)))
+
+#---------------------------------------------------------------------------------
+# PropNetStateMachine: the StateMachine interface on top of a PropNet plus
+# batched operations on state matrices.
+#---------------------------------------------------------------------------------
+
+class PropNetStateMachine(object):
+    def __init__(self, kb, propnet=None):
+        self._net = propnet if propnet is not None else PropNet(kb)
+        self._kb = self._net.kb
+        self._base_index = dict((f, i) for (i, f) in enumerate(self._net.base))
+        self._role_index = dict((r, i) for (i, r) in enumerate(self._net.roles))
+        self._input_index = dict((args, i) for (i, args) in enumerate(self._net.inputs))
+        self._cache = {}
+
+    @property
+    def kb(self):
+        return self._kb
+
+    @property
+    def propnet(self):
+        return self._net
+
+    @property
+    def roles(self):
+        return self._net.roles
+
+    #-----------------------------------------------------------------------------
+    # The StateMachine interface (states are frozensets of fluent terms)
+    #-----------------------------------------------------------------------------
+    def initial_state(self):
+        return self.vector_to_state(self._net.init)
+
+    def legal_moves(self, state, role):
+        r = self._role_index[to_term(role)]
+        values = self._values(state)
+        inputs = self._net.legal_inputs[r][values[self._net.legal_ids[r], 0]]
+        return [self._net.inputs[i][1] for i in inputs]
+
+    def legal_joint_moves(self, state):
+        return [self.legal_moves(state, r) for r in self.roles]
+
+    def is_terminal(self, state):
+        return bool(self._values(state)[self._net.terminal_id, 0])
+
+    def goal(self, state, role):
+        r = self._role_index[to_term(role)]
+        return self._goal(self._values(state), r)[0]
+
+    def goals(self, state):
+        values = self._values(state)
+        return [self._goal(values, r)[0] for r in range(len(self.roles))]
+
+    def next_state(self, state, joint):
+        return self.vector_to_state(self._move_values(state, joint)[self._net.next_ids, 0])
+
+    # GDL-II: the observations of a role for a joint move
+    def sees(self, state, joint, role):
+        r = self._role_index[to_term(role)]
+        (observations, ids) = self._net.sees[r]
+        values = self._move_values(state, joint)
+        return [observations[i] for i in np.flatnonzero(values[ids, 0])]
+
+    def random_rollout(self, state, rng=random):
+        while not self.is_terminal(state):
+            joint = [rng.choice(self.legal_moves(state, r)) for r in self.roles]
+            state = self.next_state(state, joint)
+        return state
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    #-----------------------------------------------------------------------------
+    # Conversion between states and base proposition vectors
+    #-----------------------------------------------------------------------------
+    def state_to_vector(self, state):
+        vector = np.zeros(len(self._net.base), dtype=np.bool_)
+        for f in state:
+            i = self._base_index.get(f)
+            if i is not None: vector[i] = True
+        return vector
+
+    def vector_to_state(self, vector):
+        base = self._net.base
+        return frozenset(base[i] for i in np.flatnonzero(vector))
+
+    #-----------------------------------------------------------------------------
+    # Batched operations. A batch of states is a boolean matrix with one row
+    # per base proposition and one column per state.
+    #-----------------------------------------------------------------------------
+    def batch(self, states):
+        return np.column_stack([self.state_to_vector(s) for s in states])
+
+    def terminal_batch(self, states):
+        return self._net.evaluate_state(states)[self._net.terminal_id]
+
+    def goals_batch(self, states):
+        values = self._net.evaluate_state(states)
+        return np.array([self._goal(values, r) for r in range(len(self.roles))])
+
+    #-----------------------------------------------------------------------------
+    # Run num random rollouts (simultaneously) from a state. Returns the goal
+    # values as a matrix with one row per role and one column per rollout.
+    #-----------------------------------------------------------------------------
+    def random_rollouts(self, state, num, rng=None, max_steps=10000):
+        if rng is None: rng = np.random
+        net = self._net
+        states = np.repeat(self.state_to_vector(state)[:, None], num, axis=1)
+        columns = np.arange(num)
+        for step in range(max_steps):
+            values = net.evaluate_state(states)
+            terminal = values[net.terminal_id]
+            if terminal.all(): break
+            inputs = np.zeros((len(net.inputs), num), dtype=np.bool_)
+            for r in range(len(self.roles)):
+                legal = values[net.legal_ids[r]]
+                if not legal.shape[0]: continue
+                weights = rng.random_sample(legal.shape)
+                weights[~legal] = -1.0
+                choice = weights.argmax(axis=0)
+                chosen = legal[choice, columns]
+                inputs[net.legal_inputs[r][choice[chosen]], columns[chosen]] = True
+            nexts = net.evaluate_next(values, inputs)
+            states = np.where(terminal, states, nexts)
+        return np.array([self._goal(values, r) for r in range(len(self.roles))])
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    def _values(self, state):
+        values = self._cache.get(state)
+        if values is None:
+            values = self._net.evaluate_state(self.state_to_vector(state)[:, None])
+            if len(self._cache) >= 1024: self._cache.clear()
+            self._cache[state] = values
+        return values
+
+    def _move_values(self, state, joint):
+        if isinstance(joint, dict): joint = [joint[r] for r in self._kb.roles]
+        values = self._values(state).copy()
+        inputs = np.zeros((len(self._net.inputs), 1), dtype=np.bool_)
+        for (role, move) in zip(self.roles, joint):
+            i = self._input_index.get((role, to_term(move)))
+            if i is not None: inputs[i, 0] = True
+        self._net.evaluate_next(values, inputs)
+        return values
+
+    def _goal(self, values, r):
+        ids = self._net.goal_ids[r]
+        if not len(ids):
+            return [None] * values.shape[1]
+        goals = np.where(values[ids], self._net.goal_values[r][:, None], -1).max(axis=0)
+        return [int(g) if g >= 0 else None for g in goals]
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+def _args(literal):
+    if type(literal) == list: return literal[1:]
+    return []
+
+def _is_negative(literal):
+    return type(literal) == list and literal[0] == "not"
+
+def _ground_args(literal, binding):
+    return tuple(_ground(a, binding) for a in _args(literal))
+
+def _ground(exp, binding):
+    if type(exp) == list: return tuple(_ground(e, binding) for e in exp)
+    return binding.get(exp, exp)
+
+# Evaluate one layer of the network in place
+def _evaluate_layer(values, layer):
+    (targets, pos, neg, starts, iterate) = layer
+    if iterate: values[targets] = False
+    while True:
+        conj = values[pos].all(axis=1)
+        if neg.shape[1]: conj &= ~values[neg].any(axis=1)
+        result = np.logical_or.reduceat(conj, starts, axis=0)
+        if not iterate or (result == values[targets]).all():
+            values[targets] = result
+            return
+        values[targets] = result
+
+# The relaxed model: every fluent, move and view that could be true.
+def _relaxed_model(kb):
+    sentences = []
+    for key in kb.relations():
+        sentences.extend(kb.facts(key))
+        for rule in kb.rules(key):
+            sentences.append(["<=", rule.head] + [l for l in rule.body if not _is_negative(l)])
+    sentences.append(["<=", ["true", "?x"], ["init", "?x"]])
+    sentences.append(["<=", ["true", "?x"], ["next", "?x"]])
+    sentences.append(["<=", ["does", "?r", "?m"], ["legal", "?r", "?m"]])
+    relaxed = KnowledgeBase(sentences)
+    reasoner = Reasoner(relaxed)
+    store = reasoner.evaluate(relaxed.components, reasoner.static_store)
+    for key in (TRUE, DOES):
+        if key not in store: store[key] = Relation()
+    return store
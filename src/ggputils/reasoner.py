@@ -0,0 +1,528 @@
+#---------------------------------------------------------------------------------
+#
+# A bottom-up (forward chaining) GDL reasoner and a game state machine built
+# on top of it. The StateMachine is constructed from a GDL knowledge base
+# (see ggputils.gdl.KnowledgeBase) and provides the initial state, the legal
+# moves of each role, the next state, the goal values and the terminal test.
+#
+# Evaluation:
+#
+# - The relations are evaluated one strongly connected component of the
+#   dependency graph at a time, in the stratified order computed by the
+#   knowledge base. Recursive components use semi-naive evaluation (each
+#   round only joins against the facts that were new in the previous round).
+#
+# - The body of each rule is joined in an order that is fixed when the rule is
+#   prepared: filters (distinct, not) are placed as soon as their variables are
+#   bound and the relation with the most bound arguments is joined next.
+#   Relations are looked up through hash indexes on the bound argument
+#   positions, which are built on demand and then maintained incrementally.
+#
+# - Relations that don't depend on "true" or "does" are static and are
+#   evaluated once. Relations that depend on "true" (legal, goal, terminal and
+#   their views) are evaluated once per state and memoised, so asking for the
+#   legal moves, goals and terminal status of the same state is cheap.
+#   Relations that depend on "does" (next, sees) are evaluated per joint move.
+#
+# Terms:
+#
+# Ground terms are represented as strings (for atoms) and tuples (for
+# compound terms); eg. "(cell 1 2 b)" is ("cell", "1", "2", "b"). A state is
+# a frozenset of the ground fluents that are true. to_term() and
+# term_to_sexp() convert between s-expressions and terms.
+#
+# Example usage:
+#
+#    sm = StateMachine(KnowledgeBase.from_gdl(gdl))
+#    state = sm.initial_state()
+#    while not sm.is_terminal(state):
+#        joint = [random.choice(sm.legal_moves(state, r)) for r in sm.roles]
+#        state = sm.next_state(state, joint)
+#    print(sm.goals(state))
+#
+#---------------------------------------------------------------------------------
+
+import random
+from ggputils.utils import parse_simple_sexp, exp_to_sexp
+from ggputils.gdl import GDL, KnowledgeBase, is_variable, relation, \
+    INIT, TRUE, NEXT, LEGAL, DOES, GOAL, TERMINAL, SEES
+
+#---------------------------------------------------------------------------------
+# Conversion between s-expressions (strings or parsed lists) and terms
+#---------------------------------------------------------------------------------
+
+def to_term(exp):
+    if type(exp) == str:
+        if '(' not in exp: return exp.strip()
+        exp = parse_simple_sexp(exp)
+    return _exp_to_term(exp)
+
+def term_to_exp(term):
+    if type(term) != tuple: return term
+    return [term_to_exp(t) for t in term]
+
+def term_to_sexp(term):
+    return exp_to_sexp(term_to_exp(term))
+
+def _exp_to_term(exp):
+    if type(exp) != list: return exp
+    return tuple(_exp_to_term(e) for e in exp)
+
+#---------------------------------------------------------------------------------
+# Relation holds the ground facts of a relation as a set of argument tuples,
+# together with hash indexes on combinations of argument positions.
+#---------------------------------------------------------------------------------
+
+class Relation(object):
+    __slots__ = ("tuples", "_indexes")
+
+    def __init__(self, tuples=()):
+        self.tuples = set(tuples)
+        self._indexes = {}
+
+    def add(self, args):
+        if args in self.tuples: return False
+        self.tuples.add(args)
+        for (positions, index) in self._indexes.items():
+            key = tuple(args[p] for p in positions)
+            index.setdefault(key, []).append(args)
+        return True
+
+    def lookup(self, positions, key):
+        if not positions: return self.tuples
+        index = self._indexes.get(positions)
+        if index is None:
+            index = {}
+            for args in self.tuples:
+                index.setdefault(tuple(args[p] for p in positions), []).append(args)
+            self._indexes[positions] = index
+        return index.get(key, ())
+
+    def __contains__(self, args):
+        return args in self.tuples
+
+    def __len__(self):
+        return len(self.tuples)
+
+    def __iter__(self):
+        return iter(self.tuples)
+
+_EMPTY = Relation()
+
+#---------------------------------------------------------------------------------
+# A rule prepared for evaluation. Variables are replaced by integer slots in
+# an environment list. The body is a list of operations in join order:
+#
+# - (_REL, relation, argpatterns, bound_positions, steps, new_slots)
+# - (_NOT, relation, argpatterns)
+# - (_DISTINCT, None, (pattern1, pattern2))
+#
+# For a relation literal the bound argument positions are matched by the
+# index lookup, so only the remaining positions need to be unified. These
+# are the steps: (position, pattern, direct) where direct is True if the
+# pattern is a variable that is bound for the first time (a simple
+# assignment). new_slots are the variables first bound by the literal.
+#---------------------------------------------------------------------------------
+
+_REL = 0
+_NOT = 1
+_DISTINCT = 2
+
+class PreparedRule(object):
+    def __init__(self, rule):
+        self.rule = rule
+        self.variables = []
+        self.relation = rule.relation
+        self.head = tuple(self._pattern(a) for a in _args(rule.head))
+        self.body = self._order(rule.body)
+
+    def _pattern(self, exp):
+        if type(exp) == list: return tuple(self._pattern(e) for e in exp)
+        if is_variable(exp):
+            if exp not in self.variables: self.variables.append(exp)
+            return self.variables.index(exp)
+        return exp
+
+    #-----------------------------------------------------------------------------
+    # Fix the join order: filters as early as possible, then the relation
+    # literal with the most bound arguments (fewest new variables).
+    #-----------------------------------------------------------------------------
+    def _order(self, body):
+        literals = []
+        for lit in body:
+            if type(lit) == list and lit[0] == "distinct" and len(lit) == 3:
+                literals.append((_DISTINCT, None, [self._pattern(lit[1]), self._pattern(lit[2])]))
+            elif type(lit) == list and lit[0] == "not":
+                literals.append((_NOT, relation(lit[1]), [self._pattern(a) for a in _args(lit[1])]))
+            else:
+                literals.append((_REL, relation(lit), [self._pattern(a) for a in _args(lit)]))
+
+        ordered = []
+        bound = set()
+        while literals:
+            choice = None
+            for (i, (op, key, pats)) in enumerate(literals):
+                if op != _REL and _slots(pats) <= bound:
+                    choice = i
+                    break
+            if choice is None:
+                best = None
+                for (i, (op, key, pats)) in enumerate(literals):
+                    if op != _REL: continue
+                    unbound = len(_slots(pats) - bound)
+                    nbound = len([p for p in pats if _slots([p]) <= bound])
+                    score = (-nbound, unbound)
+                    if best is None or score < best:
+                        (best, choice) = (score, i)
+            if choice is None:
+                raise ValueError("Unsafe GDL rule: {0}".format(exp_to_sexp(
+                    ["<=", self.rule.head] + self.rule.body)))
+            (op, key, pats) = literals.pop(choice)
+            if op == _REL:
+                positions = tuple(i for (i, p) in enumerate(pats) if _slots([p]) <= bound)
+                new_slots = tuple(sorted(_slots(pats) - bound))
+                steps = []
+                for (i, p) in enumerate(pats):
+                    if i in positions: continue
+                    steps.append((i, p, type(p) == int and p not in bound))
+                    bound |= _slots([p])
+                ordered.append((op, key, tuple(pats), positions, tuple(steps), new_slots))
+            else:
+                ordered.append((op, key, tuple(pats)))
+        if not (_slots(self.head) <= bound):
+            raise ValueError("Unsafe GDL rule: {0}".format(exp_to_sexp(
+                ["<=", self.rule.head] + self.rule.body)))
+        return ordered
+
+#---------------------------------------------------------------------------------
+# Reasoner evaluates the rules of a knowledge base bottom up.
+#---------------------------------------------------------------------------------
+
+class Reasoner(object):
+    def __init__(self, kb):
+        self._kb = kb
+        self._rules = {}
+        for key in kb.relations():
+            rules = kb.rules(key)
+            if rules: self._rules[key] = [self._prepare(r) for r in rules]
+
+        # Classify each component as static, state or move dependent
+        self._static = []
+        self._state = []
+        self._move = []
+        depends = {}
+        for component in kb.components:
+            deps = set()
+            for key in component:
+                if key in (TRUE, DOES): deps.add(key)
+                for (dep, negative) in kb.dependencies(key):
+                    deps |= depends.get(dep, set([dep]) & set([TRUE, DOES]))
+            for key in component: depends[key] = deps
+            if not any(key in self._rules for key in component): continue
+            if DOES in deps: self._move.append(component)
+            elif TRUE in deps: self._state.append(component)
+            else: self._static.append(component)
+
+        # The facts and the static relations
+        self._facts = {}
+        for key in kb.relations():
+            facts = kb.facts(key)
+            if facts: self._facts[key] = Relation(tuple(_exp_to_term(a) for a in _args(f))
+                                                  for f in facts)
+        self._static_store = self.evaluate(self._static, self._facts)
+
+    @property
+    def kb(self):
+        return self._kb
+
+    # Prepare a rule for evaluation. Sub-classes can override this and _fire().
+    def _prepare(self, rule):
+        return PreparedRule(rule)
+
+    @property
+    def static_store(self):
+        return self._static_store
+
+    @property
+    def state_components(self):
+        return self._state
+
+    @property
+    def move_components(self):
+        return self._move
+
+    #-----------------------------------------------------------------------------
+    # Evaluate the given components (in order) over a store, a dictionary of
+    # relation keys to Relation objects. The store is copied (not the
+    # relations in it) and the copy extended with the derived relations is
+    # returned.
+    #-----------------------------------------------------------------------------
+    def evaluate(self, components, store):
+        store = dict(store)
+        for component in components:
+            rules = []
+            for key in component:
+                rules.extend(self._rules.get(key, ()))
+                relation = store.get(key)
+                store[key] = Relation(relation.tuples) if relation else Relation()
+            if len(component) == 1 and not self._kb.is_recursive(component[0]):
+                for rule in rules: self._fire(rule, store, store[rule.relation].add)
+            else:
+                self._seminaive(component, rules, store)
+        return store
+
+    def _seminaive(self, component, rules, store):
+        members = set(component)
+        derived = []
+        for rule in rules:
+            self._fire(rule, store, lambda args, key=rule.relation: derived.append((key, args)))
+        delta = _merge(component, store, derived)
+
+        while any(len(d) for d in delta.values()):
+            derived = []
+            for rule in rules:
+                add = lambda args, key=rule.relation: derived.append((key, args))
+                for (i, op) in enumerate(rule.body):
+                    if op[0] == _REL and op[1] in members and len(delta[op[1]]):
+                        self._fire(rule, store, add, i, delta[op[1]])
+            delta = _merge(component, store, derived)
+
+    #-----------------------------------------------------------------------------
+    # Join the body of a rule and call add() for each derived head. If
+    # delta_pos is given then that body literal is joined against delta
+    # instead of the full relation.
+    #-----------------------------------------------------------------------------
+    def _fire(self, rule, store, add, delta_pos=-1, delta=None):
+        env = [None] * len(rule.variables)
+        body = rule.body
+        head = rule.head
+        nbody = len(body)
+
+        def join(i):
+            if i == nbody:
+                add(tuple(_subst(p, env) for p in head))
+                return
+            op = body[i]
+            if op[0] == _REL:
+                (_, key, pats, positions, steps, new_slots) = op
+                rel = delta if i == delta_pos else store.get(key, _EMPTY)
+                if positions:
+                    candidates = rel.lookup(positions, tuple(_subst(pats[p], env)
+                                                             for p in positions))
+                else:
+                    candidates = rel.tuples
+                for args in candidates:
+                    for slot in new_slots: env[slot] = None
+                    for (pos, pat, direct) in steps:
+                        if direct: env[pat] = args[pos]
+                        elif not _unify(pat, args[pos], env): break
+                    else:
+                        join(i + 1)
+            elif op[0] == _NOT:
+                (_, key, pats) = op
+                args = tuple(_subst(p, env) for p in pats)
+                if args not in store.get(key, _EMPTY): join(i + 1)
+            else:
+                (_, _, (p1, p2)) = op
+                if _subst(p1, env) != _subst(p2, env): join(i + 1)
+        join(0)
+
+#---------------------------------------------------------------------------------
+# StateMachine provides the game semantics on top of a reasoner.
+#---------------------------------------------------------------------------------
+
+class StateMachine(object):
+    def __init__(self, kb, cache_size=1024, reasoner=None):
+        if not isinstance(kb, KnowledgeBase): kb = KnowledgeBase.from_gdl(kb)
+        self._kb = kb
+        self._reasoner = reasoner if reasoner else Reasoner(kb)
+        self._roles = [to_term(r) for r in kb.roles]
+        self._role_index = dict((r, i) for (i, r) in enumerate(self._roles))
+        self._cache = {}
+        self._cache_size = cache_size
+        self._terms = {}
+
+    @property
+    def kb(self):
+        return self._kb
+
+    @property
+    def roles(self):
+        return self._roles
+
+    #-----------------------------------------------------------------------------
+    # The initial state
+    #-----------------------------------------------------------------------------
+    def initial_state(self):
+        init = self._reasoner.static_store.get(INIT, _EMPTY)
+        return frozenset(args[0] for args in init)
+
+    #-----------------------------------------------------------------------------
+    # Queries on a state
+    #-----------------------------------------------------------------------------
+    def legal_moves(self, state, role):
+        role = self._term(role)
+        legal = self._state_store(state).get(LEGAL, _EMPTY)
+        return sorted(args[1] for args in legal.lookup((0,), (role,)))
+
+    def legal_joint_moves(self, state):
+        return [self.legal_moves(state, r) for r in self._roles]
+
+    def is_legal(self, state, role, move):
+        legal = self._state_store(state).get(LEGAL, _EMPTY)
+        return (self._term(role), self._term(move)) in legal
+
+    def is_terminal(self, state):
+        return () in self._state_store(state).get(TERMINAL, _EMPTY)
+
+    def goal(self, state, role):
+        role = self._term(role)
+        values = self._state_store(state).get(GOAL, _EMPTY).lookup((0,), (role,))
+        if not values: return None
+        return max(int(args[1]) for args in values)
+
+    def goals(self, state):
+        return [self.goal(state, r) for r in self._roles]
+
+    #-----------------------------------------------------------------------------
+    # The next state given a joint move. The joint move is either a sequence
+    # of moves ordered like the roles or a dictionary of roles to moves. Moves
+    # can be terms or s-expressions.
+    #-----------------------------------------------------------------------------
+    def next_state(self, state, joint):
+        store = self._move_store(state, joint)
+        return frozenset(args[0] for args in store.get(NEXT, _EMPTY))
+
+    # GDL-II: the observations of a role for a joint move
+    def sees(self, state, joint, role):
+        store = self._move_store(state, joint)
+        role = self._term(role)
+        return sorted(args[1] for args in store.get(SEES, _EMPTY).lookup((0,), (role,)))
+
+    #-----------------------------------------------------------------------------
+    # Play random moves from the state until a terminal state is reached and
+    # return that state.
+    #-----------------------------------------------------------------------------
+    def random_rollout(self, state, rng=random):
+        while not self.is_terminal(state):
+            joint = [rng.choice(self.legal_moves(state, r)) for r in self._roles]
+            state = self.next_state(state, joint)
+        return state
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    def _term(self, exp):
+        if type(exp) != str: return exp
+        term = self._terms.get(exp)
+        if term is None:
+            term = to_term(exp)
+            if len(self._terms) < 65536: self._terms[exp] = term
+        return term
+
+    def _state_store(self, state):
+        store = self._cache.get(state)
+        if store is not None: return store
+        base = dict(self._reasoner.static_store)
+        base[TRUE] = Relation((f,) for f in state)
+        store = self._reasoner.evaluate(self._reasoner.state_components, base)
+        if len(self._cache) >= self._cache_size: self._cache.clear()
+        self._cache[state] = store
+        return store
+
+    def _move_store(self, state, joint):
+        if isinstance(joint, dict):
+            joint = [joint[r] for r in self._kb.roles]
+        base = dict(self._state_store(state))
+        base[DOES] = Relation((r, self._term(m)) for (r, m) in zip(self._roles, joint))
+        return self._reasoner.evaluate(self._reasoner.move_components, base)
+
+#---------------------------------------------------------------------------------
+# StateTracker keeps track of the current state of a match and plugs
+# directly into the SimplePlayer callbacks:
+#
+#    tracker = StateTracker()
+#    SimplePlayer(address, on_start=tracker.on_start,
+#                 on_update=tracker.on_update, on_select=my_select,
+#                 on_clear=tracker.on_clear)
+#
+# where my_select() can use tracker.machine, tracker.state and tracker.role.
+# It accepts the string, structured and integer (with the symbols keyword
+# passed to on_start) action formats of the Handler. The knowledge base is
+# taken from the kb keyword or from the GDL object's shared kb view, so the
+# GDL is not parsed again.
+#---------------------------------------------------------------------------------
+
+class StateTracker(object):
+    def __init__(self, machine_factory=StateMachine):
+        self._factory = machine_factory
+        self.on_clear()
+
+    def on_start(self, timeout, matchid, role, gdl, playclock, symbols=None, kb=None):
+        if kb is None: kb = gdl.kb if isinstance(gdl, GDL) else KnowledgeBase.from_gdl(gdl)
+        self.machine = self._factory(kb)
+        self.role = to_term(role)
+        self.state = self.machine.initial_state()
+        self._symbols = symbols
+
+    def on_update(self, actions):
+        if isinstance(actions, dict):
+            actions = [actions[r] for r in self.machine.kb.roles]
+        elif self._symbols is not None:
+            actions = self._symbols.actions.decode(actions)
+        self.state = self.machine.next_state(self.state, [to_term(a) for a in actions])
+
+    def on_clear(self):
+        self.machine = None
+        self.role = None
+        self.state = None
+        self._symbols = None
+
+    def legal_moves(self):
+        return self.machine.legal_moves(self.state, self.role)
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+def _args(literal):
+    if type(literal) == list: return literal[1:]
+    return []
+
+def _slots(patterns):
+    out = set()
+    stack = list(patterns)
+    while stack:
+        p = stack.pop()
+        if type(p) == int: out.add(p)
+        elif type(p) == tuple: stack.extend(p)
+    return out
+
+# Add the derived (relation, args) pairs of a recursive component to the
+# store and return the new facts for each relation.
+def _merge(component, store, derived):
+    delta = dict((key, Relation()) for key in component)
+    for (key, args) in derived:
+        if store[key].add(args): delta[key].add(args)
+    return delta
+
+def _subst(pattern, env):
+    if type(pattern) == int: return env[pattern]
+    if type(pattern) == str: return pattern
+    return tuple(_subst(p, env) for p in pattern)
+
+def _unify(pattern, term, env):
+    if type(pattern) == int:
+        value = env[pattern]
+        if value is None:
+            env[pattern] = term
+            return True
+        return value == term
+    if type(pattern) == str: return pattern == term
+    if type(term) != tuple or len(term) != len(pattern): return False
+    for (p, t) in zip(pattern, term):
+        if not _unify(p, t, env): return False
+    return True
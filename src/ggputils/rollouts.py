@@ -0,0 +1,250 @@
+#---------------------------------------------------------------------------------
+#
+# A deadline aware parallel rollout executor. Most players spend the play
+# clock running independent random simulations for each of their legal
+# moves; RolloutExecutor farms these out to a pool of worker processes and
+# collects per-move statistics until the deadline.
+#
+# The simulate function is called as simulate(context, move, rng) and returns
+# the value of the simulation (eg. the goal value of our role). It must be
+# picklable (a module level function) as must the context and the moves. The
+# context and moves are sent to the workers once per run.
+#
+# Each worker writes the statistics (number of simulations and sum of values
+# for each move) to its own row of a shared memory array, so no locking is
+# needed, and stops at the deadline (the timeout less a safety margin). The
+# executor then sums the rows into a RolloutStats object. For example, in a
+# SimplePlayer on_select() callback:
+#
+#    executor = RolloutExecutor(simulate)
+#    ...
+#    def on_select(timeout):
+#        moves = tracker.legal_moves()
+#        stats = executor.run(timeout, tracker.state, moves)
+#        return moves[stats.best()]
+#
+# The pool is created once and reused between runs, so create the executor
+# before the first match. Call close() (or use the executor in a "with"
+# statement) to shut it down. With processes=0 the simulations are run in the
+# calling process, which is useful for testing.
+#
+# Large read-only data (eg. the compiled game) should not be part of the
+# context, since that is pickled and sent to every worker for every run.
+# Instead publish() it once at START: it is written to shared memory (see
+# ggputils.shared) and each worker attaches to it straight away, so the cost
+# is paid within the start clock. Put the returned SharedObject in the context
+# and call get() on it in simulate. release() it (or close the executor) when
+# it is no longer needed.
+#
+#---------------------------------------------------------------------------------
+
+import multiprocessing
+import random
+import time
+import logging
+from ggputils.utils import _fmt
+from ggputils.shared import publish as _publish, prune as _prune
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger(__name__)
+
+# The shared memory of a worker process (set by the pool initializer)
+_shared = None
+
+#---------------------------------------------------------------------------------
+# RolloutStats holds the aggregated per-move statistics of a run.
+#---------------------------------------------------------------------------------
+
+class RolloutStats(object):
+    def __init__(self, moves, counts, values, elapsed):
+        self.moves = moves
+        self.counts = counts
+        self.values = values
+        self.elapsed = elapsed
+
+    @property
+    def simulations(self):
+        return sum(self.counts)
+
+    # The mean value of a move (by index) or None if it was never simulated
+    def mean(self, index):
+        if not self.counts[index]: return None
+        return self.values[index] / self.counts[index]
+
+    def means(self):
+        return [self.mean(i) for i in range(len(self.moves))]
+
+    # The index of the move with the best mean value (or None if no moves)
+    def best(self):
+        best = None
+        for i in range(len(self.moves)):
+            if not self.counts[i]: continue
+            if best is None or self.mean(i) > self.mean(best): best = i
+        if best is None and self.moves: return 0
+        return best
+
+    def __repr__(self):
+        return "RolloutStats(simulations={0}, elapsed={1:.3f}s)".format(
+            self.simulations, self.elapsed)
+
+#---------------------------------------------------------------------------------
+# RolloutExecutor
+#---------------------------------------------------------------------------------
+
+class RolloutExecutor(object):
+    def __init__(self, simulate, processes=None, margin=0.5, max_moves=1024):
+        if processes is None: processes = multiprocessing.cpu_count()
+        self._simulate = simulate
+        self._processes = processes
+        self._margin = margin
+        self._max_moves = max_moves
+        self._pending = []
+        self._published = []
+        self._pool = None
+        if processes > 0:
+            size = processes * max_moves
+            self._counts = multiprocessing.Array('d', size, lock=False)
+            self._values = multiprocessing.Array('d', size, lock=False)
+            self._stop = multiprocessing.Value('b', 0, lock=False)
+            self._attached = multiprocessing.Value('i', 0)
+            self._pool = multiprocessing.Pool(processes, _init_worker,
+                                              (self._counts, self._values, self._stop,
+                                               self._attached))
+
+    @property
+    def processes(self):
+        return self._processes
+
+    #-----------------------------------------------------------------------------
+    # Run simulations of the moves until the deadline. Returns a RolloutStats.
+    #-----------------------------------------------------------------------------
+    def run(self, timeout, context, moves):
+        moves = list(moves)
+        if len(moves) > self._max_moves:
+            raise ValueError("Too many moves ({0} > {1})".format(len(moves), self._max_moves))
+        start = time.time()
+        deadline = start + timeout.remaining() - self._margin
+        seed = random.randrange(1 << 30)
+        if not moves: return RolloutStats(moves, [], [], 0.0)
+
+        if self._pool is None:
+            (counts, values) = _simulate(self._simulate, context, moves, deadline,
+                                         random.Random(seed), [0.0] * len(moves),
+                                         [0.0] * len(moves), 0, None)
+            return RolloutStats(moves, [int(c) for c in counts], values, time.time() - start)
+
+        self._wait_pending()
+        for i in range(len(self._counts)):
+            self._counts[i] = 0.0
+            self._values[i] = 0.0
+        self._stop.value = 0
+        self._pending = [self._pool.apply_async(_worker, (self._simulate, context, moves,
+                                                          deadline, seed, w, self._max_moves))
+                         for w in range(self._processes)]
+        for result in self._pending:
+            result.wait(max(0.0, deadline - time.time()) + self._margin / 2.0)
+        self._stop.value = 1
+        late = len([r for r in self._pending if not r.ready()])
+        if late: g_logger.warning(_fmt("{0} rollout worker(s) missed the deadline", late))
+        for result in self._pending:
+            if result.ready() and not result.successful(): result.get()
+
+        counts = [0.0] * len(moves)
+        values = [0.0] * len(moves)
+        for w in range(self._processes):
+            offset = w * self._max_moves
+            for i in range(len(moves)):
+                counts[i] += self._counts[offset + i]
+                values[i] += self._values[offset + i]
+        return RolloutStats(moves, [int(c) for c in counts], values, time.time() - start)
+
+    #-----------------------------------------------------------------------------
+    # Publish a read-only object to the workers and return its SharedObject.
+    # Waits for every worker to attach to it (or until the timeout, less the
+    # margin; the remaining workers finish attaching before the next run).
+    #-----------------------------------------------------------------------------
+    def publish(self, obj, timeout=None):
+        shared = _publish(obj)
+        self._published.append(shared)
+        if self._pool is None: return shared
+        self._wait_pending()
+        self._attached.value = 0
+        self._stop.value = 0
+        self._pending = [self._pool.apply_async(_attach_worker, (shared, self._processes))
+                         for w in range(self._processes)]
+        for result in self._pending:
+            result.wait(None if timeout is None else
+                        max(0.0, timeout.remaining() - self._margin))
+        for result in self._pending:
+            if result.ready() and not result.successful(): result.get()
+        return shared
+
+    def release(self, shared):
+        shared.release()
+        if shared in self._published: self._published.remove(shared)
+
+    def close(self):
+        for shared in self._published: shared.release()
+        self._published = []
+        if self._pool is None: return
+        self._stop.value = 1
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+
+    # Workers from a previous run that missed the deadline must be finished
+    # before the shared memory is reused.
+    def _wait_pending(self):
+        for result in self._pending: result.wait()
+        self._pending = []
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+def _init_worker(counts, values, stop, attached):
+    global _shared
+    _shared = (counts, values, stop, attached)
+
+def _worker(simulate, context, moves, deadline, seed, worker, max_moves):
+    (counts, values, stop, attached) = _shared
+    _simulate(simulate, context, moves, deadline, random.Random(seed + worker),
+              counts, values, worker * max_moves, stop, worker)
+    return True
+
+# Attach to a published object (forgetting released ones). Then hold the
+# worker until every worker has taken one of these tasks, so that each
+# worker attaches.
+def _attach_worker(shared, processes):
+    (counts, values, stop, attached) = _shared
+    _prune()
+    shared.get()
+    with attached.get_lock(): attached.value += 1
+    deadline = time.time() + 1.0
+    while attached.value < processes and time.time() < deadline and not stop.value:
+        time.sleep(0.001)
+    return True
+
+# Simulate the moves in turn (each worker starting at a different move)
+# until the deadline or until stopped.
+def _simulate(simulate, context, moves, deadline, rng, counts, values, offset, stop,
+              first=0):
+    i = first % len(moves)
+    while time.time() < deadline and not (stop is not None and stop.value):
+        value = simulate(context, moves[i], rng)
+        counts[offset + i] += 1
+        values[offset + i] += value
+        i = (i + 1) % len(moves)
+    return (counts, values)
@@ -0,0 +1,160 @@
+#---------------------------------------------------------------------------------
+#
+# Sharing large read-only objects (the parsed or compiled game, weight tables,
+# ...) with worker processes. Passing such an object to a pool pickles it and
+# sends it through a pipe to every worker for every task. Instead publish()
+# writes it once to a file in shared memory (/dev/shm where available) and
+# returns a SharedObject, a small handle that pickles as just the path of the
+# file. get() maps the file read-only and returns the object, once per
+# process (the result is cached):
+#
+# - str (bytes): a read-only mmap.mmap object (zero copy).
+# - NumPy arrays: a read-only memory mapped array (zero copy).
+# - anything else: unpickled from the mapping once in each process.
+#
+# For example, with a RolloutExecutor (which also attaches every worker as
+# soon as the object is published, so this happens within the start clock):
+#
+#    def on_start(timeout, matchid, role, gdl, playclock):
+#        global g_game
+#        g_game = executor.publish(compile_game(gdl.exp))
+#    ...
+#    def simulate(context, move, rng):
+#        (game, state) = context
+#        return playout(game.get(), state, move, rng)
+#    ...
+#        stats = executor.run(timeout, (g_game, state), moves)
+#
+# The process that published the object owns the file and should release()
+# it when it is no longer needed (eg. at the end of the match).
+#
+# NumPy is only required for sharing arrays and is only imported when an
+# array is attached, so this module stays quick to import in workers.
+#
+#---------------------------------------------------------------------------------
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import mmap
+import os
+import sys
+import tempfile
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+ARRAY = "array"
+BYTES = "bytes"
+OBJECT = "object"
+
+_EXTENSIONS = {ARRAY: ".npy", BYTES: ".bin", OBJECT: ".pkl"}
+_SHM_DIR = "/dev/shm"
+
+# The objects attached in this process: path -> object
+_attached = {}
+
+#---------------------------------------------------------------------------------
+# SharedObject
+#---------------------------------------------------------------------------------
+
+class SharedObject(object):
+    def __init__(self, path, kind, owner=False):
+        self._path = path
+        self._kind = kind
+        self._owner = owner
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def kind(self):
+        return self._kind
+
+    # Return the object (attaching to it on first use in this process)
+    def get(self):
+        obj = _attached.get(self._path)
+        if obj is None and self._path not in _attached:
+            obj = _attach(self._path, self._kind)
+            _attached[self._path] = obj
+        return obj
+
+    # Remove the file (only by the process that published it). Processes
+    # that are already attached can still use the object.
+    def release(self):
+        _attached.pop(self._path, None)
+        if not self._owner: return
+        self._owner = False
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    @property
+    def released(self):
+        return not os.path.exists(self._path)
+
+    # Only the path and kind are pickled (the copy is never the owner)
+    def __getstate__(self):
+        return (self._path, self._kind)
+
+    def __setstate__(self, state):
+        (self._path, self._kind) = state
+        self._owner = False
+
+    def __repr__(self):
+        return "SharedObject({0}, {1})".format(self._kind, self._path)
+
+#---------------------------------------------------------------------------------
+# Publish an object. The file is created in directory (by default /dev/shm if
+# it exists, otherwise the temporary directory).
+#---------------------------------------------------------------------------------
+def publish(obj, directory=None):
+    if directory is None:
+        directory = _SHM_DIR if os.access(_SHM_DIR, os.W_OK) else tempfile.gettempdir()
+    if type(obj) == str:
+        kind = BYTES
+        write = lambda f: f.write(obj)
+    elif _is_array(obj):
+        kind = ARRAY
+        np = sys.modules["numpy"]
+        write = lambda f: np.save(f, np.ascontiguousarray(obj))
+    else:
+        kind = OBJECT
+        write = lambda f: pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    (fd, path) = tempfile.mkstemp(dir=directory, prefix="ggputils-", suffix=_EXTENSIONS[kind])
+    try:
+        with os.fdopen(fd, "wb") as f: write(f)
+    except:
+        os.remove(path)
+        raise
+    shared = SharedObject(path, kind, owner=True)
+    _attached[path] = obj
+    return shared
+
+#---------------------------------------------------------------------------------
+# Forget the attached objects whose files have been released.
+#---------------------------------------------------------------------------------
+def prune():
+    for path in [p for p in _attached if not os.path.exists(p)]: del _attached[path]
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+# An object can only be a NumPy array if NumPy has been imported
+def _is_array(obj):
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(obj, np.ndarray)
+
+def _attach(path, kind):
+    if kind == ARRAY:
+        import numpy as np
+        return np.load(path, mmap_mode="r")
+    with open(path, "rb") as f:
+        if kind == OBJECT: return pickle.load(f)
+        if not os.fstat(f.fileno()).st_size: return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,166 @@
+#---------------------------------------------------------------------------------
+#
+# Per-match symbol tables that map ground GDL terms (actions, observations
+# and fluents) to dense integer ids and back again. Search code can then
+# work with ints (and arrays indexed by them) instead of strings.
+#
+# Terms are stored in a canonical s-expression form (single spaces, no
+# extra whitespace), as produced by ggputils.utils.exp_to_sexp(). A term
+# can be looked up using any textual form or as a parsed expression. The
+# non-canonical forms that have been seen are remembered so that the
+# (relatively expensive) canonicalisation is only done once per form.
+#
+# Note: no case conversion is done, so "(MARK 1 2)" and "(mark 1 2)" are
+# different symbols.
+#
+# Example usage:
+#
+#    symbols = MatchSymbols.from_gdl(gdl)
+#    mid = symbols.actions.intern("(mark 1 2)")
+#    symbols.actions.symbol(mid)    => "(mark 1 2)"
+#
+#---------------------------------------------------------------------------------
+
+import re
+from ggputils.utils import parse_simple_sexp, exp_to_sexp
+
+#---------------------------------------------------------------------------------
+# SymbolTable assigns dense integer ids (0,1,2,...) to terms in the order
+# in which they are first interned.
+#---------------------------------------------------------------------------------
+
+class SymbolTable(object):
+    def __init__(self, symbols=()):
+        self._ids = {}
+        self._symbols = []
+        self._aliases = {}
+        for s in symbols: self.intern(s)
+
+    #-----------------------------------------------------------------------------
+    # Return the id of a term, assigning a new id if the term is unknown.
+    #-----------------------------------------------------------------------------
+    def intern(self, term):
+        sid = self.get(term)
+        if sid is not None: return sid
+        symbol = _canonical(term)
+        sid = len(self._symbols)
+        self._ids[symbol] = sid
+        self._symbols.append(symbol)
+        if type(term) == str and term != symbol: self._aliases[term] = sid
+        return sid
+
+    #-----------------------------------------------------------------------------
+    # Return the id of a term or the default if the term is unknown.
+    #-----------------------------------------------------------------------------
+    def get(self, term, default=None):
+        if type(term) == str:
+            sid = self._ids.get(term)
+            if sid is not None: return sid
+            sid = self._aliases.get(term)
+            if sid is not None: return sid
+        sid = self._ids.get(_canonical(term))
+        if sid is None: return default
+        if type(term) == str: self._aliases[term] = sid
+        return sid
+
+    #-----------------------------------------------------------------------------
+    # Return the (canonical) term of an id.
+    #-----------------------------------------------------------------------------
+    def symbol(self, sid):
+        if sid < 0: raise IndexError("Invalid symbol id {0}".format(sid))
+        return self._symbols[sid]
+
+    #-----------------------------------------------------------------------------
+    # Encode a sequence of terms to ids or decode a sequence of ids to terms
+    #-----------------------------------------------------------------------------
+    def encode(self, terms):
+        return tuple(self.intern(t) for t in terms)
+
+    def decode(self, sids):
+        return [self.symbol(sid) for sid in sids]
+
+    @property
+    def symbols(self):
+        return self._symbols
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __iter__(self):
+        return iter(self._symbols)
+
+#---------------------------------------------------------------------------------
+# MatchSymbols holds the symbol tables for a match. It is seeded from the
+# ground terms that appear in the GDL:
+#
+# - actions: (input ?r A), (legal ?r A) heads and facts.
+# - observations: (sees ?r O) heads and facts.
+# - fluents: (base F), (init F) and (next F) heads and facts.
+#
+# Terms that are not ground in the GDL (which is the case for most games)
+# are given ids as they are first encountered during the match.
+#---------------------------------------------------------------------------------
+
+class MatchSymbols(object):
+    def __init__(self):
+        self.actions = SymbolTable()
+        self.observations = SymbolTable()
+        self.fluents = SymbolTable()
+
+    @classmethod
+    def from_gdl(cls, gdl):
+        return cls.from_gdl_exp(parse_simple_sexp("({0})".format(gdl)))
+
+    @classmethod
+    def from_gdl_exp(cls, gdl_exp):
+        symbols = cls()
+        for sentence in gdl_exp:
+            head = sentence
+            if type(sentence) == list and sentence and _is_rule_arrow(sentence[0]):
+                if len(sentence) < 2: continue
+                head = sentence[1]
+            if type(head) != list or len(head) < 2: continue
+            name = head[0].lower() if type(head[0]) == str else None
+            if name in _ACTION_RELATIONS and len(head) == 3:
+                table = symbols.actions
+                term = head[2]
+            elif name in _OBSERVATION_RELATIONS and len(head) == 3:
+                table = symbols.observations
+                term = head[2]
+            elif name in _FLUENT_RELATIONS and len(head) == 2:
+                table = symbols.fluents
+                term = head[1]
+            else:
+                continue
+            if _is_ground(term): table.intern(term)
+        return symbols
+
+#---------------------------------------------------------------------------------
+# Internal support functions
+#---------------------------------------------------------------------------------
+
+_ACTION_RELATIONS = frozenset(["input", "legal"])
+_OBSERVATION_RELATIONS = frozenset(["sees"])
+_FLUENT_RELATIONS = frozenset(["base", "init", "next"])
+_re_compound = re.compile(r'[\s()]')
+
+def _is_rule_arrow(atom):
+    return atom == "<="
+
+def _is_ground(exp):
+    if type(exp) != list: return not exp.startswith("?")
+    stack = [exp]
+    while stack:
+        for x in stack.pop():
+            if type(x) == list: stack.append(x)
+            elif x.startswith("?"): return False
+    return True
+
+def _canonical(term):
+    if type(term) == str:
+        if not _re_compound.search(term): return term
+        return exp_to_sexp(parse_simple_sexp(term))
+    return exp_to_sexp(term)
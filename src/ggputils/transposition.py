@@ -0,0 +1,198 @@
+#---------------------------------------------------------------------------------
+#
+# Zobrist hashing of GDL states and a bounded transposition table.
+#
+# ZobristHasher assigns a random 64 bit key to each fluent (any hashable
+# fluent; eg. a reasoner term, a canonical string or an interned fluent id
+# from ggputils.symbols.MatchSymbols.fluents). The hash of a state is the XOR
+# of the keys of its fluents, so it can be updated incrementally from the
+# fluents that were removed and added by a move:
+#
+#    h = hasher.hash(state)
+#    h = hasher.update(h, state, next_state)
+#
+# TranspositionTable is a fixed size table (the memory budget is a number of
+# entries, allocated up front) of (key, depth, value) entries indexed by the
+# low bits of the key. When two keys map to the same slot the replacement
+# policy decides which entry is kept:
+#
+# - DEPTH_PREFERRED: keep the entry searched to the greater depth.
+# - ALWAYS_REPLACE: keep the newest entry.
+# - TWO_TIER: each slot has a depth preferred entry and an always replace
+#   entry; an entry displaced from the first goes to the second.
+#
+# The table counts hits, misses, stores and replacements. It can be cleared
+# automatically at the end of each match by passing it to SimplePlayer with
+# auto_clear=[table].
+#
+#---------------------------------------------------------------------------------
+
+import random
+
+#---------------------------------------------------------------------------------
+# Replacement policies
+#---------------------------------------------------------------------------------
+DEPTH_PREFERRED = "depth_preferred"
+ALWAYS_REPLACE = "always_replace"
+TWO_TIER = "two_tier"
+
+_POLICIES = (DEPTH_PREFERRED, ALWAYS_REPLACE, TWO_TIER)
+
+#---------------------------------------------------------------------------------
+# ZobristHasher
+#---------------------------------------------------------------------------------
+
+class ZobristHasher(object):
+    def __init__(self, seed=0):
+        self._rng = random.Random(seed)
+        self._keys = {}
+
+    # The random key of a fluent (generated the first time it is seen)
+    def key(self, fluent):
+        key = self._keys.get(fluent)
+        if key is None:
+            key = self._rng.getrandbits(64)
+            self._keys[fluent] = key
+        return key
+
+    def hash(self, state):
+        h = 0
+        for fluent in state: h ^= self.key(fluent)
+        return h
+
+    #-----------------------------------------------------------------------------
+    # Update the hash of a state for a move to a new state. Only the fluents
+    # that changed are hashed. update_delta() takes the removed and added
+    # fluents directly.
+    #-----------------------------------------------------------------------------
+    def update(self, h, state, next_state):
+        for fluent in state.symmetric_difference(next_state): h ^= self.key(fluent)
+        return h
+
+    def update_delta(self, h, removed, added):
+        for fluent in removed: h ^= self.key(fluent)
+        for fluent in added: h ^= self.key(fluent)
+        return h
+
+    def __len__(self):
+        return len(self._keys)
+
+#---------------------------------------------------------------------------------
+# TranspositionTable
+#---------------------------------------------------------------------------------
+
+class TranspositionTable(object):
+    def __init__(self, entries=1 << 16, policy=DEPTH_PREFERRED):
+        if policy not in _POLICIES:
+            raise ValueError("Unknown replacement policy: {0}".format(policy))
+        self._policy = policy
+        self._ways = 2 if policy == TWO_TIER else 1
+        slots = 1
+        while slots * 2 * self._ways <= entries: slots *= 2
+        self._mask = slots - 1
+        self._capacity = slots * self._ways
+        self._keys = [None] * self._capacity
+        self._depths = [0] * self._capacity
+        self._values = [None] * self._capacity
+        self._size = 0
+        self.reset_stats()
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return self._size
+
+    #-----------------------------------------------------------------------------
+    # Look up a key. Returns the value or the default if the key is not in the
+    # table or was stored with a depth less than min_depth.
+    #-----------------------------------------------------------------------------
+    def lookup(self, key, default=None, min_depth=0):
+        slot = (key & self._mask) * self._ways
+        for i in range(slot, slot + self._ways):
+            if self._keys[i] == key and self._depths[i] >= min_depth:
+                self.hits += 1
+                return self._values[i]
+        self.misses += 1
+        return default
+
+    def __contains__(self, key):
+        slot = (key & self._mask) * self._ways
+        return key in self._keys[slot:slot + self._ways]
+
+    #-----------------------------------------------------------------------------
+    # Store a value for a key. Returns False if the policy kept an existing
+    # entry instead.
+    #-----------------------------------------------------------------------------
+    def store(self, key, value, depth=0):
+        slot = (key & self._mask) * self._ways
+        self.stores += 1
+        keys = self._keys
+        depths = self._depths
+        if self._policy == TWO_TIER:
+            if keys[slot + 1] == key and keys[slot] != key:
+                self._set(slot + 1, None, 0, None)
+            if keys[slot] is None or keys[slot] == key or depth >= depths[slot]:
+                if keys[slot] is not None and keys[slot] != key:
+                    self._set(slot + 1, keys[slot], depths[slot], self._values[slot])
+                self._set(slot, key, depth, value)
+            else:
+                self._set(slot + 1, key, depth, value)
+            return True
+        if self._policy == DEPTH_PREFERRED and keys[slot] is not None and \
+           keys[slot] != key and depth < depths[slot]:
+            self.rejected += 1
+            return False
+        self._set(slot, key, depth, value)
+        return True
+
+    #-----------------------------------------------------------------------------
+    # Statistics
+    #-----------------------------------------------------------------------------
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups: return 0.0
+        return float(self.hits) / lookups
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.replacements = 0
+        self.rejected = 0
+
+    def stats(self):
+        return {"size": self._size, "capacity": self._capacity, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate, "stores": self.stores,
+                "replacements": self.replacements, "rejected": self.rejected}
+
+    #-----------------------------------------------------------------------------
+    # Remove all entries and reset the statistics.
+    #-----------------------------------------------------------------------------
+    def clear(self):
+        self._keys[:] = [None] * self._capacity
+        self._depths[:] = [0] * self._capacity
+        self._values[:] = [None] * self._capacity
+        self._size = 0
+        self.reset_stats()
+
+    #-----------------------------------------------------------------------------
+    # Internal functions
+    #-----------------------------------------------------------------------------
+    def _set(self, i, key, depth, value):
+        old = self._keys[i]
+        if old is None:
+            if key is not None: self._size += 1
+        elif key is None:
+            self._size -= 1
+        elif old != key:
+            self.replacements += 1
+        self._keys[i] = key
+        self._depths[i] = depth
+        self._values[i] = value
@@ -9,7 +9,11 @@
 
 import time
 import re
-import copy
+import sys
+import os
+import fcntl
+import weakref
+import logging
 
 #--------------------------------------------------------------------------
 #
@@ -36,36 +40,221 @@ class BraceMessage(object):
 
 _fmt = BraceMessage
 
+# Private so that "from ggputils.utils import *" does not replace the
+# logger of the importing module
+_g_logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------------------
+# The unpatched version of a standard library function (if gevent has
+# monkey patched it). Used for the background threads that must be real
+# threads.
+#--------------------------------------------------------------------------------------
+_THREAD = "thread" if sys.version_info[0] < 3 else "_thread"
+
+def _original(module, name):
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None: return monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+#--------------------------------------------------------------------------------------
+# A monotonic clock (in seconds from an arbitrary point), so that timeouts are
+# not affected by changes to the system time. Python 2 has no time.monotonic()
+# so there clock_gettime(CLOCK_MONOTONIC) is called through ctypes. That is
+# much slower than time.time() (a couple of microseconds a call), so it is
+# only read when a Timeout is created and by the background timer, never by
+# has_expired() or remaining(). If the call is not available it falls back
+# to time.time().
+#--------------------------------------------------------------------------------------
+
+def _monotonic_clock():
+    if hasattr(time, "monotonic"): return time.monotonic
+    if sys.platform.startswith("linux"): clock_id = 1
+    elif sys.platform == "darwin": clock_id = 6
+    else: return time.time
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        library = ctypes.util.find_library("rt") or ctypes.util.find_library("c")
+        clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        clock_gettime.restype = ctypes.c_int
+        byref = ctypes.byref
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+    def monotonic():
+        ts = timespec()
+        if clock_gettime(clock_id, byref(ts)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return time.time
+    return monotonic
+
+monotonic = _monotonic_clock()
+
 #--------------------------------------------------------------------------------------
 # Encapsulates a timeout from some timepoint (in seconds). It takes an
 # initial timestamp and a duration which is the time given for a
 # response.  This matches the GGP protocol where the player is given a
-# start or playclock in which to respond.
+# start or playclock in which to respond. The timestamp is from
+# time.time(); use Timeout.from_monotonic() for a timestamp from the
+# monotonic() clock. The deadline is kept on both clocks: has_expired() and
+# remaining() compare it against the cheap time.time(), while the background
+# timer uses the monotonic clock (so a change to the system time cannot stop
+# it cancelling the timeout).
 #
 # The timeout can be extended or retracted. retraction is useful for
 # providing a buffer in which to respond.
+#
+# The timeout is also a cancellation token. The cancelled attribute is a
+# plain boolean that is set by cancel(), so a search loop can poll it much
+# more cheaply than calling has_expired() (which reads the clock):
+#
+#    timeout.reduce(1.5)
+#    timeout.start_timer()
+#    while not timeout.cancelled:
+#        ...
+#
+# start_timer() makes a background timer cancel the timeout at its
+# deadline (taking any later reduce() or extend() into account). The Handler
+# starts the timer of the timeouts it passes to the callbacks and also
+# cancels them when the match is stopped or aborted. Cancelling a timeout
+# also cancels its clones. Once cancelled, has_expired() is True and
+# remaining() is 0.
 # --------------------------------------------------------------------------------------
 
 class Timeout(object):
     def __init__(self, timestamp, response_duration):
-        self._decision_time = timestamp + response_duration
+        wall_time = timestamp + response_duration
+        self._init(wall_time - time.time() + monotonic(), wall_time)
+
+    @classmethod
+    def from_monotonic(cls, timestamp, response_duration):
+        timeout = cls.__new__(cls)
+        timeout._init(timestamp + response_duration)
+        return timeout
+
+    def _init(self, decision_time, wall_time=None):
+        self._decision_time = decision_time
+        if wall_time is None: wall_time = decision_time - monotonic() + time.time()
+        self._wall_time = wall_time
+        self.cancelled = False
+        self._clones = weakref.WeakSet()
+        self._lock = _original(_THREAD, "allocate_lock")()
+        self._timed = False
 
     def has_expired(self):
-        return float(self._decision_time - time.time()) <= 0.0
+        return self.cancelled or self._wall_time <= time.time()
 
     def remaining(self):
-        remainder = float(self._decision_time - time.time())
+        if self.cancelled: return 0.0
+        remainder = float(self._wall_time - time.time())
         if remainder < 0.0: return 0.0
         return remainder
 
     def extend(self, duration):
         self._decision_time += duration
+        self._wall_time += duration
 
     def reduce(self, duration):
         self._decision_time -= duration
+        self._wall_time -= duration
+        if self._timed: _timer.wake()
 
+    # The clones are shared with the timer thread so they are only changed
+    # or iterated while holding the lock.
     def clone(self):
-        return copy.copy(self)
+        timeout = Timeout.__new__(Timeout)
+        timeout._init(self._decision_time, self._wall_time)
+        with self._lock:
+            timeout.cancelled = self.cancelled
+            self._clones.add(timeout)
+        return timeout
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            clones = list(self._clones)
+        for timeout in clones: timeout.cancel()
+        if self._timed:
+            self._timed = False
+            _timer.wake()
+
+    # Start the background timer for this timeout. Returns the timeout.
+    def start_timer(self):
+        if self.cancelled or self._timed: return self
+        self._timed = True
+        _timer.add(self)
+        return self
+
+#--------------------------------------------------------------------------------------
+# The background timer of the timeouts. It is a single real thread (even if
+# gevent has monkey patched the standard library, so it also fires while a
+# greenlet hogs the CPU) that sleeps until the earliest deadline. It sleeps in
+# select() on a pipe so that a reduce() or cancel() can wake it up early (a
+# Python 2 lock or condition cannot be waited on with a timeout without
+# polling). The thread is started on first use (again in a forked child).
+# An error while cancelling is logged and the thread carries on, as the
+# timeouts of the whole process depend on it.
+#--------------------------------------------------------------------------------------
+
+class _Timer(object):
+    def __init__(self):
+        self._pid = None
+
+    def add(self, timeout):
+        if self._pid != os.getpid(): self._start()
+        with self._lock: self._timeouts.add(timeout)
+        self.wake()
+
+    def wake(self):
+        if self._pid != os.getpid(): return
+        try:
+            os.write(self._wakeup[1], b"x")
+        except OSError:
+            pass   # The pipe is full so the thread is awake anyway
+
+    def _start(self):
+        self._timeouts = weakref.WeakSet()
+        self._lock = _original(_THREAD, "allocate_lock")()
+        self._wakeup = os.pipe()
+        fcntl.fcntl(self._wakeup[1], fcntl.F_SETFL, os.O_NONBLOCK)
+        self._pid = os.getpid()
+        _original(_THREAD, "start_new_thread")(self._run, (self._wakeup[0],))
+
+    def _run(self, wakeup):
+        select = _original("select", "select")
+        while True:
+            with self._lock: timeouts = list(self._timeouts)
+            now = monotonic()
+            deadline = None
+            for timeout in timeouts:
+                try:
+                    if timeout._timed and timeout._decision_time <= now: timeout.cancel()
+                except Exception:
+                    _g_logger.exception("Timer failed to cancel a timeout")
+                    timeout._timed = False
+                if not timeout._timed:
+                    with self._lock: self._timeouts.discard(timeout)
+                elif deadline is None or timeout._decision_time < deadline:
+                    deadline = timeout._decision_time
+            del timeouts
+            try:
+                if select([wakeup], [], [], None if deadline is None else deadline - now)[0]:
+                    os.read(wakeup, 4096)
+            except Exception:
+                _g_logger.exception("Timer failed to wait")
+
+_timer = _Timer()
 
 #--------------------------------------------------------------------------------------
 # Generate an integer timeout (in seconds) from some timepoint. It requires a
@@ -140,32 +329,137 @@ def parse_simple_sexp(sexp):
 
 #--------------------------------------------------------------------------------------
 # Convert an sexpression to a string.
+#
+# The conversion is iterative (so there is no recursion limit on deeply nested
+# terms) and writes into a single buffer that is joined at the end. Text atoms
+# that have already been validated are remembered so that the regex check is
+# only run once for each distinct symbol. The cache is simply dropped when it
+# gets too big, which is fine since the set of symbols in a game is small.
 #--------------------------------------------------------------------------------------
-def exp_to_sexp(exp):
-    out = ''
-    if type(exp) == type([]):
-        out += '(' + ' '.join(exp_to_sexp(x) for x in exp) + ')'
-    elif type(exp) == type('') and re.search(r'[\s()]', exp):
+_re_bad_atom = re.compile(r'[\s()]')
+_valid_atoms = set()
+_VALID_ATOMS_LIMIT = 65536
+
+def _check_atom(atom):
+    if _re_bad_atom.search(atom):
         raise ValueError(("Cannot be converted to an s-expression as a "
                           "text element contains spaces or '(' or ')'"))
-    else:
-        out += '{0}'.format(exp)
-    return out
+    if len(_valid_atoms) >= _VALID_ATOMS_LIMIT: _valid_atoms.clear()
+    _valid_atoms.add(atom)
+
+def exp_to_sexp(exp):
+    if type(exp) != list:
+        if type(exp) == str:
+            if exp not in _valid_atoms: _check_atom(exp)
+            return exp
+        return '{0}'.format(exp)
+
+    buf = ['(']
+    append = buf.append
+    stack = [iter(exp)]
+    sep = False
+    while stack:
+        for x in stack[-1]:
+            if sep: append(' ')
+            if type(x) == list:
+                append('(')
+                stack.append(iter(x))
+                sep = False
+                break
+            if type(x) == str:
+                if x not in _valid_atoms: _check_atom(x)
+                append(x)
+            else:
+                append('{0}'.format(x))
+            sep = True
+        else:
+            stack.pop()
+            append(')')
+            sep = True
+    return ''.join(buf)
+
+
+#--------------------------------------------------------------------------------------
+# Span based extraction of s-expressions.
+#
+# Instead of parsing into lists and then converting back to strings these
+# functions locate the top-level elements of an s-expression with a single
+# bracket-depth scan and return them as slices of the original text. So each
+# element costs one string allocation and its text is returned verbatim (no
+# whitespace normalisation). For example:
+#
+#    split_sexp("((mark 1 2)  noop (mark  3 4))") => ["(mark 1 2)", "noop", "(mark  3 4)"]
+#
+# split_sexp() expects a bracketed list while split_sexp_sequence() takes a
+# sequence of s-expressions without the enclosing brackets.
+#--------------------------------------------------------------------------------------
+_re_brackets = re.compile(r'[()]')
+_re_nonspace = re.compile(r'\S')
+
+def _sexp_spans(text, pos, end):
+    spans = []
+    depth = 0
+    for m in _re_brackets.finditer(text, pos, end):
+        i = m.start()
+        if text[i] == '(':
+            if depth == 0:
+                if pos < i: spans.extend(text[pos:i].split())
+                pos = i
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                spans.append(text[pos:i+1])
+                pos = i + 1
+            elif depth < 0:
+                raise ValueError("Bad bracket nesting in s-expression: \"{0}\"".format(text))
+    if depth:
+        raise ValueError("Bad bracket nesting in s-expression: \"{0}\"".format(text))
+    if pos < end: spans.extend(text[pos:end].split())
+    return spans
+
+def _list_bounds(text, pos, end):
+    m = _re_nonspace.search(text, pos, end)
+    last = text.rfind(')', pos, end)
+    if not m or text[m.start()] != '(' or last < 0 or \
+       _re_nonspace.search(text, last+1, end):
+        raise ValueError("\"{0}\" is not an s-expression list".format(text[pos:end]))
+    return (m.start() + 1, last)
 
+def split_sexp(sexp):
+    (start, end) = _list_bounds(sexp, 0, len(sexp))
+    return _sexp_spans(sexp, start, end)
+
+def split_sexp_sequence(sexp):
+    return _sexp_spans(sexp, 0, len(sexp))
+
+#-----------------------------------------------------------------------
+# Split an actionstr into its component actions. If spans is True
+# then the actions are slices of the original string (see split_sexp()).
+#-----------------------------------------------------------------------
+def parse_actions_sexp(sexp, spans=False):
+    if spans:
+        m = _re_nonspace.search(sexp)
+        if m and sexp[m.start()] == '(': return split_sexp(sexp)
+        actions = sexp.split()
+        if len(actions) != 1:
+            raise ValueError("{0} is not a sequence of actions".format(sexp))
+        if actions[0].upper() == "NIL": return []
+        return actions
+
+    return [exp_to_sexp(aexp) for aexp in parse_actions_exp(sexp)]
 
 #-----------------------------------------------------------------------
-# Split an actionstr into its component actions.
+# Split an actionstr into its component actions but return each action
+# as a parsed expression (see parse_simple_sexp()) instead of a string.
 #-----------------------------------------------------------------------
-def parse_actions_sexp(sexp):
+def parse_actions_exp(sexp):
     exp = parse_simple_sexp(sexp)
     if type(exp) == type(''):
         if re.match(r'^NIL$', exp, re.IGNORECASE): return []
-        return [exp_to_sexp(exp)]
+        return [exp]
 #        raise ValueError("{0} is not a sequence of actions".format(sexp))
-    actions = []
-    for aexp in exp:
-        actions.append(exp_to_sexp(aexp))
-    return actions
+    return exp
 
 def actions_to_sexp(actions):
     if hasattr(actions, '__iter__'):
@@ -181,7 +475,20 @@ def actions_to_sexp(actions):
 #
 # Note: An empty list of action values is legal: "()" => []
 #-----------------------------------------------------------------------
-def parse_actionvalues_sexp(sexp):
+def parse_actionvalues_sexp(sexp, spans=False):
+    if spans:
+        avs = []
+        for av_span in split_sexp(sexp):
+            if av_span[0] != '(':
+                raise ValueError("Invalid action value pair")
+            av = _sexp_spans(av_span, 1, len(av_span) - 1)
+            if len(av) != 2:
+                raise ValueError("Invalid action value pair")
+            if av[1][0] == '(':
+                raise ValueError("Invalid value")
+            avs.append((av[0], int(av[1])))
+        return avs
+
     exp = parse_simple_sexp(sexp)
     if type(exp) == type(''):
         raise ValueError("Invalid action values list")
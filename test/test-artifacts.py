@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ggputils.artifacts import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+GAME = "0123456789abcdef0123456789abcdef01234567"
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class ArtifactStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_arrays(self):
+        store = ArtifactStore(self._dir)
+        self.assertEqual(store.load_array(GAME, "weights"), None)
+        store.save_array(GAME, "weights", np.arange(10, dtype=np.float32))
+        loaded = store.load_array(GAME, "weights")
+        self.assertTrue(isinstance(loaded, np.memmap))
+        self.assertEqual(list(loaded), list(range(10)))
+        self.assertFalse(loaded.flags.writeable)
+        self.assertEqual(store.games(), [GAME])
+        self.assertEqual(store.artifacts(GAME), ["weights"])
+
+    def test_bytes_and_objects(self):
+        store = ArtifactStore(self._dir)
+        store.save_bytes(GAME, "net", b"abcdef")
+        data = store.load_bytes(GAME, "net")
+        self.assertEqual(data[1:4], b"bcd")
+        data.close()
+        store.save_object(GAME, "book", {"moves": [1, 2]})
+        self.assertEqual(store.load_object(GAME, "book"), {"moves": [1, 2]})
+        self.assertEqual(store.load_bytes(GAME, "book"), None)
+
+        # Replacing and removing
+        store.save_object(GAME, "net", [1])
+        self.assertEqual(store.load_bytes(GAME, "net"), None)
+        self.assertEqual(store.load_object(GAME, "net"), [1])
+        store.remove(GAME, "net")
+        store.remove(GAME, "book")
+        self.assertEqual(store.games(), [])
+        self.assertRaises(ValueError, store.save_bytes, "../x", "net", b"")
+        self.assertRaises(ValueError, store.save_bytes, GAME, "a/b", b"")
+
+    def test_versions(self):
+        ArtifactStore(self._dir, version=1).save_object(GAME, "book", 1)
+        self.assertEqual(ArtifactStore(self._dir, version=1).load_object(GAME, "book"), 1)
+        store = ArtifactStore(self._dir, version=2)
+        self.assertEqual(store.load_object(GAME, "book"), None)
+        self.assertFalse(store.contains(GAME, "book"))
+        self.assertEqual(ArtifactStore(self._dir, version=1).load_object(GAME, "book"), None)
+
+    def test_eviction(self):
+        store = ArtifactStore(self._dir, max_bytes=2500)
+        for name in ["a", "b"]:
+            store.save_bytes(GAME, name, b"x" * 1000)
+            time.sleep(0.02)
+        store.load_bytes(GAME, "a").close()
+        time.sleep(0.02)
+        store.save_bytes("other", "c", b"x" * 1000)
+        self.assertEqual(store.artifacts(GAME), ["a"])
+        self.assertEqual(store.artifacts("other"), ["c"])
+        self.assertEqual(store.total_size(), 2000)
+        store.clear()
+        self.assertEqual(store.total_size(), 0)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
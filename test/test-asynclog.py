@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import thread
+import time
+import unittest
+import logging
+
+from ggputils.asynclog import *
+from ggputils.utils import _fmt
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+class ListHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+# Records the thread in which it is formatted
+class ThreadMessage(object):
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = thread.get_ident()
+        return "formatted"
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [handler]
+    return logger
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class AsyncLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        set_current_match(None)
+        shutil.rmtree(self._dir)
+
+    def test_async_handler(self):
+        target = ListHandler()
+        warnings = ListHandler(logging.WARNING)
+        handler = AsyncLogHandler(target, warnings)
+        logger = make_logger("test.async", handler)
+        message = ThreadMessage()
+        for i in range(100): logger.info(_fmt("message {0}", i))
+        logger.warning(message)
+        handler.close()
+        self.assertEqual(target.messages, ["message {0}".format(i) for i in range(100)] +
+                         ["formatted"])
+        self.assertEqual(warnings.messages, ["formatted"])
+
+        # Formatted in the background thread
+        self.assertNotEqual(message.thread, None)
+        self.assertNotEqual(message.thread, thread.get_ident())
+
+        # Records are dropped once closed or when the queue is full
+        logger.info("dropped")
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(len(target.messages), 101)
+
+    # The writer blocks until a record is queued rather than polling
+    def test_wakeup(self):
+        target = ListHandler()
+        handler = AsyncLogHandler(target, interval=60.0)
+        logger = make_logger("test.wakeup", handler)
+        for i in range(3):
+            logger.info(_fmt("message {0}", i))
+            deadline = time.time() + 1.0
+            while len(target.messages) <= i and time.time() < deadline: time.sleep(0.001)
+            self.assertEqual(len(target.messages), i + 1)
+        start = time.time()
+        handler.close()
+        self.assertTrue(time.time() - start < 1.0)
+
+    # flush() waits for the records to be written, without blocking the
+    # other greenlets when called from a greenlet
+    def test_flush(self):
+        import gevent
+
+        class SlowHandler(ListHandler):
+            def emit(self, record):
+                time.sleep(0.2)
+                ListHandler.emit(self, record)
+
+        target = SlowHandler()
+        handler = AsyncLogHandler(target)
+        logger = make_logger("test.flush", handler)
+        logger.info("first")
+        handler.flush()
+        self.assertEqual(target.messages, ["first"])
+
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(time.time())
+                gevent.sleep(0.01)
+
+        def flush():
+            logger.info("second")
+            handler.flush()
+            return list(target.messages)
+
+        ticker = gevent.spawn(tick)
+        self.assertEqual(gevent.spawn(flush).get(), ["first", "second"])
+        ticker.kill()
+        self.assertTrue(len(ticks) > 5, len(ticks))
+        handler.close()
+
+    def test_match_files(self):
+        files = MatchFileHandler(self._dir, max_bytes=200, backup_count=2, max_open=1)
+        files.setFormatter(logging.Formatter("%(matchid)s %(message)s"))
+        handler = AsyncLogHandler(files)
+        logger = make_logger("test.match", handler)
+        logger.info("outside")
+        set_current_match("match/1")
+        for i in range(20): logger.info(_fmt("move {0}", i))
+        set_current_match("match2")
+        logger.info("second match")
+        handler.close()
+
+        with open(files.filename(None)) as f: self.assertEqual(f.read(), "None outside\n")
+        with open(files.filename("match2")) as f:
+            self.assertEqual(f.read(), "match2 second match\n")
+
+        # The first match has been rotated
+        path = files.filename("match/1")
+        self.assertEqual(os.path.basename(path), "match_1.log")
+        self.assertTrue(os.path.exists(path + ".1"))
+        self.assertFalse(os.path.exists(path + ".3"))
+        with open(path) as f: self.assertTrue(f.read().endswith("match/1 move 19\n"))
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import random
+import unittest
+import logging
+
+from ggputils.gdl import KnowledgeBase
+from ggputils.reasoner import StateMachine
+from ggputils.compiler import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+def load_game(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games", name)
+    with open(path) as f: return KnowledgeBase.from_gdl(f.read())
+
+#---------------------------------------------------------------------------------
+# Unit test class. The compiled rules are cross checked against the
+# interpreter.
+#---------------------------------------------------------------------------------
+class CompilerTest(unittest.TestCase):
+
+    def _cross_check(self, kb, rollouts=10):
+        sm = StateMachine(kb)
+        cm = CompiledStateMachine(kb)
+        rng = random.Random(0)
+        for i in range(rollouts):
+            state = sm.initial_state()
+            self.assertEqual(cm.initial_state(), state)
+            while True:
+                self.assertEqual(cm.is_terminal(state), sm.is_terminal(state))
+                self.assertEqual(cm.goals(state), sm.goals(state))
+                if sm.is_terminal(state): break
+                legal = sm.legal_joint_moves(state)
+                self.assertEqual(cm.legal_joint_moves(state), legal)
+                joint = [rng.choice(moves) for moves in legal]
+                nstate = sm.next_state(state, joint)
+                self.assertEqual(cm.next_state(state, joint), nstate)
+                state = nstate
+
+    def test_games(self):
+        self._cross_check(load_game("tictactoe.kif"))
+        self._cross_check(load_game("connectfour.kif"))
+
+    def test_recursion_and_negation(self):
+        gdl = """(role r) (init (edge a b)) (init (edge b c)) (init (edge c d))
+                 (node a) (node b) (node c) (node d)
+                 (<= (reach ?x ?y) (true (edge ?x ?y)))
+                 (<= (reach ?x ?z) (reach ?x ?y) (true (edge ?y ?z)))
+                 (<= (unreached ?x ?y) (node ?x) (node ?y) (not (reach ?x ?y)))
+                 (<= (legal r (link ?x ?y)) (unreached ?x ?y) (distinct ?x ?y))
+                 (<= (next (edge ?x ?y)) (true (edge ?x ?y)))
+                 (<= (next (edge ?x ?y)) (does r (link ?x ?y)))
+                 (<= (same ?x ?x) (node ?x))
+                 (<= terminal (not (unreached a a)) (same a a))"""
+        self._cross_check(KnowledgeBase.from_gdl(gdl))
+
+    def test_source_and_cache(self):
+        clear_cache()
+        kb = load_game("tictactoe.kif")
+        compiled = compile_rules(kb)
+        self.assertEqual(compiled.hash, kb.hash)
+        self.assertTrue(compiled is compile_rules(load_game("tictactoe.kif")))
+        self.assertEqual(len(compiled), sum(len(kb.rules(k)) for k in kb.relations()))
+
+        # Each rule is a commented function
+        rule = kb.rules("legal", 2)[0]
+        self.assertTrue(callable(compiled.function(rule)))
+        self.assertTrue("\ndef " in compiled.source)
+        self.assertTrue("# (<= (legal" in compiled.source)
+        self.assertTrue(CompiledReasoner(kb).compiled is compiled)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+import logging
+
+from ggputils.gdl import *
+from ggputils.utils import parse_simple_sexp
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+def load_game(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games", name)
+    with open(path) as f: return f.read()
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class KnowledgeBaseTest(unittest.TestCase):
+
+    def test_indexing(self):
+        kb = KnowledgeBase.from_gdl(load_game("tictactoe.kif"))
+        self.assertEqual(kb.roles, ["xplayer", "oplayer"])
+        self.assertEqual(len(kb.facts("init", 1)), 10)
+        self.assertEqual(kb.facts(INIT)[-1], ["init", ["control", "xplayer"]])
+        self.assertEqual(len(kb.rules(LEGAL)), 3)
+        self.assertEqual(len(kb.rules(GOAL)), 6)
+        self.assertEqual(len(kb.rules(TERMINAL)), 3)
+        self.assertEqual(len(kb.rules(BASE)), 2)
+        self.assertEqual(len(kb.rules(INPUT)), 2)
+        self.assertEqual(kb.rules("foo", 3), [])
+        self.assertTrue(kb.is_defined("index", 1))
+        self.assertFalse(kb.is_defined("index", 2))
+
+        # The (or ...) in the next rule is expanded
+        self.assertEqual(len(kb.rules(NEXT)), 7)
+        self.assertEqual(kb.rules(NEXT)[4].body[-1], ["distinct", "?n", "?k"])
+
+    # A bare name covers the relations of every arity with that name
+    def test_bare_names(self):
+        kb = KnowledgeBase.from_gdl(load_game("tictactoe.kif"))
+        self.assertEqual(kb.facts("init"), kb.facts(INIT))
+        self.assertEqual(kb.rules("legal"), kb.rules(LEGAL))
+        self.assertEqual(kb.rules("terminal"), kb.rules(TERMINAL))
+        self.assertTrue(kb.is_defined("legal"))
+        self.assertFalse(kb.is_defined("foo"))
+        self.assertEqual(kb.dependencies("terminal"), kb.dependencies(TERMINAL))
+        self.assertEqual(kb.stratum("legal"), kb.stratum(LEGAL))
+        self.assertFalse(kb.is_recursive("line"))
+        self.assertRaises(KeyError, kb.stratum, "foo")
+
+        kb = KnowledgeBase.from_gdl("(role r) (p) (p 1) (p 1 2) (<= (q ?x) (p ?x) (not p))")
+        self.assertEqual(kb.facts("p"), [["p"], ["p", "1"], ["p", "1", "2"]])
+        self.assertEqual(kb.facts("p", 1), [["p", "1"]])
+        self.assertEqual(kb.dependencies("q"),
+                         frozenset([(("p", 1), False), (("p", 0), True)]))
+        self.assertEqual(kb.stratum("q"), 1)
+
+    def test_keywords(self):
+        kb = KnowledgeBase.from_gdl(("(ROLE Robot) (INIT (Cell 1)) "
+                                     "(<= (NEXT (Cell ?X)) (TRUE (Cell ?X)) (NOT TERMINAL))"))
+        self.assertEqual(kb.roles, ["Robot"])
+        self.assertEqual(kb.facts(INIT), [["init", ["Cell", "1"]]])
+        self.assertEqual(kb.rules(NEXT)[0].body,
+                         [["true", ["Cell", "?X"]], ["not", "terminal"]])
+
+    def test_hash(self):
+        kb1 = KnowledgeBase.from_gdl("(ROLE r) (init p)  ; comment\n(<= (next p) (TRUE p))")
+        kb2 = KnowledgeBase.from_gdl("(role r)\n(init p) (<= (next p)\n  (true p))")
+        kb3 = KnowledgeBase.from_gdl("(role r) (init q) (<= (next p) (true p))")
+        self.assertEqual(kb1.hash, kb2.hash)
+        self.assertNotEqual(kb1.hash, kb3.hash)
+        self.assertEqual(kb1.hash, game_hash(kb2.sentences))
+        self.assertEqual(len(kb1.hash), 40)
+
+    def test_stratification(self):
+        kb = KnowledgeBase.from_gdl(load_game("tictactoe.kif"))
+        self.assertEqual(kb.dependencies(TERMINAL),
+                         frozenset([(("line", 1), False), (("open", 0), True)]))
+        self.assertTrue(kb.stratum(TERMINAL) > kb.stratum("open", 0))
+        self.assertTrue(kb.stratum(GOAL) > kb.stratum("line", 1))
+        self.assertFalse(kb.is_recursive("line", 1))
+
+        # Components are in evaluation order
+        seen = set()
+        for component in kb.components:
+            for key in component:
+                for (dep, negative) in kb.dependencies(key):
+                    self.assertTrue(dep in seen or dep in component)
+            seen.update(component)
+
+        gdl = ("(role r) (<= (reach ?x ?y) (edge ?x ?y)) "
+               "(<= (reach ?x ?z) (reach ?x ?y) (edge ?y ?z)) "
+               "(<= (unreached ?x ?y) (node ?x) (node ?y) (not (reach ?x ?y)))")
+        kb = KnowledgeBase.from_gdl(gdl)
+        self.assertTrue(kb.is_recursive("reach", 2))
+        self.assertEqual(kb.stratum("reach", 2), 0)
+        self.assertEqual(kb.stratum("unreached", 2), 1)
+        self.assertEqual(kb.strata[1], [("unreached", 2)])
+
+        gdl = "(role r) (<= p (not q)) (<= q (not p))"
+        self.assertRaises(ValueError, KnowledgeBase.from_gdl, gdl)
+        self.assertRaises(ValueError, KnowledgeBase.from_gdl, "(init p)")
+
+class GDLTest(unittest.TestCase):
+
+    def test_views(self):
+        text = strip_comments(load_game("tictactoe.kif"))
+        gdl = GDL(text)
+        self.assertEqual(gdl, text)
+        self.assertTrue(isinstance(gdl, str))
+
+        # The roles don't need the full parse
+        self.assertEqual(gdl.roles, ["xplayer", "oplayer"])
+        self.assertTrue(gdl._tokens is None and gdl._exp is None)
+
+        self.assertEqual(gdl.tokens[:4], ["(", "role", "xplayer", ")"])
+        self.assertEqual(gdl.exp, parse_simple_sexp("({0})".format(text)))
+        self.assertTrue(gdl.exp is gdl.exp)
+        self.assertEqual(len(gdl.predicates[INIT]), 10)
+        self.assertEqual(len(gdl.predicates[LEGAL]), 3)
+        self.assertEqual(gdl.predicates[ROLE], [["role", "xplayer"], ["role", "oplayer"]])
+        self.assertEqual(gdl.kb.roles, gdl.roles)
+        self.assertTrue(gdl.kb is gdl.kb)
+        self.assertEqual(gdl.hash, KnowledgeBase.from_gdl(text).hash)
+
+        gdl = GDL("(ROLE r) (init p) (<= (NEXT p) (true p))")
+        self.assertEqual(gdl.hash, game_hash(gdl.exp))
+        self.assertEqual(gdl.predicates[NEXT], [["<=", ["NEXT", "p"], ["true", "p"]]])
+        self.assertEqual(gdl.roles, ["r"])
+        self.assertRaises(ValueError, lambda: GDL("(role r) (init p").roles)
+        self.assertRaises(ValueError, lambda: GDL("(role r) (init p").exp)
+
+        # The views are built from the text without comments
+        text = load_game("tictactoe.kif")
+        self.assertTrue(";" in text)
+        text = "; (role commented)\n" + text
+        gdl = GDL(text)
+        self.assertEqual(gdl.stripped, strip_comments(text))
+        self.assertEqual(gdl.roles, ["xplayer", "oplayer"])
+        self.assertEqual(gdl.exp, parse_simple_sexp("({0})".format(strip_comments(text))))
+        self.assertEqual(gdl.hash, KnowledgeBase.from_gdl(text).hash)
+        self.assertEqual(GDL(text).kb.hash, gdl.hash)
+        self.assertEqual(GDL("(role r) ; (role s)\n(init p)").roles, ["r"])
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,15 @@ from wsgiref.util import setup_testing_defaults
 import StringIO
 import string
 import logging
-
+import time
+import zlib
+import gevent
+import gevent.pywsgi
+import gevent.socket
+
+from ggputils.gdl import KnowledgeBase
+from ggputils.openingbook import OpeningBook
+from ggputils.asynclog import current_match
 from ggputils.player.ggp_http_handler import Handler
 
 #---------------------------------------------------------------------------------
@@ -50,14 +58,14 @@ def make_handler(on_start=None,
                  on_play=None, on_stop=None,
                  on_play2=None, on_stop2=None,
                  on_abort=None, on_info=None,on_preview=None,
-                 protocol_version=Handler.GGP1):
+                 protocol_version=Handler.GGP1, **kwargs):
     return Handler(on_start=on_start,
                    on_play=on_play, on_stop=on_stop,
                    on_play2=on_play2, on_stop2=on_stop2,
                    on_abort=on_abort, on_info=on_info,
                    on_preview=on_preview,
                    protocol_version=protocol_version,
-                   test_mode=True)
+                   test_mode=True, **kwargs)
 
 def make_environ(data):
     environ = { 'REQUEST_METHOD': 'POST',
@@ -81,6 +89,12 @@ class GGPHandlerTest(unittest.TestCase):
         self.assertNotEqual(status, "200 OK")
 #        print "Status: {0}".format(status)
 
+    # A start_response that checks for the given error status code
+    def start_response_status(self, code):
+        def start_response(status, headers):
+            self.assertEqual(status.split()[0], str(code))
+        return start_response
+
     def start_response_print(self, status, headers):
         print "Status: {0}, headers: {1}".format(status,headers)
 
@@ -104,6 +118,8 @@ class GGPHandlerTest(unittest.TestCase):
         def on_start(timeout, matchid, role, gdl, playclock):
             self.assertEqual(role, "robot")
             self.assertEqual(gdl, "(role robot) (other gdl)")
+            self.assertEqual(gdl.roles, ["robot"])
+            self.assertEqual(gdl.exp, [["role", "robot"], ["other", "gdl"]])
             self.assertEqual(playclock, int(5))
 
         handler = make_handler(on_start=on_start)
@@ -118,6 +134,184 @@ class GGPHandlerTest(unittest.TestCase):
         body = handler(environ, self.start_response_status_ok)
         self.assertEqual(body, "READY")
 
+    #------------------------------------------
+    # Test GGP START message with a knowledge base
+    #------------------------------------------
+    def test_start_message_kb(self):
+
+        class TMP(object):
+            def __init__(self):
+                self._kb = None
+
+            def on_start(self, timeout, matchid, role, gdl, playclock, kb):
+                self._kb = kb
+                self._gdl = gdl
+
+        tmp = TMP()
+        handler = make_handler(on_start=tmp.on_start, knowledge_base=True)
+        environ = make_environ(("(START testmatch1 robot ((role robot) (init (cell 1)) "
+                                "(<= (next (cell ?x)) (true (cell ?x)))) 10 5)"))
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(body, "READY")
+        self.assertEqual(tmp._kb.roles, ["robot"])
+        self.assertTrue(tmp._kb is tmp._gdl.kb)
+        self.assertEqual(len(tmp._kb.rules("next", 1)), 1)
+
+    def test_start_message_game_hash(self):
+
+        class TMP(object):
+            def __init__(self):
+                self._hashes = []
+
+            def on_start(self, timeout, matchid, role, gdl, playclock, **kwargs):
+                self._hashes.append(kwargs["game_hash"])
+
+        tmp = TMP()
+        gdl = "(role robot) (init (cell 1)) (<= (next (cell ?x)) (true (cell ?x)))"
+        for kwargs in [{}, {"knowledge_base": True}]:
+            handler = make_handler(on_start=tmp.on_start, game_hash=True, **kwargs)
+            environ = make_environ("(START testmatch1 robot ({0}) 10 5)".format(gdl))
+            body = handler(environ, self.start_response_status_ok)
+            self.assertEqual(body, "READY")
+        self.assertEqual(tmp._hashes[0], tmp._hashes[1])
+        self.assertEqual(tmp._hashes[0], KnowledgeBase.from_gdl(gdl).hash)
+
+    #------------------------------------------
+    # Test compressed requests and responses
+    #------------------------------------------
+    def test_compression(self):
+        gdl = " ".join("(init (cell {0}))".format(i) for i in range(1000))
+        message = "(START testmatch1 robot ((role robot) {0}) 10 5)".format(gdl)
+        received = []
+
+        def on_start(timeout, matchid, role, gdl, playclock):
+            received.append(gdl)
+
+        def compress(data, wbits):
+            encoder = zlib.compressobj(9, zlib.DEFLATED, wbits)
+            return encoder.compress(data) + encoder.flush()
+
+        for (encoding, wbits) in [("gzip", 16 + zlib.MAX_WBITS),
+                                  ("deflate", zlib.MAX_WBITS),
+                                  ("deflate", -zlib.MAX_WBITS)]:
+            handler = make_handler(on_start=on_start)
+            data = compress(message, wbits)
+            self.assertTrue(len(data) < len(message) / 5)
+            environ = make_environ(data)
+            environ["HTTP_CONTENT_ENCODING"] = encoding
+            body = handler(environ, self.start_response_status_ok)
+            self.assertEqual(body, "READY")
+        self.assertEqual(received, ["(role robot) " + gdl] * 3)
+
+        # Unknown encodings are rejected with 415 and bad, truncated or
+        # trailing data with 400
+        handler = make_handler(on_start=on_start)
+        gzipped = compress(message, 16 + zlib.MAX_WBITS)
+        deflated = compress(message, zlib.MAX_WBITS)
+        for (encoding, data, code) in [("br", message, 415), ("gzip", message, 400),
+                                       ("gzip", gzipped[:-20], 400), ("gzip", gzipped[:-8], 400),
+                                       ("gzip", gzipped[:-1], 400), ("deflate", deflated[:-4], 400),
+                                       ("gzip", gzipped + "garbage", 400)]:
+            environ = make_environ(data)
+            environ["HTTP_CONTENT_ENCODING"] = encoding
+            self.assertFalse(handler(environ, self.start_response_status(code)))
+        self.assertEqual(len(received), 3)
+
+        # Compressed responses only if they are accepted and long enough
+        headers = {}
+        def start_response(status, response_headers):
+            self.assertEqual(status, "200 OK")
+            headers.clear()
+            headers.update(response_headers)
+
+        def on_play(timeout, actions):
+            return "(move {0})".format(" ".join(["a"] * 100))
+
+        handler = make_handler(on_start=on_start, on_play=on_play, compress_responses=100)
+        handler(make_environ("(START testmatch1 robot ((role robot)) 10 5)"), start_response)
+        self.assertFalse("Content-Encoding" in headers)
+        for accept in ["gzip", "deflate, gzip;q=0.5", "gzip;q=0", "identity", None]:
+            environ = make_environ("(PLAY testmatch1 NIL)")
+            if accept: environ["HTTP_ACCEPT_ENCODING"] = accept
+            body = handler(environ, start_response)
+            if accept in ["gzip", "deflate, gzip;q=0.5"]:
+                self.assertEqual(headers["Content-Encoding"], "gzip")
+                self.assertEqual(headers["Content-Length"], str(len(body)))
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            else:
+                self.assertFalse("Content-Encoding" in headers)
+            self.assertEqual(body, on_play(None, None))
+
+    #------------------------------------------
+    # Test chunked request bodies and the message size limit
+    #------------------------------------------
+    def test_chunked_request(self):
+        gdl = " ".join("(init (cell {0}))".format(i) for i in range(10000))
+        message = "(START testmatch1 robot ((role robot) {0}) 10 5)".format(gdl)
+        received = []
+
+        def on_start(timeout, matchid, role, gdl, playclock):
+            received.append(gdl)
+
+        def post(handler, data, encoding=None):
+            server = gevent.pywsgi.WSGIServer(("127.0.0.1", 0), handler, log=None)
+            server.start()
+            try:
+                sock = gevent.socket.create_connection(("127.0.0.1", server.server_port))
+                headers = "POST / HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n"
+                if encoding: headers += "Content-Encoding: {0}\r\n".format(encoding)
+                sock.sendall(headers + "Connection: close\r\n\r\n")
+                for i in range(0, len(data), 5000):
+                    chunk = data[i:i + 5000]
+                    sock.sendall("{0:x}\r\n{1}\r\n".format(len(chunk), chunk))
+                sock.sendall("0\r\n\r\n")
+                response = []
+                while True:
+                    block = sock.recv(65536)
+                    if not block: break
+                    response.append(block)
+                sock.close()
+                return "".join(response)
+            finally:
+                server.stop()
+
+        handler = make_handler(on_start=on_start)
+        response = post(handler, message)
+        self.assertTrue(response.startswith("HTTP/1.1 200"))
+        self.assertTrue(response.endswith("READY"))
+        handler = make_handler(on_start=on_start)
+        encoder = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        response = post(handler, encoder.compress(message) + encoder.flush(), "gzip")
+        self.assertTrue(response.endswith("READY"))
+        self.assertEqual(received, ["(role robot) " + gdl] * 2)
+
+        # Messages over the size limit are rejected, chunked or not
+        handler = make_handler(on_start=on_start, max_message_size=len(message) - 1)
+        self.assertTrue(post(handler, message).startswith("HTTP/1.1 413"))
+        self.assertFalse(handler(make_environ(message), self.start_response_status(413)))
+        handler = make_handler(on_start=on_start, max_message_size=len(message))
+        self.assertEqual(handler(make_environ(message), self.start_response_status_ok), "READY")
+        self.assertEqual(len(received), 3)
+
+        # Without a length or chunked encoding the length is required
+        environ = make_environ(message)
+        del environ["CONTENT_LENGTH"]
+        self.assertFalse(handler(environ, self.start_response_status(411)))
+
+    #------------------------------------------
+    # Test that the current match (for logging) is cleared at STOP and ABORT
+    #------------------------------------------
+    def test_current_match(self):
+        def callback(*args, **kwargs): pass
+        handler = make_handler(on_start=callback, on_stop=callback, on_abort=callback)
+        for (end, response) in [("(STOP testmatch1 ((a move)))", "DONE"),
+                                ("(ABORT testmatch1)", "ABORTED")]:
+            handler(make_environ("(START testmatch1 robot ((role robot)) 10 5)"),
+                    self.start_response_status_ok)
+            self.assertEqual(current_match(), "testmatch1")
+            self.assertEqual(handler(make_environ(end), self.start_response_status_ok), response)
+            self.assertEqual(current_match(), None)
+
     #------------------------------------------
     # Test GGP ABORT message
     #------------------------------------------
@@ -298,6 +492,260 @@ class GGPHandlerTest(unittest.TestCase):
         body = handler(environ, self.start_response_status_not_ok)
         self.assertFalse(body)
 
+    #------------------------------------------
+    # Test GGP PLAY messages with span based action extraction
+    #------------------------------------------
+    def test_play_message_spans(self):
+
+        class TMP(object):
+            def __init__(self):
+                self._actions = None
+                self._action = None
+                self._observations = []
+
+            def on_play(self, timeout, actions):
+                self._actions = actions
+                return "noop"
+
+            def on_play2(self, timeout, action, observations):
+                self._action = action
+                self._observations = observations
+                return "noop"
+
+        def on_start(timeout, matchid, role, gdl, playclock):
+            pass
+
+        tmp = TMP()
+        handler = make_handler(on_start=on_start, on_play=tmp.on_play,
+                               action_spans=True)
+        environ = make_environ("(START testmatch1 robot ((role robot) (role other)) 10 5)")
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 ((mark  1 2) noop))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._actions, {"robot": "(mark  1 2)", "other": "noop"})
+
+        handler = make_handler(on_start=on_start, on_play2=tmp.on_play2,
+                               protocol_version=Handler.GGP2, action_spans=True)
+        environ = make_environ("(START testmatch1 robot ((role robot) (role random)) 10 5)")
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 0 NIL NIL)")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._action, None)
+        self.assertEqual(tmp._observations, [])
+        environ = make_environ("(PLAY testmatch1 1 (a move) ((one) (two)   three))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._action, "(a move)")
+        self.assertEqual(tmp._observations, ["(one)", "(two)", "three"])
+        environ = make_environ("(PLAY testmatch1 2 (another move))")
+        body = handler(environ, self.start_response_status_not_ok)
+        self.assertFalse(body)
+
+    #------------------------------------------
+    # Test GGP PLAY messages with structured actions
+    #------------------------------------------
+    def test_play_message_structured(self):
+
+        class TMP(object):
+            def __init__(self):
+                self._actions = None
+                self._action = None
+                self._observations = []
+
+            def on_play(self, timeout, actions):
+                self._actions = actions
+                return ["mark", "1", "2"]
+
+            def on_play2(self, timeout, action, observations):
+                self._action = action
+                self._observations = observations
+                return "noop"
+
+        def on_start(timeout, matchid, role, gdl, playclock):
+            pass
+
+        tmp = TMP()
+        handler = make_handler(on_start=on_start, on_play=tmp.on_play,
+                               structured_actions=True)
+        environ = make_environ("(START testmatch1 robot ((role robot) (role other)) 10 5)")
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 NIL)")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._actions, {})
+        self.assertEqual(body, "(mark 1 2)")
+        environ = make_environ("(PLAY testmatch1 ((mark  1 2) noop))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._actions, {"robot": ["mark", "1", "2"], "other": "noop"})
+
+        handler = make_handler(on_start=on_start, on_play2=tmp.on_play2,
+                               protocol_version=Handler.GGP2, structured_actions=True)
+        environ = make_environ("(START testmatch1 robot ((role robot) (role random)) 10 5)")
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 0 NIL NIL)")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._action, None)
+        self.assertEqual(tmp._observations, [])
+        environ = make_environ("(PLAY testmatch1 1 (a move) ((one) (two 2) three))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._action, ["a", "move"])
+        self.assertEqual(tmp._observations, [["one"], ["two", "2"], "three"])
+
+    #------------------------------------------
+    # Test GGP PLAY messages with an opening book
+    #------------------------------------------
+    def test_play_message_opening_book(self):
+
+        class TMP(object):
+            def __init__(self):
+                self._book_moves = []
+
+            def on_start(self, timeout, matchid, role, gdl, playclock, **kwargs):
+                pass
+
+            def on_play(self, timeout, actions, book_move):
+                self._book_moves.append(book_move)
+                return book_move if book_move else "(mark 1  1)"
+
+            def on_stop(self, timeout, actions):
+                pass
+
+        def play_match(book, tmp, **kwargs):
+            handler = make_handler(on_start=tmp.on_start, on_play=tmp.on_play,
+                                   on_stop=tmp.on_stop, opening_book=book, **kwargs)
+            gdl = "(role xplayer) (role oplayer) (init (cell 1 1 b))"
+            bodies = []
+            for message in ["(START m1 xplayer ({0}) 10 5)".format(gdl), "(PLAY m1 NIL)",
+                            "(PLAY m1 ((mark 1 1) noop))", "(STOP m1 (noop (mark 2  2)))"]:
+                bodies.append(handler(make_environ(message), self.start_response_status_ok))
+            return bodies
+
+        book = OpeningBook()
+        tmp = TMP()
+        bodies = play_match(book, tmp)
+        self.assertEqual(bodies[1:3], ["(mark 1  1)", "(mark 1  1)"])
+        self.assertEqual(tmp._book_moves, [None, None])
+        self.assertEqual(book.misses, 2)
+        record = book.last_match
+        self.assertEqual(record.role, "xplayer")
+        self.assertEqual(record.moves, [((), "(mark 1 1)"),
+                                        (((("(mark 1 1)", "noop")),), "(mark 1 1)")])
+
+        # Learn from the match and replay it
+        book.learn(record, 100)
+        book.add(record.game_hash, "xplayer", (), "(mark 2 2)", 50)
+        tmp = TMP()
+        bodies = play_match(book, tmp)
+        self.assertEqual(tmp._book_moves, ["(mark 1 1)", "(mark 1 1)"])
+        self.assertEqual(book.hits, 2)
+
+        # The history is the same whatever the format of the actions
+        for kwargs in [{"action_spans": True}, {"structured_actions": True},
+                       {"integer_actions": True}]:
+            other = OpeningBook()
+            play_match(other, TMP(), **kwargs)
+            self.assertEqual(other.last_match.moves, record.moves)
+
+        # GDL-II: the history is of the last moves and the observations
+        class TMP2(TMP):
+            def on_play2(self, timeout, action, observations, book_move):
+                self._book_moves.append(book_move)
+                return "(mark 1  1)"
+
+            def on_stop2(self, timeout, action, observations):
+                pass
+
+        records = []
+        for kwargs in [{}, {"action_spans": True}, {"structured_actions": True},
+                       {"integer_actions": True}]:
+            book = OpeningBook()
+            tmp = TMP2()
+            handler = make_handler(on_start=tmp.on_start, on_play2=tmp.on_play2,
+                                   on_stop2=tmp.on_stop2, protocol_version=Handler.GGP2,
+                                   opening_book=book,
+                                   **kwargs)
+            for message in ["(START m1 robot ((role robot) (role random)) 10 5)",
+                            "(PLAY m1 0 NIL NIL)",
+                            "(PLAY m1 1 (mark 1  1) ((two  2) (one)))",
+                            "(STOP m1 2 (mark 1 1) NIL)"]:
+                handler(make_environ(message), self.start_response_status_ok)
+            records.append(book.last_match.moves)
+        self.assertEqual(records[0], [((), "(mark 1 1)"),
+                                      (((("(mark 1 1)", ("(one)", "(two 2)"))),), "(mark 1 1)")])
+        for moves in records[1:]: self.assertEqual(moves, records[0])
+
+    #------------------------------------------
+    # Test GGP PLAY messages with integer actions
+    #------------------------------------------
+    def test_play_message_integer(self):
+
+        class TMP(object):
+            def __init__(self):
+                self._symbols = None
+                self._actions = None
+                self._action = None
+                self._observations = []
+
+            def on_start(self, timeout, matchid, role, gdl, playclock, symbols):
+                self._symbols = symbols
+
+            def on_play(self, timeout, actions):
+                self._actions = actions
+                return self._symbols.actions.get("noop")
+
+            def on_play2(self, timeout, action, observations):
+                self._action = action
+                self._observations = observations
+                return "noop"
+
+        tmp = TMP()
+        handler = make_handler(on_start=tmp.on_start, on_play=tmp.on_play,
+                               integer_actions=True)
+        environ = make_environ(("(START testmatch1 robot ((role robot) (role other) "
+                                "(input robot noop)) 10 5)"))
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._symbols.actions.symbols, ["noop"])
+        environ = make_environ("(PLAY testmatch1 NIL)")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._actions, ())
+        self.assertEqual(body, "noop")
+        environ = make_environ("(PLAY testmatch1 ((mark  1 2) noop))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._actions, (1, 0))
+        self.assertEqual(tmp._symbols.actions.symbol(1), "(mark 1 2)")
+
+        # An invalid action id is replaced with NOOP
+        handler = make_handler(on_start=tmp.on_start, on_play=lambda t, a: 999,
+                               integer_actions=True)
+        environ = make_environ(("(START testmatch1 robot ((role robot) (role other) "
+                                "(input robot noop)) 10 5)"))
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 NIL)")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(body, "NOOP")
+
+        handler = make_handler(on_start=tmp.on_start, on_play2=tmp.on_play2,
+                               protocol_version=Handler.GGP2, integer_actions=True)
+        environ = make_environ("(START testmatch1 robot ((role robot) (role random)) 10 5)")
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 0 NIL NIL)")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._action, None)
+        self.assertEqual(tmp._observations, ())
+        environ = make_environ("(PLAY testmatch1 1 (a move) ((one) (two 2) (one)))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(tmp._action, 0)
+        self.assertEqual(tmp._observations, (0, 1, 0))
+
+        handler = make_handler(on_start=tmp.on_start, on_play2=tmp.on_play2,
+                               protocol_version=Handler.GGP2, integer_actions=True,
+                               observation_arrays=True)
+        environ = make_environ("(START testmatch1 robot ((role robot) (role random)) 10 5)")
+        body = handler(environ, self.start_response_status_ok)
+        environ = make_environ("(PLAY testmatch1 0 NIL ((two 2) (one) (two 2)))")
+        body = handler(environ, self.start_response_status_ok)
+        self.assertEqual(list(tmp._observations), [0, 1])
+        self.assertEqual(tmp._symbols.observations.decode(tmp._observations),
+                         ["(two 2)", "(one)"])
+
     #------------------------------------------
     # Test GGP STOP2 message
     # FIXUP: for completeness should add gdl2 stop message testing but
@@ -343,6 +791,124 @@ class GGPHandlerTest(unittest.TestCase):
         body = handler(environ, self.start_response_status_ok)
         self.assertTrue(tmp._called)
 
+    #------------------------------------------
+    # Test catching up with PLAY messages that have queued up
+    #------------------------------------------
+    def test_play_message_catch_up(self):
+
+        class TMP(object):
+            def __init__(self, handler=None):
+                self.handler = handler
+                self.calls = []
+                self.backlog = []
+
+            def on_start(self, timeout, matchid, role, gdl, playclock):
+                pass
+
+            def on_play(self, timeout, actions, stale):
+                self.calls.append((actions, stale))
+                self.backlog.append(self.handler.backlog)
+                if not stale: gevent.sleep(0.1)
+                return "noop"
+
+            def on_stop(self, timeout, actions):
+                self.calls.append((actions, "stop"))
+
+        tmp = TMP()
+        handler = make_handler(on_start=tmp.on_start, on_play=tmp.on_play,
+                               on_stop=tmp.on_stop, catch_up=True)
+        tmp.handler = handler
+        environ = make_environ("(START testmatch1 robot ((role robot)) 10 5)")
+        self.assertEqual(handler(environ, self.start_response_status_ok), "READY")
+
+        messages = ["(PLAY testmatch1 NIL)", "(PLAY testmatch1 (a))", "(PLAY testmatch1 (b))",
+                    "(PLAY testmatch1 (c))", "(STOP testmatch1 (d))"]
+        greenlets = []
+        for message in messages:
+            greenlets.append(gevent.spawn(handler, make_environ(message),
+                                          self.start_response_status_ok))
+            gevent.sleep(0)
+        self.assertEqual([g.get() for g in greenlets], ["noop"] * 4 + ["DONE"])
+
+        # All updates are applied in order. Only the first PLAY (handled before
+        # the others arrived) is not stale since the last PLAY is followed by a STOP
+        self.assertEqual(tmp.calls, [({}, False), ({"robot": "a"}, True),
+                                     ({"robot": "b"}, True), ({"robot": "c"}, True),
+                                     ({"robot": "d"}, "stop")])
+        self.assertEqual(tmp.backlog, [0, 3, 2, 1])
+        self.assertEqual(handler.backlog, 0)
+
+        # Without a backlog the PLAY is not stale
+        tmp.calls = []
+        handler(make_environ("(START testmatch2 robot ((role robot)) 10 5)"),
+                self.start_response_status_ok)
+        handler(make_environ("(PLAY testmatch2 NIL)"), self.start_response_status_ok)
+        self.assertEqual(tmp.calls, [({}, False)])
+
+    #------------------------------------------
+    # Test preempting a running on_play when an ABORT or STOP arrives
+    #------------------------------------------
+    def test_play_message_preempt(self):
+
+        class TMP(object):
+            def __init__(self):
+                self.events = []
+
+            def on_start(self, timeout, matchid, role, gdl, playclock):
+                pass
+
+            # A search that checks the cancellation flag
+            def on_play(self, timeout, actions):
+                while not timeout.cancelled: gevent.sleep(0.01)
+                self.events.append("cancelled")
+                return "move"
+
+            # A search that doesn't
+            def on_play_forever(self, timeout, actions):
+                self.events.append("searching")
+                gevent.sleep(60)
+                self.events.append("finished")
+                return "move"
+
+            def on_stop(self, timeout, actions):
+                self.events.append("stop")
+
+            def on_abort(self):
+                self.events.append("abort")
+
+        def run(handler, play, other):
+            handler(make_environ("(START testmatch1 robot ((role robot)) 10 60)"),
+                    self.start_response_status_ok)
+            start = time.time()
+            greenlets = [gevent.spawn(handler, make_environ(play),
+                                      self.start_response_status_ok)]
+            gevent.sleep(0.05)
+            for message in other:
+                greenlets.append(gevent.spawn(handler, make_environ(message),
+                                              self.start_response_status_ok))
+            results = [g.get() for g in greenlets]
+            self.assertTrue(time.time() - start < 1.0)
+            return results
+
+        # The timeout is cancelled by a STOP and an ABORT
+        tmp = TMP()
+        handler = make_handler(on_start=tmp.on_start, on_play=tmp.on_play,
+                               on_stop=tmp.on_stop, on_abort=tmp.on_abort)
+        results = run(handler, "(PLAY testmatch1 NIL)", ["(STOP testmatch1 (a))"])
+        self.assertEqual(results, ["move", "DONE"])
+        results = run(handler, "(PLAY testmatch1 NIL)", ["(ABORT testmatch1)"])
+        self.assertEqual(results, ["move", "ABORTED"])
+        self.assertEqual(tmp.events, ["cancelled", "stop", "cancelled", "abort"])
+
+        # With preempt the callback is killed by an ABORT and queued PLAYs skipped
+        tmp = TMP()
+        handler = make_handler(on_start=tmp.on_start, on_play=tmp.on_play_forever,
+                               on_stop=tmp.on_stop, on_abort=tmp.on_abort, preempt=True)
+        results = run(handler, "(PLAY testmatch1 NIL)",
+                      ["(PLAY testmatch1 (a))", "(ABORT testmatch1)"])
+        self.assertEqual(results, ["NOOP", "NOOP", "ABORTED"])
+        self.assertEqual(tmp.events, ["searching", "abort"])
+
     #------------------------------------------
     # Test GGP INFO message
     #------------------------------------------
@@ -359,6 +925,98 @@ class GGPHandlerTest(unittest.TestCase):
         body = handler(environ, self.start_response_status_ok)
         self.assertEqual(body, "available")
 
+    #------------------------------------------
+    # Test that INFO messages are answered promptly while a large START
+    # message is being preprocessed.
+    #------------------------------------------
+    def test_info_latency_during_large_start(self):
+
+        gdl = "(role robot) " + " ".join(
+            "(init (cell {0} {1} (blank b)))".format(i, i % 7) for i in range(40000))
+        start_msg = "(START bigmatch robot ({0}) 60 5)".format(gdl)
+
+        # Returns the worst lateness of INFO messages sent every 10ms while
+        # the START is handled.
+        def worst_info_latency(offload_threshold):
+            handler = make_handler(on_start=lambda *args, **kwargs: None,
+                                   knowledge_base=True, game_hash=True,
+                                   offload_threshold=offload_threshold)
+            start = gevent.spawn(handler, make_environ(start_msg),
+                                 self.start_response_status_ok)
+            worst = 0.0
+            while not start.ready():
+                due = time.time() + 0.01
+                gevent.sleep(0.01)
+                body = handler(make_environ("(INFO)"), self.start_response_status_ok)
+                self.assertTrue(body in ["AVAILABLE", "BUSY"])
+                worst = max(worst, time.time() - due)
+            self.assertEqual(start.get(), "READY")
+            return worst
+
+        blocking = worst_info_latency(None)
+        offloaded = worst_info_latency(1024)
+        self.assertTrue(offloaded < blocking / 4,
+                        "INFO latency {0}s (blocking {1}s)".format(offloaded, blocking))
+
+    #------------------------------------------
+    # Test that a message cannot overtake a START that is being preprocessed
+    #------------------------------------------
+    def test_large_start_ordering(self):
+        gdl = "(role robot) " + " ".join("(init (cell {0}))".format(i) for i in range(20000))
+        events = []
+
+        def on_start(timeout, matchid, role, gdl, playclock):
+            events.append("start")
+
+        def on_abort():
+            events.append("abort")
+
+        handler = make_handler(on_start=on_start, on_abort=on_abort, offload_threshold=1024)
+        start = gevent.spawn(handler, make_environ("(START bigmatch robot ({0}) 60 5)".format(gdl)),
+                             self.start_response_status_ok)
+        gevent.sleep(0)
+        body = handler(make_environ("(ABORT bigmatch)"), self.start_response_status_ok)
+        self.assertEqual(body, "ABORTED")
+        self.assertEqual(start.get(), "READY")
+        self.assertEqual(events, ["start", "abort"])
+
+    #------------------------------------------
+    # Test that INFO and PREVIEW messages don't wait for a running callback
+    #------------------------------------------
+    def test_info_preview_fast_lane(self):
+
+        def on_start(timeout, matchid, role, gdl, playclock):
+            gevent.sleep(0.5)
+
+        def latencies(fast_lane):
+            handler = make_handler(on_start=on_start, fast_lane=fast_lane)
+            start = gevent.spawn(handler,
+                                 make_environ("(START testmatch1 robot ((role robot)) 10 5)"),
+                                 self.start_response_status_ok)
+            gevent.sleep(0.05)
+            result = []
+            for (message, response) in [("(INFO)", "BUSY"),
+                                        ("(PREVIEW ((role robot)) 10)", "DONE")]:
+                begin = time.time()
+                body = handler(make_environ(message), self.start_response_status_ok)
+                result.append(time.time() - begin)
+                self.assertEqual(body, response)
+            self.assertEqual(start.get(), "READY")
+            return result
+
+        self.assertTrue(max(latencies(True)) < 0.1)
+        self.assertTrue(latencies(False)[0] > 0.3)
+
+        # A lowercase INFO/PREVIEW doesn't change the case of the START response
+        handler = make_handler(on_start=on_start)
+        start = gevent.spawn(handler, make_environ("(START testmatch1 robot ((role robot)) 10 5)"),
+                             self.start_response_status_ok)
+        gevent.sleep(0.05)
+        self.assertEqual(handler(make_environ("(info)"), self.start_response_status_ok), "busy")
+        self.assertEqual(handler(make_environ("(preview ((role robot)) 10)"),
+                                 self.start_response_status_ok), "done")
+        self.assertEqual(start.get(), "READY")
+
     #------------------------------------------
     # Test GGP PREVIEW message
     #------------------------------------------
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+import logging
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+# Modules that worker processes use must import quickly and without gevent.
+# The budget (in seconds) is generous so that the test is not flaky on a slow
+# machine but still catches something like gevent (or NumPy, for the modules
+# that do not need it) being imported.
+BUDGET = 0.25
+
+NO_GEVENT = ["ggputils.utils", "ggputils.gdl", "ggputils.reasoner", "ggputils.compiler",
+             "ggputils.symbols", "ggputils.transposition", "ggputils.openingbook",
+             "ggputils.asynclog", "ggputils.shared", "ggputils.rollouts",
+             "ggputils.propnet", "ggputils.mcts", "ggputils.observations",
+             "ggputils.artifacts", "ggputils.player"]
+
+NO_NUMPY = ["ggputils.utils", "ggputils.gdl", "ggputils.reasoner", "ggputils.compiler",
+            "ggputils.symbols", "ggputils.transposition", "ggputils.openingbook",
+            "ggputils.asynclog", "ggputils.shared", "ggputils.rollouts", "ggputils.player",
+            "ggputils.player.ggp_http_handler", "ggputils.player.basic_players"]
+
+_SCRIPT = """
+import json, sys, time
+start = time.time()
+{0}
+elapsed = time.time() - start
+print(json.dumps([elapsed, "gevent" in sys.modules, "numpy" in sys.modules]))
+"""
+
+# Run the statement in a fresh interpreter and return (elapsed, gevent, numpy)
+def timed_import(statement):
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    env["PYTHONPATH"] = os.pathsep.join([src] + [p for p in [env.get("PYTHONPATH")] if p])
+    output = subprocess.check_output([sys.executable, "-c", _SCRIPT.format(statement)],
+                                     env=env)
+    return tuple(json.loads(output.splitlines()[-1]))
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class ImportTest(unittest.TestCase):
+
+    def test_no_gevent(self):
+        for module in NO_GEVENT:
+            (elapsed, gevent, numpy) = timed_import("import " + module)
+            g_logger.info("{0}: {1:.3f}s".format(module, elapsed))
+            self.assertFalse(gevent, module)
+            self.assertTrue(elapsed < BUDGET, module)
+
+    # The server modules need gevent but not NumPy
+    def test_no_numpy(self):
+        for module in NO_NUMPY:
+            (elapsed, gevent, numpy) = timed_import("import " + module)
+            self.assertFalse(numpy, module)
+
+    def test_lazy_players(self):
+        (elapsed, gevent, numpy) = timed_import(
+            "from ggputils.player import SimplePlayer, Handler\n"
+            "import ggputils.player\n"
+            "assert ggputils.player.RawPlayer.__name__ == 'RawPlayer'")
+        self.assertTrue(gevent)
+        (elapsed, gevent, numpy) = timed_import("from ggputils.player import *")
+        self.assertTrue(gevent)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
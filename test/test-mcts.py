@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import math
+import unittest
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ggputils.mcts import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+@unittest.skipIf(np is None, "NumPy is not installed")
+class SearchTreeTest(unittest.TestCase):
+
+    def test_expand_and_select(self):
+        tree = SearchTree(capacity=4)
+        self.assertFalse(tree.is_expanded(tree.root))
+        first = tree.expand(tree.root, [10, 11, 12])
+        self.assertEqual(list(tree.children(tree.root)), [first, first + 1, first + 2])
+        self.assertEqual(tree.child(tree.root, 12), first + 2)
+        self.assertEqual(tree.child(tree.root, 13), NO_NODE)
+        self.assertRaises(ValueError, tree.expand, tree.root, [1])
+
+        # Unvisited children first, then UCT
+        for (i, value) in enumerate([1.0, 0.0, 0.5]):
+            node = tree.select_child(tree.root)
+            self.assertEqual(node, first + i)
+            tree.backpropagate(node, value)
+        self.assertEqual(tree.visits[tree.root], 3)
+        self.assertEqual(tree.select_child(tree.root), first)
+        tree.backpropagate(first, 1.0)
+        parent = tree.visits[tree.root]
+        scores = [tree.mean(n) + math.sqrt(2.0) * math.sqrt(math.log(parent) / tree.visits[n])
+                  for n in tree.children(tree.root)]
+        self.assertEqual(tree.select_child(tree.root), first + scores.index(max(scores)))
+        self.assertEqual(tree.best_child(tree.root), first)
+
+        # Multiple values
+        tree = SearchTree(num_values=2)
+        first = tree.expand(tree.root, [0, 1])
+        tree.backpropagate(first, [100, 0])
+        tree.backpropagate(first + 1, [0, 100])
+        tree.backpropagate(first + 1, [0, 100])
+        self.assertEqual(tree.mean(tree.root, 1), 200.0 / 3)
+        self.assertEqual(tree.select_child(tree.root, c=0.0, value_index=0), first)
+        self.assertEqual(tree.select_child(tree.root, c=0.0, value_index=1), first + 1)
+
+    def test_grow(self):
+        tree = SearchTree(capacity=2)
+        node = tree.root
+        for depth in range(100):
+            node = tree.expand(node, [0, 1, 2])
+            tree.backpropagate(node, 1.0)
+        self.assertEqual(tree.size, 301)
+        self.assertTrue(tree.capacity >= 301)
+        self.assertEqual(len(tree.path(node)), 101)
+        self.assertEqual(tree.visits[tree.root], 100)
+
+    def test_advance(self):
+        tree = SearchTree(capacity=8)
+        first = tree.expand(tree.root, [0, 1])
+        a = tree.expand(first, [5, 6, 7])
+        b = tree.expand(first + 1, [8])
+        tree.expand(a + 1, [])
+        tree.expand(a + 2, [3, 4])
+        for node in [a, a + 1, a + 2, a + 2, b]: tree.backpropagate(node, 1.0)
+
+        self.assertTrue(tree.advance([0]))
+        self.assertEqual(tree.size, 6)
+        self.assertEqual(tree.parent[tree.root], NO_NODE)
+        self.assertEqual(tree.visits[tree.root], 4)
+        self.assertEqual([tree.move[n] for n in tree.children(tree.root)], [5, 6, 7])
+        self.assertEqual([tree.visits[n] for n in tree.children(tree.root)], [1, 1, 2])
+        for n in tree.children(tree.root): self.assertEqual(tree.parent[n], tree.root)
+        leaf = tree.child(tree.root, 6)
+        self.assertTrue(tree.is_expanded(leaf))
+        self.assertEqual(list(tree.children(leaf)), [])
+        node = tree.child(tree.root, 7)
+        self.assertEqual([tree.move[n] for n in tree.children(node)], [3, 4])
+        for n in tree.children(node): self.assertEqual(tree.parent[n], node)
+
+        # Further expansion after compaction
+        self.assertFalse(tree.is_expanded(tree.child(tree.root, 5)))
+        tree.expand(tree.child(tree.root, 5), [1, 2])
+        self.assertEqual(tree.size, 8)
+
+        # Unknown moves clear the tree
+        self.assertFalse(tree.advance([9]))
+        self.assertEqual(tree.size, 1)
+        self.assertEqual(tree.visits[tree.root], 0)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+
+from ggputils.openingbook import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+GAME = "0123456789abcdef0123456789abcdef01234567"
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class OpeningBookTest(unittest.TestCase):
+
+    def test_lookup(self):
+        book = OpeningBook(min_count=2, max_depth=1)
+        book.add(GAME, "x", [], "a", 100)
+        self.assertEqual(book.lookup(GAME, "x", ()), None)
+        book.add(GAME, "x", [], "a", 0)
+        book.add(GAME, "x", [], "b", 80, count=2)
+        self.assertEqual(book.lookup(GAME, "x", ()), "b")
+        self.assertEqual(book.lookup(GAME, "o", ()), None)
+        self.assertEqual(book.lookup("other", "x", ()), None)
+
+        # Depth limit
+        record = MatchRecord(GAME, "x", [((), "a"), ((("a", "noop"),), "c"),
+                                         ((("a", "noop"), ("c", "noop")), "d")])
+        book.learn(record, 100)
+        book.learn(record, 100)
+        self.assertEqual(book.lookup(GAME, "x", [["a", "noop"]]), "c")
+        self.assertEqual(book.lookup(GAME, "x", (("a", "noop"), ("c", "noop"))), None)
+        self.assertEqual(len(book), 2)
+        # Lookups beyond the maximum depth don't count
+        self.assertEqual((book.hits, book.misses), (2, 3))
+        self.assertEqual(book.stats()["hit_rate"], 2.0 / 5)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "book.json")
+            book = OpeningBook()
+            book.add(GAME, "x", (), "(mark 1 1)", 100)
+            book.add(GAME, "x", ((None, ("(obs 1)",)),), "noop", 50)
+            book.save(path)
+            loaded = OpeningBook.load(path)
+            self.assertEqual(loaded.lookup(GAME, "x", ()), "(mark 1 1)")
+            self.assertEqual(loaded.lookup(GAME, "x", ((None, ("(obs 1)",)),)), "noop")
+            self.assertEqual(len(loaded), 2)
+        finally:
+            shutil.rmtree(directory)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
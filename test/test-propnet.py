@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import os
+import random
+import unittest
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ggputils.gdl import KnowledgeBase
+from ggputils.reasoner import StateMachine
+from ggputils.propnet import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+def load_game(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games", name)
+    with open(path) as f: return KnowledgeBase.from_gdl(f.read())
+
+#---------------------------------------------------------------------------------
+# Unit test class. The propnet is cross checked against the reasoner.
+#---------------------------------------------------------------------------------
+@unittest.skipIf(np is None, "NumPy is not installed")
+class PropNetTest(unittest.TestCase):
+
+    def _cross_check(self, kb, rollouts=20):
+        sm = StateMachine(kb)
+        pn = PropNetStateMachine(kb)
+        rng = random.Random(0)
+        for i in range(rollouts):
+            state = sm.initial_state()
+            self.assertEqual(pn.initial_state(), state)
+            while True:
+                self.assertEqual(pn.is_terminal(state), sm.is_terminal(state))
+                self.assertEqual(pn.goals(state), sm.goals(state))
+                if sm.is_terminal(state): break
+                legal = sm.legal_joint_moves(state)
+                self.assertEqual(pn.legal_joint_moves(state), legal)
+                joint = [rng.choice(moves) for moves in legal]
+                nstate = sm.next_state(state, joint)
+                self.assertEqual(pn.next_state(state, joint), nstate)
+                state = nstate
+        return pn
+
+    def test_tictactoe(self):
+        pn = self._cross_check(load_game("tictactoe.kif"))
+        self.assertEqual(len(pn.propnet.base), 29)
+        self.assertEqual(len(pn.propnet.inputs), 20)
+
+    def test_connectfour(self):
+        self._cross_check(load_game("connectfour.kif"), rollouts=10)
+
+    def test_recursion_and_negation(self):
+        gdl = """(role r) (init (edge a b)) (init (edge b c)) (init (edge c d))
+                 (node a) (node b) (node c) (node d)
+                 (<= (reach ?x ?y) (true (edge ?x ?y)))
+                 (<= (reach ?x ?z) (reach ?x ?y) (true (edge ?y ?z)))
+                 (<= (unreached ?x ?y) (node ?x) (node ?y) (not (reach ?x ?y)))
+                 (<= (legal r (link ?x ?y)) (unreached ?x ?y) (distinct ?x ?y))
+                 (<= (next (edge ?x ?y)) (true (edge ?x ?y)))
+                 (<= (next (edge ?x ?y)) (does r (link ?x ?y)))
+                 (<= terminal (not (unreached a a)))"""
+        self._cross_check(KnowledgeBase.from_gdl(gdl))
+
+    def test_sees(self):
+        gdl = """(role r) (role random) (init (secret 1))
+                 (<= (legal random (set ?x)) (val ?x)) (<= (legal r noop))
+                 (<= (sees r (hint ?x)) (does random (set ?x)) (true (secret ?x)))
+                 (<= (next (secret ?x)) (true (secret ?x))) (val 1) (val 2)"""
+        pn = PropNetStateMachine(KnowledgeBase.from_gdl(gdl))
+        state = pn.initial_state()
+        self.assertEqual(pn.sees(state, ["noop", "(set 1)"], "r"), [("hint", "1")])
+        self.assertEqual(pn.sees(state, ["noop", "(set 2)"], "r"), [])
+
+    def test_batch(self):
+        pn = PropNetStateMachine(load_game("tictactoe.kif"))
+        state = pn.initial_state()
+        states = pn.batch([state, pn.next_state(state, ["(mark 1 1)", "noop"])])
+        self.assertEqual(states.shape, (29, 2))
+        self.assertEqual(list(pn.terminal_batch(states)), [False, False])
+
+        goals = pn.random_rollouts(state, 200, np.random.RandomState(0))
+        self.assertEqual(goals.shape, (2, 200))
+        for (x, o) in goals.T: self.assertTrue(sorted([x, o]) in [[0, 100], [50, 50]])
+
+    def test_too_large(self):
+        self.assertRaises(ValueError, PropNet, load_game("connectfour.kif"), 10)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
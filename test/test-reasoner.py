@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import os
+import random
+import unittest
+import logging
+
+from ggputils.gdl import GDL, KnowledgeBase
+from ggputils.reasoner import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+def load_game(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games", name)
+    with open(path) as f: return KnowledgeBase.from_gdl(f.read())
+
+def play(sm, state, moves):
+    for joint in moves: state = sm.next_state(state, joint)
+    return state
+
+# xplayer wins with the top row
+TICTACTOE_XWINS = [["(mark 1 1)", "noop"], ["noop", "(mark 2 2)"],
+                   ["(mark 1 2)", "noop"], ["noop", "(mark 3 3)"],
+                   ["(mark 1 3)", "noop"]]
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class ReasonerTest(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(to_term("noop"), "noop")
+        self.assertEqual(to_term("(mark 1 (f 2))"), ("mark", "1", ("f", "2")))
+        self.assertEqual(to_term(["mark", "1", "2"]), ("mark", "1", "2"))
+        self.assertEqual(term_to_sexp(("mark", "1", ("f", "2"))), "(mark 1 (f 2))")
+
+    def test_tictactoe(self):
+        sm = StateMachine(load_game("tictactoe.kif"))
+        state = sm.initial_state()
+        self.assertEqual(len(state), 10)
+        self.assertTrue(("control", "xplayer") in state)
+        self.assertEqual(len(sm.legal_moves(state, "xplayer")), 9)
+        self.assertEqual(sm.legal_moves(state, "oplayer"), ["noop"])
+        self.assertTrue(sm.is_legal(state, "xplayer", "(mark 2 2)"))
+        self.assertFalse(sm.is_legal(state, "oplayer", "(mark 2 2)"))
+        self.assertFalse(sm.is_terminal(state))
+
+        state = play(sm, state, TICTACTOE_XWINS[:1])
+        self.assertTrue(("cell", "1", "1", "x") in state)
+        self.assertEqual(len(sm.legal_moves(state, "oplayer")), 8)
+
+        state = play(sm, state, TICTACTOE_XWINS[1:])
+        self.assertTrue(sm.is_terminal(state))
+        self.assertEqual(sm.goals(state), [100, 0])
+
+        # Dictionary joint moves and random rollouts
+        state = sm.next_state(sm.initial_state(), {"xplayer": "(mark 2 2)", "oplayer": "noop"})
+        self.assertTrue(("cell", "2", "2", "x") in state)
+        rng = random.Random(0)
+        for i in range(20):
+            final = sm.random_rollout(state, rng)
+            self.assertTrue(sm.is_terminal(final))
+            self.assertTrue(sorted(sm.goals(final)) in [[0, 100], [50, 50]])
+
+    def test_connectfour(self):
+        sm = StateMachine(load_game("connectfour.kif"))
+        state = sm.initial_state()
+        for i in range(3):
+            state = play(sm, state, [["(drop 1)", "noop"], ["noop", "(drop 2)"]])
+        self.assertFalse(sm.is_terminal(state))
+        state = play(sm, state, [["(drop 1)", "noop"]])
+        self.assertTrue(sm.is_terminal(state))
+        self.assertEqual(sm.goals(state), [100, 0])
+
+    def test_recursion_and_negation(self):
+        gdl = """(role r) (init (edge a b)) (init (edge b c)) (init (edge c d))
+                 (node a) (node b) (node c) (node d)
+                 (<= (reach ?x ?y) (true (edge ?x ?y)))
+                 (<= (reach ?x ?z) (reach ?x ?y) (true (edge ?y ?z)))
+                 (<= (unreached ?x ?y) (node ?x) (node ?y) (not (reach ?x ?y)))
+                 (<= (legal r (link ?x ?y)) (unreached ?x ?y) (distinct ?x ?y))
+                 (<= (next (edge ?x ?y)) (true (edge ?x ?y)))
+                 (<= (next (edge ?x ?y)) (does r (link ?x ?y)))
+                 (<= terminal (not (unreached a a)))"""
+        sm = StateMachine(KnowledgeBase.from_gdl(gdl))
+        state = sm.initial_state()
+        legal = sm.legal_moves(state, "r")
+        self.assertEqual(len(legal), 16 - 6 - 4)
+        self.assertFalse(("link", "a", "d") in legal)
+        self.assertTrue(("link", "d", "a") in legal)
+        self.assertFalse(sm.is_terminal(state))
+        state = sm.next_state(state, ["(link d a)"])
+        self.assertTrue(sm.is_terminal(state))
+        self.assertEqual(sm.legal_moves(state, "r"), [])
+        self.assertEqual(sm.goal(state, "r"), None)
+
+    def test_sees(self):
+        gdl = """(role r) (role random) (init (secret 1))
+                 (<= (legal random (set ?x)) (val ?x)) (<= (legal r noop))
+                 (<= (sees r (hint ?x)) (does random (set ?x)) (true (secret ?x)))
+                 (<= (next (secret ?x)) (true (secret ?x))) (val 1) (val 2)"""
+        sm = StateMachine(KnowledgeBase.from_gdl(gdl))
+        state = sm.initial_state()
+        self.assertEqual(sm.sees(state, ["noop", "(set 1)"], "r"), [("hint", "1")])
+        self.assertEqual(sm.sees(state, ["noop", "(set 2)"], "r"), [])
+
+    def test_unsafe_rule(self):
+        gdl = "(role r) (<= (legal r ?x) (not (foo ?x)))"
+        self.assertRaises(ValueError, StateMachine, KnowledgeBase.from_gdl(gdl))
+
+    def test_state_tracker(self):
+        tracker = StateTracker()
+        tracker.on_start(None, "m1", "xplayer", None, 10, kb=load_game("tictactoe.kif"))
+        self.assertEqual(len(tracker.legal_moves()), 9)
+        tracker.on_update({"xplayer": "(mark 1 1)", "oplayer": "noop"})
+        tracker.on_update({"xplayer": "noop", "oplayer": ["mark", "2", "2"]})
+        self.assertTrue(("cell", "2", "2", "o") in tracker.state)
+        self.assertEqual(len(tracker.legal_moves()), 7)
+        tracker.on_clear()
+        self.assertEqual(tracker.state, None)
+
+        # The knowledge base is taken from a GDL object's shared view
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games", "tictactoe.kif")
+        with open(path) as f: gdl = GDL(f.read())
+        tracker.on_start(None, "m2", "xplayer", gdl, 10)
+        self.assertTrue(tracker.machine.kb is gdl.kb)
+        self.assertEqual(len(tracker.legal_moves()), 9)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
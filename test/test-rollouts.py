@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import os
+import time
+import unittest
+import logging
+
+import ggputils.shared
+
+from ggputils.utils import Timeout
+from ggputils.rollouts import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+# A picklable simulate function: the value of a move is around context * move
+def simulate(context, move, rng):
+    time.sleep(0.001)
+    return context * move + rng.random()
+
+# The context is (shared game, scale). The value is 1 if the game was already
+# attached before the first simulation.
+def shared_simulate(context, move, rng):
+    (game, scale) = context
+    attached = 1.0 if game.path in ggputils.shared._attached else 0.0
+    return attached + scale * game.get()[move]
+
+def failing_simulate(context, move, rng):
+    return move / context
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class RolloutExecutorTest(unittest.TestCase):
+
+    def _check(self, executor):
+        start = time.time()
+        stats = executor.run(Timeout(start, 1.0), 10, [3, 1, 2])
+        elapsed = time.time() - start
+        self.assertTrue(elapsed < 1.0)
+        self.assertTrue(elapsed > 0.5)
+        self.assertTrue(stats.simulations > 50)
+        self.assertTrue(all(c > 0 for c in stats.counts))
+        self.assertEqual(stats.best(), 0)
+        self.assertTrue(30.0 <= stats.mean(0) <= 31.0)
+        return stats
+
+    def test_in_process(self):
+        self._check(RolloutExecutor(simulate, processes=0, margin=0.2))
+
+    def test_pool(self):
+        with RolloutExecutor(simulate, processes=2, margin=0.2) as executor:
+            self.assertEqual(executor.processes, 2)
+            single = self._check(RolloutExecutor(simulate, processes=0, margin=0.2))
+            stats = self._check(executor)
+            self.assertTrue(stats.simulations > 1.5 * single.simulations)
+
+            # The pool is reused and the statistics reset between runs
+            again = executor.run(Timeout(time.time(), 0.4), 1, [5])
+            self.assertEqual(again.best(), 0)
+            self.assertTrue(5.0 <= again.mean(0) <= 6.0)
+            self.assertTrue(again.simulations < stats.simulations)
+
+    def test_publish(self):
+        game = dict((i, float(i)) for i in range(10000))
+        with RolloutExecutor(shared_simulate, processes=2, margin=0.2) as executor:
+            shared = executor.publish(game, Timeout(time.time(), 5.0))
+            self.assertTrue(os.path.exists(shared.path))
+            stats = executor.run(Timeout(time.time(), 0.5), (shared, 0.0), [3, 1])
+            self.assertTrue(stats.simulations > 100)
+            self.assertEqual(stats.means(), [1.0, 1.0])
+            stats = executor.run(Timeout(time.time(), 0.5), (shared, 1.0), [3, 1])
+            self.assertEqual(stats.best(), 0)
+            self.assertEqual(stats.means(), [4.0, 2.0])
+
+            # Released objects are forgotten by the workers
+            executor.release(shared)
+            self.assertFalse(os.path.exists(shared.path))
+            other = executor.publish({1: 5.0})
+            stats = executor.run(Timeout(time.time(), 0.5), (other, 1.0), [1])
+            self.assertEqual(stats.means(), [6.0])
+        self.assertFalse(os.path.exists(other.path))
+
+        executor = RolloutExecutor(shared_simulate, processes=0, margin=0.2)
+        shared = executor.publish(game)
+        stats = executor.run(Timeout(time.time(), 0.3), (shared, 1.0), [2])
+        self.assertEqual(stats.means(), [3.0])
+        executor.close()
+        self.assertFalse(os.path.exists(shared.path))
+
+    def test_simulate_error(self):
+        with RolloutExecutor(failing_simulate, processes=1, margin=0.2) as executor:
+            self.assertRaises(ZeroDivisionError, executor.run, Timeout(time.time(), 0.5), 0, [1])
+
+    def test_no_moves(self):
+        executor = RolloutExecutor(simulate, processes=0)
+        stats = executor.run(Timeout(time.time(), 1.0), 10, [])
+        self.assertEqual(stats.best(), None)
+        self.assertRaises(ValueError, RolloutExecutor(simulate, processes=0, max_moves=1).run,
+                          Timeout(time.time(), 1.0), 10, [1, 2])
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
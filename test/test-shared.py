@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import ggputils.shared
+from ggputils.shared import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class SharedObjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    # A copy of the handle as a worker process would see it
+    def _worker_copy(self, shared):
+        copy = pickle.loads(pickle.dumps(shared, pickle.HIGHEST_PROTOCOL))
+        ggputils.shared._attached.pop(copy.path, None)
+        return copy
+
+    def test_objects(self):
+        game = {"roles": ["white", "black"], "rules": [("init", i) for i in range(10000)]}
+        shared = publish(game, self._dir)
+        self.assertEqual(shared.kind, OBJECT)
+        self.assertTrue(os.path.dirname(shared.path) == self._dir)
+        self.assertTrue(shared.get() is game)
+
+        # The handle pickles as just the path
+        self.assertTrue(len(pickle.dumps(shared, pickle.HIGHEST_PROTOCOL)) < 200)
+        copy = self._worker_copy(shared)
+        self.assertEqual(copy.get(), game)
+        self.assertTrue(copy.get() is copy.get())
+
+        # Only the owner removes the file
+        copy.release()
+        self.assertFalse(shared.released)
+        shared.release()
+        self.assertTrue(shared.released)
+        self.assertRaises(IOError, self._worker_copy(shared).get)
+
+        # Objects whose files are removed are forgotten
+        copy = self._worker_copy(publish(game, self._dir))
+        copy.get()
+        os.remove(copy.path)
+        self.assertTrue(copy.path in ggputils.shared._attached)
+        prune()
+        self.assertFalse(copy.path in ggputils.shared._attached)
+
+    def test_bytes(self):
+        data = "0123456789" * 1000
+        copy = self._worker_copy(publish(data, self._dir))
+        self.assertEqual(copy.kind, BYTES)
+        self.assertEqual(copy.get()[:], data)
+        self.assertRaises(TypeError, copy.get().__setitem__, 0, "x")
+        self.assertEqual(self._worker_copy(publish("", self._dir)).get(), "")
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_arrays(self):
+        array = np.arange(1000, dtype=np.float32).reshape(10, 100)
+        copy = self._worker_copy(publish(array, self._dir))
+        self.assertEqual(copy.kind, ARRAY)
+        loaded = copy.get()
+        self.assertTrue(isinstance(loaded, np.memmap))
+        self.assertTrue(np.array_equal(loaded, array))
+        self.assertFalse(loaded.flags.writeable)
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
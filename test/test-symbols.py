@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import unittest
+import logging
+
+from ggputils.symbols import *
+from ggputils.observations import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+GDL = """
+(role xplayer) (role oplayer)
+(init (control xplayer))
+(<= (legal ?r (mark ?x ?y)) (true (cell ?x ?y b)) (true (control ?r)))
+(<= (legal xplayer noop) (true (control oplayer)))
+(input oplayer noop)
+(base (control xplayer)) (base (control oplayer))
+(<= (sees ?r (played ?m)) (does ?r ?m))
+(<= (sees xplayer (turn over)) (true (control oplayer)))
+(<= (next (control oplayer)) (true (control xplayer)))
+"""
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class SymbolTableTest(unittest.TestCase):
+
+    def test_symbol_table(self):
+        table = SymbolTable(["noop"])
+        self.assertEqual(table.intern("noop"), 0)
+        self.assertEqual(table.intern("(mark 1 2)"), 1)
+        self.assertEqual(table.intern(" ( mark  1\n2 ) "), 1)
+        self.assertEqual(table.intern(["mark", "1", "2"]), 1)
+        self.assertEqual(table.intern("(mark(f 1) 2)"), 2)
+        self.assertEqual(table.symbol(2), "(mark (f 1) 2)")
+        self.assertEqual(table.get("(mark 3 3)"), None)
+        self.assertFalse("(mark 3 3)" in table)
+        self.assertTrue("(mark  1 2)" in table)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.encode(["noop", "(mark 1 2)", "(mark 3 3)"]), (0, 1, 3))
+        self.assertEqual(table.decode((3, 0)), ["(mark 3 3)", "noop"])
+        self.assertRaises(IndexError, table.symbol, -1)
+        self.assertRaises(IndexError, table.symbol, 4)
+
+    def test_match_symbols(self):
+        symbols = MatchSymbols.from_gdl(GDL)
+        self.assertEqual(symbols.actions.symbols, ["noop"])
+        self.assertEqual(symbols.observations.symbols, ["(turn over)"])
+        self.assertEqual(symbols.fluents.symbols, ["(control xplayer)", "(control oplayer)"])
+
+class ObservationEncoderTest(unittest.TestCase):
+
+    def test_encoding(self):
+        encoder = ObservationEncoder(SymbolTable(["(one)", "(two)"]))
+        ids = encoder.to_ids(["(three)", "(one)", "(three)"])
+        self.assertEqual(ids.dtype, np.int32)
+        self.assertEqual(list(ids), [0, 2])
+        self.assertEqual(len(encoder), 3)
+        bits = encoder.to_bits(["(two)"], 5)
+        self.assertEqual(list(bits), [False, True, False, False, False])
+        self.assertEqual(list(bits_to_ids(bits)), [1])
+        self.assertEqual(encoder.decode_ids(ids), ["(one)", "(three)"])
+        self.assertEqual(encoder.decode_bits(bits), ["(two)"])
+
+    def test_set_operations(self):
+        a = to_id_array([5, 1, 3])
+        b = to_id_array([3, 4])
+        self.assertEqual(list(ids_union(a, b)), [1, 3, 4, 5])
+        self.assertEqual(list(ids_intersection(a, b)), [3])
+        self.assertEqual(list(ids_difference(a, b)), [1, 5])
+        self.assertTrue(ids_issubset(to_id_array([1, 5]), a))
+        self.assertFalse(ids_issubset(b, a))
+
+        x = np.array([True, False, True])
+        y = np.array([True, True])
+        self.assertEqual(list(bits_union(x, y)), [True, True, True])
+        self.assertEqual(list(bits_intersection(x, y)), [True, False, False])
+        self.assertEqual(list(bits_difference(x, y)), [False, False, True])
+        self.assertTrue(bits_issubset(y[:1], x))
+        self.assertFalse(bits_issubset(y, x))
+
+    def test_belief_filtering(self):
+        encoder = ObservationEncoder()
+        predicted = encoder.stack_bits([["(a)", "(b)"], ["(a)"], [], ["(b)", "(c)"]])
+        self.assertEqual(predicted.shape, (4, 3))
+        actual = encoder.to_bits(["(a)"])
+        self.assertEqual(list(consistent_rows(predicted, actual)), [False, True, False, False])
+        self.assertEqual(list(superset_rows(predicted, actual)), [True, True, False, False])
+        self.assertEqual(list(subset_rows(predicted, actual)), [False, True, True, False])
+
+        # A new observation grows the vocabulary beyond the matrix width
+        actual = encoder.to_bits(["(b)", "(d)"])
+        self.assertEqual(list(superset_rows(predicted, actual)), [False, False, False, False])
+        self.assertEqual(list(subset_rows(predicted, encoder.to_bits(["(b)", "(c)", "(d)"]))),
+                         [False, False, True, True])
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import os
+import random
+import unittest
+import logging
+
+from ggputils.gdl import KnowledgeBase
+from ggputils.reasoner import StateMachine
+from ggputils.transposition import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+def load_game(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games", name)
+    with open(path) as f: return KnowledgeBase.from_gdl(f.read())
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class TranspositionTest(unittest.TestCase):
+
+    def test_zobrist(self):
+        sm = StateMachine(load_game("tictactoe.kif"))
+        hasher = ZobristHasher()
+        state = sm.initial_state()
+        h = hasher.hash(state)
+        self.assertEqual(h, ZobristHasher().hash(state))
+        rng = random.Random(0)
+        while not sm.is_terminal(state):
+            joint = [rng.choice(sm.legal_moves(state, r)) for r in sm.roles]
+            nstate = sm.next_state(state, joint)
+            h = hasher.update(h, state, nstate)
+            self.assertEqual(h, hasher.hash(nstate))
+            state = nstate
+
+        # Transpositions have the same hash
+        a = [["(mark 1 1)", "noop"], ["noop", "(mark 2 2)"], ["(mark 3 3)", "noop"]]
+        b = [["(mark 3 3)", "noop"], ["noop", "(mark 2 2)"], ["(mark 1 1)", "noop"]]
+        (sa, sb) = (sm.initial_state(), sm.initial_state())
+        for (ja, jb) in zip(a, b):
+            (sa, sb) = (sm.next_state(sa, ja), sm.next_state(sb, jb))
+        self.assertEqual(hasher.hash(sa), hasher.hash(sb))
+        self.assertEqual(hasher.update_delta(0, [1], [2, 3]), hasher.hash([1, 2, 3]))
+
+    def test_depth_preferred(self):
+        table = TranspositionTable(entries=4)
+        self.assertEqual(table.capacity, 4)
+        table.store(1, "a", depth=3)
+        self.assertEqual(table.lookup(1), "a")
+        self.assertEqual(table.lookup(1, min_depth=4), None)
+        self.assertFalse(table.store(5, "b", depth=2))
+        self.assertEqual(table.lookup(5), None)
+        self.assertTrue(table.store(5, "b", depth=3))
+        self.assertEqual(table.lookup(1, "none"), "none")
+        self.assertEqual(table.lookup(5), "b")
+        self.assertTrue(table.store(5, "c", depth=0))
+        self.assertEqual(table.lookup(5), "c")
+        self.assertEqual(len(table), 1)
+        self.assertEqual((table.hits, table.misses), (3, 3))
+        self.assertEqual(table.hit_rate, 0.5)
+        self.assertEqual((table.replacements, table.rejected), (1, 1))
+
+    def test_always_replace(self):
+        table = TranspositionTable(entries=4, policy=ALWAYS_REPLACE)
+        table.store(1, "a", depth=3)
+        table.store(5, "b", depth=0)
+        self.assertFalse(1 in table)
+        self.assertTrue(5 in table)
+
+    def test_two_tier(self):
+        table = TranspositionTable(entries=4, policy=TWO_TIER)
+        self.assertEqual(table.capacity, 4)
+        table.store(1, "a", depth=3)
+        table.store(3, "b", depth=1)
+        table.store(5, "c", depth=0)
+        self.assertEqual([table.lookup(k) for k in (1, 3, 5)], ["a", None, "c"])
+        table.store(5, "d", depth=5)
+        self.assertEqual([table.lookup(k) for k in (1, 5)], ["a", "d"])
+        self.assertEqual(len(table), 2)
+        table.store(7, "e", depth=6)
+        self.assertEqual([table.lookup(k) for k in (1, 5, 7)], [None, "d", "e"])
+
+        table.clear()
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.lookup(7), None)
+        self.assertEqual(table.stats()["misses"], 1)
+        self.assertRaises(ValueError, TranspositionTable, 4, "unknown")
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
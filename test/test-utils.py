@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import unittest
+import logging
+
+from ggputils.utils import *
+
+#---------------------------------------------------------------------------------
+# Global variables
+#---------------------------------------------------------------------------------
+g_logger = logging.getLogger()
+
+#---------------------------------------------------------------------------------
+# Unit test class
+#---------------------------------------------------------------------------------
+class SexpTest(unittest.TestCase):
+
+    #------------------------------------------
+    # Test converting expressions to strings
+    #------------------------------------------
+    def test_exp_to_sexp(self):
+        self.assertEqual(exp_to_sexp("noop"), "noop")
+        self.assertEqual(exp_to_sexp(10), "10")
+        self.assertEqual(exp_to_sexp([]), "()")
+        self.assertEqual(exp_to_sexp(["mark", "1", "2"]), "(mark 1 2)")
+        self.assertEqual(exp_to_sexp([["a"], [], ["b", ["c", "d"]], "e"]),
+                         "((a) () (b (c d)) e)")
+
+        sexp = "((true (cell 1 1 x)) (true (control oplayer)) (does x noop))"
+        self.assertEqual(exp_to_sexp(parse_simple_sexp(sexp)), sexp)
+
+        # Invalid text atoms are rejected, even once a valid one is cached
+        self.assertRaises(ValueError, exp_to_sexp, "a b")
+        self.assertRaises(ValueError, exp_to_sexp, ["ok", ["a(b"]])
+        exp_to_sexp(["ok"])
+        self.assertRaises(ValueError, exp_to_sexp, ["ok", "a)"])
+
+    #------------------------------------------
+    # Deep terms must not hit the recursion limit
+    #------------------------------------------
+    def test_exp_to_sexp_deep(self):
+        depth = 20000
+        exp = "leaf"
+        for i in range(depth): exp = ["f", exp]
+        sexp = exp_to_sexp(exp)
+        self.assertEqual(sexp, "(f " * depth + "leaf" + ")" * depth)
+        self.assertEqual(exp_to_sexp(parse_simple_sexp(sexp)), sexp)
+
+    #------------------------------------------
+    # Test span based extraction
+    #------------------------------------------
+    def test_split_sexp(self):
+        self.assertEqual(split_sexp("()"), [])
+        self.assertEqual(split_sexp(" ( a  (b (c))\n d ) "), ["a", "(b (c))", "d"])
+        self.assertEqual(split_sexp_sequence("(a) NIL"), ["(a)", "NIL"])
+        self.assertEqual(split_sexp_sequence(""), [])
+        self.assertRaises(ValueError, split_sexp, "a b")
+        self.assertRaises(ValueError, split_sexp, "(a) (b)")
+        self.assertRaises(ValueError, split_sexp, "(a (b)")
+        self.assertRaises(ValueError, split_sexp_sequence, "a) (b")
+
+    def test_parse_actions_spans(self):
+        for sexp in ["NIL", "nil", "noop", "(noop (mark 1 2) (mark 3  4))", "()"]:
+            self.assertEqual([" ".join(a.split()) for a in parse_actions_sexp(sexp, True)],
+                             parse_actions_sexp(sexp))
+        self.assertEqual(parse_actions_sexp("((mark  1 2))", True), ["(mark  1 2)"])
+
+    def test_parse_actions_exp(self):
+        self.assertEqual(parse_actions_exp("NIL"), [])
+        self.assertEqual(parse_actions_exp("noop"), ["noop"])
+        self.assertEqual(parse_actions_exp("(noop (mark 1 2))"), ["noop", ["mark", "1", "2"]])
+
+    def test_parse_actionvalues_spans(self):
+        sexp = "((NOOP 50) ((MARK 3 4) 60))"
+        self.assertEqual(parse_actionvalues_sexp(sexp, True),
+                         [("NOOP", 50), ("(MARK 3 4)", 60)])
+        self.assertEqual(parse_actionvalues_sexp("()", True), [])
+        self.assertRaises(ValueError, parse_actionvalues_sexp, "(NOOP)", True)
+        self.assertRaises(ValueError, parse_actionvalues_sexp, "((NOOP 1 2))", True)
+        self.assertRaises(ValueError, parse_actionvalues_sexp, "((NOOP (1)))", True)
+
+class TimeoutTest(unittest.TestCase):
+
+    def test_timeout(self):
+        timeout = Timeout.from_monotonic(monotonic(), 10.0)
+        self.assertFalse(timeout.has_expired())
+        self.assertTrue(9.0 < timeout.remaining() <= 10.0)
+        timeout.reduce(5.0)
+        self.assertTrue(4.0 < timeout.remaining() <= 5.0)
+        clone = timeout.clone()
+        clone.extend(5.0)
+        self.assertTrue(9.0 < clone.remaining() <= 10.0)
+        self.assertTrue(4.0 < timeout.remaining() <= 5.0)
+        self.assertTrue(Timeout.from_monotonic(monotonic(), -1.0).has_expired())
+
+        # Wall clock timestamps are still accepted
+        timeout = Timeout(time.time() - 2.0, 10.0)
+        self.assertTrue(7.0 < timeout.remaining() <= 8.0)
+        self.assertTrue(Timeout(time.time(), -1.0).has_expired())
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "clock_gettime() on Linux")
+    def test_monotonic(self):
+        self.assertFalse(monotonic is time.time)
+        start = monotonic()
+        time.sleep(0.05)
+        self.assertTrue(0.04 < monotonic() - start < 0.5)
+
+    def test_cancel(self):
+        timeout = Timeout(time.time(), 10.0)
+        clone = timeout.clone()
+        grandclone = clone.clone()
+        self.assertFalse(timeout.cancelled or clone.cancelled)
+        clone.cancel()
+        self.assertTrue(clone.cancelled and grandclone.cancelled)
+        self.assertTrue(clone.has_expired())
+        self.assertEqual(clone.remaining(), 0.0)
+        self.assertFalse(timeout.cancelled)
+        timeout.cancel()
+        self.assertTrue(timeout.clone().cancelled)
+
+    def test_timer(self):
+        start = monotonic()
+        timeout = Timeout.from_monotonic(start, 0.2).start_timer()
+        clone = timeout.clone()
+        count = 0
+        while not timeout.cancelled: count += 1
+        elapsed = monotonic() - start
+        self.assertTrue(0.15 < elapsed < 1.0, elapsed)
+        self.assertTrue(clone.cancelled)
+
+        # A reduce() wakes the timer for the new deadline
+        start = monotonic()
+        timeout = Timeout.from_monotonic(start, 5.0).start_timer()
+        timeout.reduce(4.9)
+        while not timeout.cancelled: pass
+        self.assertTrue(monotonic() - start < 1.0)
+
+        # One thread serves all the timers
+        threads = os.listdir("/proc/self/task") if os.path.isdir("/proc/self/task") else []
+        timeouts = [Timeout(time.time(), 0.1 * i).start_timer() for i in range(10)]
+        if threads: self.assertEqual(len(os.listdir("/proc/self/task")), len(threads))
+        timeouts[-1].cancel()
+        while not timeouts[-2].cancelled: pass
+        self.assertTrue(all(t.cancelled for t in timeouts))
+
+    # The hot checks only read time.time() (the monotonic clock is slow on Python 2)
+    def test_expiry_cost(self):
+        import ggputils.utils as utils
+        timeout = Timeout(time.time(), 10.0)
+        expired = Timeout(time.time(), -1.0)
+        original = utils.monotonic
+        def fail(): raise AssertionError("monotonic() called")
+        utils.monotonic = fail
+        try:
+            self.assertFalse(timeout.has_expired())
+            self.assertTrue(9.0 < timeout.remaining() <= 10.0)
+            timeout.reduce(5.0)
+            self.assertTrue(4.0 < timeout.remaining() <= 5.0)
+            self.assertTrue(expired.has_expired())
+            self.assertEqual(expired.remaining(), 0.0)
+        finally:
+            utils.monotonic = original
+
+    # An error while cancelling a timeout does not stop the timer thread
+    def test_timer_error(self):
+        def fail(): raise RuntimeError("cancel failed")
+        bad = Timeout(time.time(), 0.05)
+        bad.cancel = fail
+        bad.start_timer()
+        logger = logging.getLogger("ggputils.utils")
+        logger.disabled = True
+        try:
+            time.sleep(0.2)
+            timeout = Timeout(time.time(), 0.05).start_timer()
+            start = time.time()
+            while not timeout.cancelled and time.time() - start < 2.0: time.sleep(0.01)
+            self.assertTrue(timeout.cancelled)
+        finally:
+            logger.disabled = False
+
+#-----------------------------
+# main
+#-----------------------------
+
+def main():
+    g_logger.setLevel(logging.DEBUG)
+    g_logger.addHandler(logging.StreamHandler())
+
+    unittest.main()
+
+if __name__ == '__main__':
+    main()